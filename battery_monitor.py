@@ -1,22 +1,37 @@
+import json
 import os
+import signal
+import subprocess
 import sys
+import tempfile
 import traceback
 
-import keyring
-
 script_loc_dir = os.path.split(os.path.realpath(__file__))[0]
 if script_loc_dir not in sys.path:
     sys.path.append(script_loc_dir)
 
-from scripts.bm_logging import controller, logger, console, new_log_file, flush_logs
+from scripts.bm_logging import controller, logger, console, printer, new_log_file, flush_logs
 
-from scripts.functions import send_notification, error_notification
+from scripts.functions import send_notification, error_notification, get_plug_password, get_emailer_password, prefetch_credentials
+from scripts.CredentialProvider import credentials
 from scripts.BatteryMonitor import BatteryMonitor, EmailNotifier
+from scripts.FleetAgent import FleetAgent
+from scripts.BatterySource import make_battery_source, set_battery_source
+from scripts.PowerEvents import make_power_event_source
+from scripts.ConfigReloader import ConfigReloader
+from scripts.ChargeCutoff import ChargeCutoff
+from scripts.HistoryStore import HistoryStore, HistoryRetention, HistoryStoreException
+from scripts.MemoryMonitor import MemoryMonitor
+from scripts.PidFile import PidFile, PidFileException, DEFAULT_PID_FILE_NAME
+from scripts.MetricsRegistry import metrics
+from scripts.PhaseTimer import phases, PhaseTimer
 from scripts.SmartPlugController import *
 from scripts.TimeString import TimeString
-from scripts.arg_parsing import parse_args, PLUG_CREDENTIAL_STORE, EMAIL_CREDENTIAL_STORE
+from scripts.arg_parsing import parse_args
+from scripts.unlock_signal import UNLOCK_FILE
 
-UNLOCK_FILE = ''
+# Set in the environment of a restarted monitor, to the file holding the state it continues from
+RESTART_STATE_ENV = 'BATTERY_MONITOR_RESTART_STATE'
 
 def started_notif(logFileAddr):
     send_notification('Headless Battery Monitor', 'Battery monitor started successfully and running in headless mode. Log file: {}'.format(os.path.split(logFileAddr)[1]))
@@ -24,8 +39,53 @@ def started_notif(logFileAddr):
 def testing():
     pass
 
+def restart_monitor(state: dict):
+    '''
+    Replaces this run of the monitor with a fresh one, started with the same arguments, that continues from `state`
+    '''
+    stateFile = os.path.join(tempfile.gettempdir(), f'battery_monitor_restart_{os.getpid()}.json')
+    with open(stateFile, 'w') as file:
+        json.dump(state, file)
+
+    env = dict(os.environ)
+    env[RESTART_STATE_ENV] = stateFile
+    cmd = [sys.executable] + sys.argv
+    logger.info(f'Restarting: {subprocess.list2cmdline(cmd)}')
+    flush_logs()
+
+    if sys.platform == 'win32':
+        # exec on Windows starts a new process anyway, and does not quote arguments with spaces
+        # the new process runs outside Task Scheduler's task, bm.py stops it through its pid file
+        subprocess.Popen(cmd, env=env, close_fds=True)
+        return
+    os.execve(sys.executable, cmd, env)
+
+def take_restart_state():
+    '''
+    Returns the state handed over by the monitor that restarted into this one, None if this is not a restart
+    '''
+    stateFile = os.environ.pop(RESTART_STATE_ENV, None)
+    if stateFile is None:
+        return None
+    try:
+        with open(stateFile, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError) as e:
+        logger.warning(f'Could not read the state of the previous run: {e}')
+        return None
+    finally:
+        try:
+            os.remove(stateFile)
+        except OSError:
+            pass
+
+def stop_on_signal(signum, frame):
+    # unwinds the main thread like Ctrl+C in headless mode, so the monitor stops its background work and releases its pid file
+    raise SystemExit(0)
+
 def main():
     headless = (sys.stdout is None)
+    pidFile = None
     try:
         # Parse arguments
         args = parse_args()
@@ -68,30 +128,86 @@ def main():
             testing()
             return 0
 
+        # Credentials are checked by checkArgs and used below, look them up once and at the same time
+        prefetch_credentials(args.plugAccUsername, args.emailUsername)
+
         # Check argument logic
         args.checkArgs()
 
+        # only one monitor runs at a time, and bm.py reads whether it is running from the lock on this file
+        pidPath = args.pidFile
+        if pidPath is None and not args.noLogFile:
+            pidPath = os.path.join(args.logDir, DEFAULT_PID_FILE_NAME)
+        if pidPath is not None:
+            pidFile = PidFile(pidPath)
+            pidFile.acquire()
+        signal.signal(signal.SIGTERM, stop_on_signal)
+
+        batterySource = make_battery_source(args.batterySource)
+        set_battery_source(batterySource)
+
         plugCreds = None
         if args.plugAccUsername is not None:
-            plugPass = keyring.get_password(PLUG_CREDENTIAL_STORE, args.plugAccUsername)
+            plugPass = get_plug_password(args.plugAccUsername)
             plugCreds = (args.plugAccUsername, plugPass)
 
         emailCreds = None
         if args.emailUsername is not None:
-            emailPass = keyring.get_password(EMAIL_CREDENTIAL_STORE, args.emailUsername)
+            emailPass = get_emailer_password(args.emailUsername)
             emailCreds = (args.emailUsername, emailPass)
 
+        logger.info(f'Credential Lookups: {credentials.lookups} ({credentials.hits} answered from memory)')
+
         smartPlug = SmartPlugController(
             args.plugIP,
             args.plugName,
             args.wifi,
             tplink_creds=plugCreds,
-            TPLinkAvail=plugCreds is not None)
+            TPLinkAvail=plugCreds is not None,
+            plug_port=args.plugPort)
 
         emailer = None
         if emailCreds is not None and args.emailRecipient is not None:
             emailer = EmailNotifier(emailCreds, args.emailRecipient)
 
+        agent = None
+        if args.collectorUrl is not None:
+            # buffer undelivered records next to the logs so they survive restarts
+            bufferFile = None if args.noLogFile else os.path.join(args.logDir, 'fleet_buffer.jsonl')
+            agent = FleetAgent(args.collectorUrl, bufferFile=bufferFile, logger=logger)
+
+        powerEvents = make_power_event_source() if args.powerEvents else None
+
+        if args.phaseBudgets is not None:
+            phases.setBudgets(PhaseTimer.parseBudgets(args.phaseBudgets))
+
+        chargeCutoff = ChargeCutoff(smartPlug, logger=logger) if args.plugTimer else None
+
+        history = None
+        if args.historyDB is not None:
+            retention = HistoryRetention(keepRawSecs=TimeString.parse(args.historyKeepRaw), keepMinutesSecs=TimeString.parse(args.historyKeepMinutes),
+                                         keepEventsSecs=TimeString.parse(args.historyKeepEvents))
+            history = HistoryStore(args.historyDB, retention=retention, logger=logger)
+            try:
+                history.start()
+            except HistoryStoreException as e:
+                # the monitor works without its history
+                logger.error(e.message)
+                history = None
+
+        memoryMonitor = None
+        if args.memoryDiagnostics or args.rssCeiling is not None:
+            memoryMonitor = MemoryMonitor(
+                periodSecs=TimeString.parse(args.memoryCheckPeriod),
+                trace=args.memoryDiagnostics,
+                rssCeilingBytes=None if args.rssCeiling is None else args.rssCeiling * 1024 * 1024,
+                logger=logger)
+
+        configReloader = None
+        if args.configJSON is not None:
+            configReloader = ConfigReloader(args, sys.argv[1:], pollSecs=TimeString.parse(args.configPoll), logger=logger)
+            configReloader.installSignalHandler()
+
         bm = BatteryMonitor(
             args.batteryMin,
             args.batteryMax,
@@ -101,9 +217,23 @@ def main():
             args.maxAttempts,
             smartPlug,
             emailer,
-            headless=headless
+            headless=headless,
+            agent=agent,
+            powerEvents=powerEvents,
+            countdownRedrawSecs=TimeString.parse(args.countdownRedraw),
+            metricsFile=args.metricsFile,
+            configReloader=configReloader,
+            chargeCutoff=chargeCutoff,
+            loadModel=not args.noLoadModel,
+            watchdogPeriodSecs=TimeString.parse(args.watchdogPeriod),
+            history=history,
+            memoryMonitor=memoryMonitor
         )
 
+        restartState = take_restart_state()
+        if restartState is not None:
+            bm.restoreState(restartState)
+
         logger.info('Script Started')
 
         if headless:
@@ -111,6 +241,9 @@ def main():
             logger.info('Running in headless mode')
 
         logger.info(f'min={args.batteryMin}%, max={args.batteryMax}%, grain={args.grain}%, adaptivity={args.adaptivity} alertEvery={TimeString.parse(args.alertPeriod)}s, maxAttempts={args.maxAttempts}')
+        logger.info(f'Battery Source: {batterySource.name}')
+        if powerEvents is not None:
+            logger.info(f'Power Events: {powerEvents.name}')
         logger.info(f'Plug Info: Network="{smartPlug.home_network}", Plug IP={smartPlug.plug_ip}, Plug Name="{smartPlug.plug_name}"')
 
         if plugCreds is not None:
@@ -121,11 +254,57 @@ def main():
         if emailer is not None:
             logger.info(f'Email Alerts To: {emailer.recipient}')
 
+        if args.noLoadModel:
+            logger.info('Load Model: disabled, predictions use the overall battery rate')
+
+        if bm.sleepController.watchdog is not None:
+            logger.info(f'Sleep Watchdog: checking the battery every {TimeString.make(bm.sleepController.watchdog.periodSecs)} while discharging')
+
+        if history is not None:
+            logger.info(f'Recording history to: {args.historyDB}')
+
+        if restartState is not None:
+            logger.info(f'Restarted by the memory ceiling (restart {bm.restarts}), continuing from the learned predictions')
+
+        if memoryMonitor is not None:
+            ceiling = '' if args.rssCeiling is None else f', restarting above {args.rssCeiling} MB'
+            tracing = ' with allocation tracing' if memoryMonitor.trace else ''
+            logger.info(f'Memory Checks: every {TimeString.make(memoryMonitor.periodSecs)}{tracing}{ceiling}')
+
+        if chargeCutoff is not None:
+            logger.info('Charge Cut-off Timer: plug timer is armed while charging to switch it off at the maximum')
+
+        if configReloader is not None:
+            logger.info(f'Watching config file for changes every {TimeString.make(configReloader.pollSecs)}: {args.configJSON}')
+
+        if args.metricsFile is not None:
+            logger.info(f'Writing metrics to: {args.metricsFile}')
+
+        if args.metricsPort is not None:
+            metrics.serve(args.metricsPort)
+            logger.info(f'Serving metrics at: http://127.0.0.1:{args.metricsPort}/metrics')
+
+        if agent is not None:
+            logger.info(f'Reporting to fleet collector: {args.collectorUrl} as "{agent.hostName}"')
+            agent.start()
+
         flush_logs()
 
         bm.monitorBattery()
+        if bm.restartState is not None:
+            metrics.stopServing()
+            if pidFile is not None:
+                # the new run takes it again
+                pidFile.release()
+            restart_monitor(bm.restartState)
+            return 0
         logger.info('Script Ended')
 
+    except PidFileException as e:
+        # another monitor is running, leave it be
+        printer.error(e.message)
+        return 1
+
     except Exception as e:
         logger.error('Script Exception: "{}"'.format(e))
         if headless:
@@ -137,6 +316,10 @@ def main():
 
         return 1
 
+    finally:
+        if pidFile is not None:
+            pidFile.release()
+
     return 0
 
 
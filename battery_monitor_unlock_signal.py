@@ -4,7 +4,7 @@ script_loc_dir = os.path.split(os.path.realpath(__file__))[0]
 if script_loc_dir not in sys.path:
     sys.path.append(script_loc_dir)
 
-from battery_monitor import UNLOCK_FILE
+from scripts.unlock_signal import UNLOCK_FILE
 
 def main():
     """
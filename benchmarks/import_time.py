@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+"""
+Import time budgets for the monitor and its helper scripts.
+
+battery_monitor.py is started at logon and the helper scripts are short lived, so what they import before doing
+any work matters. Each entry point is imported in a fresh interpreter with `python -X importtime` and fails the run if:
+- its import takes longer than its budget (the fastest of several runs is used),
+- it imports one of the heavy dependencies that should only be loaded on first use,
+- importing it creates any files.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py -budget-scale 2    # slower machine
+"""
+
+repo_dir = os.path.realpath(os.path.join(os.path.split(os.path.realpath(__file__))[0], '..'))
+
+# Budgets in milliseconds for the import of each entry point, excluding interpreter start up
+IMPORT_BUDGETS_MS = {
+    'battery_monitor': 100,
+    'battery_monitor_unlock_signal': 10,
+    'hibernate_off_plug': 60,
+    'test_smart_plug': 60,
+    'bm': 40,
+}
+
+# Modules that must only be imported when they are used
+LAZY_MODULES = (
+    'kasa',
+    'keyring',
+    'psutil',
+    'winotify',
+    'winsound',
+    'smtplib',
+    'email.mime',
+    'asyncio',
+    'http.server',
+    'urllib.request',
+    'sqlite3',
+    'tracemalloc',
+)
+
+PROBE = '''
+import json, sys
+import {module}
+print(json.dumps(sorted(m for m in {lazy!r} if m in sys.modules)))
+'''
+
+
+def import_time_ms(module: str, env: dict, cwd: str) -> float:
+    '''
+    Returns the cumulative import time of `module` in ms as reported by `python -X importtime`
+    '''
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         cwd=cwd, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise Exception(f'Importing {module} failed:\n{out.stderr}')
+
+    for line in reversed(out.stderr.splitlines()):
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000
+    raise Exception(f'No import time reported for {module}')
+
+
+def lazy_violations(module: str, env: dict, cwd: str) -> list:
+    out = subprocess.run([sys.executable, '-c', PROBE.format(module=module, lazy=LAZY_MODULES)],
+                         cwd=cwd, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise Exception(f'Importing {module} failed:\n{out.stderr}')
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    argParser = argparse.ArgumentParser(description='Import time budgets for the battery monitor entry points')
+    argParser.add_argument('-only', nargs='+', metavar='<module>', choices=list(IMPORT_BUDGETS_MS), help='Only check these entry points')
+    argParser.add_argument('-repeats', type=int, default=7, help='Imports timed per entry point, the fastest is used. default: 7')
+    argParser.add_argument('-budget-scale', type=float, default=1.0, help='Multiply every budget by this, for slower machines. default: 1')
+    argParser.add_argument('-save', metavar='<file path>', help='Save results as JSON to this file')
+    args = argParser.parse_args()
+
+    failures = 0
+    results = {}
+    names = args.only if args.only else list(IMPORT_BUDGETS_MS)
+
+    print(f'{"entry point":<32} {"import (ms)":>12} {"budget (ms)":>12}')
+    for name in names:
+        # run from an empty directory with an empty home, anything written at import ends up there
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, PYTHONPATH=repo_dir, HOME=tmp, USERPROFILE=tmp, PYTHONDONTWRITEBYTECODE='1')
+
+            # warm up the file system cache and make sure bytecode is compiled before timing
+            subprocess.run([sys.executable, '-c', f'import {name}'], cwd=tmp, env=dict(env, PYTHONDONTWRITEBYTECODE=''), capture_output=True)
+
+            best = min(import_time_ms(name, env, tmp) for _ in range(args.repeats))
+            budget = IMPORT_BUDGETS_MS[name] * args.budget_scale
+            lazy = lazy_violations(name, env, tmp)
+            created = os.listdir(tmp)
+
+        problems = []
+        if best > budget:
+            problems.append('OVER BUDGET')
+        if lazy:
+            problems.append(f'imported {", ".join(lazy)}')
+        if created:
+            problems.append(f'created {", ".join(created)}')
+        failures += 1 if problems else 0
+
+        results[name] = {'import_ms': best, 'budget_ms': budget, 'lazy_violations': lazy, 'created_files': created}
+        print(f'{name:<32} {best:>12.1f} {budget:>12.0f}  {"; ".join(problems)}')
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results saved to {args.save}')
+
+    if failures:
+        print(f'\n{failures} entry point(s) failed their import budget')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+"""
+Microbenchmarks for the monitor's hot paths.
+
+Each benchmark is timed with timeit (auto-ranged loop count, several repeats) and results are saved as JSON
+so runs from different versions can be compared:
+
+    python benchmarks/run_benchmarks.py -save results/before.json
+    python benchmarks/run_benchmarks.py -save results/after.json -compare results/before.json
+    python benchmarks/run_benchmarks.py -compare results/before.json results/after.json
+"""
+
+repo_dir = os.path.realpath(os.path.join(os.path.split(os.path.realpath(__file__))[0], '..'))
+if repo_dir not in sys.path:
+    sys.path.append(repo_dir)
+
+BENCHMARKS = {}
+
+NETSH_OUTPUT = '''
+There is 1 interface on the system:
+
+    Name                   : Wi-Fi
+    Description            : Intel(R) Wi-Fi 6 AX201 160MHz
+    GUID                   : 01234567-89ab-cdef-0123-456789abcdef
+    Physical address       : 01:23:45:67:89:ab
+    State                  : connected
+    SSID                   : My Home Wifi
+    BSSID                  : 01:23:45:67:89:ac
+    Network type           : Infrastructure
+    Radio type             : 802.11ax
+    Authentication         : WPA2-Personal
+    Cipher                 : CCMP
+    Connection mode        : Profile
+    Channel                : 36
+    Receive rate (Mbps)    : 1201
+    Transmit rate (Mbps)   : 1201
+    Signal                 : 99%
+    Profile                : My Home Wifi
+
+    Hosted network status  : Not available
+'''
+
+CONFIG = {
+    "-plug-ip": "192.168.0.10",
+    "-plug-name": "Smart Plug",
+    "-home-wifi": "My Home Wifi",
+    "-min": 40,
+    "-max": 80,
+    "-grain": 5,
+    "-adaptivity": 0.9,
+    "-alert": "5m",
+    "-max-attempts": 20,
+    "-logdir": tempfile.gettempdir(),
+    "--headless": True,
+}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+# Each benchmark is a setup function returning the zero argument callable to time
+
+@benchmark('timestring_parse')
+def bench_timestring_parse():
+    from scripts.TimeString import TimeString
+    strs = ['30s', '1m 25s', '3h30s', '2h30m16s', '2hrs 3mins 2secs', '5 mins']
+    return lambda: [TimeString.parse(s) for s in strs]
+
+
+@benchmark('timestring_make')
+def bench_timestring_make():
+    from scripts.TimeString import TimeString
+    secs = [1, 59, 61, 3599, 3600, 3661, 86399, 12345]
+    return lambda: [TimeString.make(s) for s in secs]
+
+
+@benchmark('timestring_parse_many')
+def bench_timestring_parse_many():
+    from scripts.TimeString import TimeString
+    strs = ['30s', '1m 25s', '3h30s', '2h30m16s', '2hrs 3mins 2secs', '5 mins', '1d 2h', '1.5h'] * 125
+    return lambda: TimeString.parseMany(strs)
+
+
+@benchmark('timestring_make_many')
+def bench_timestring_make_many():
+    from scripts.TimeString import TimeString
+    secs = list(range(0, 100000, 100))
+    return lambda: TimeString.makeMany(secs)
+
+
+def make_sleep_controller():
+    from scripts.bm_logging import controller
+    from scripts.ScriptSleepController import ScriptSleepController
+    from scripts.SuspendClock import ClockInterval
+
+    # measure the prediction maths, not the log file
+    controller.setLoggingEnabled(False)
+
+    ssc = ScriptSleepController(25, 85, checkIntervalPercentage=5, headless=True, predAdaptivity=0.9)
+    ssc.prevPercent, ssc.curPercent = 70, 66
+    ssc.prevCharging, ssc.charging = False, False
+    ssc.sleepPeriod = 900
+    ssc.sampleInterval = ClockInterval(930, 930)
+    return ssc
+
+
+@benchmark('predict_sleep_period')
+def bench_predict_sleep_period():
+    ssc = make_sleep_controller()
+    return ssc.predictSleepPeriod
+
+
+@benchmark('get_next_sleep_period')
+def bench_get_next_sleep_period():
+    ssc = make_sleep_controller()
+    return ssc.getNextSleepPeriod
+
+
+@benchmark('logging_configure_loggers')
+def bench_configure_loggers():
+    from scripts.bm_logging import LoggingController
+    lc = LoggingController(os.path.join(tempfile.mkdtemp(), 'bench.log'))
+    lc.setHeadless(True)
+    return lc.configureLoggers
+
+
+@benchmark('logging_record_throughput')
+def bench_logging_records():
+    from scripts.bm_logging import LoggingController
+    lc = LoggingController(os.path.join(tempfile.mkdtemp(), 'bench.log'))
+    lc.setHeadless(True)
+    lc.setLoggingEnabled(True)
+    lc.setLoggingToFile(True)
+    logger = lc.getLogger()
+
+    def log_100():
+        for i in range(100):
+            logger.info('Calculated Prediction: %ds (Exponential Averaging with alpha=%.2f)', i, 0.9)
+    return log_100
+
+
+@benchmark('netsh_parse')
+def bench_netsh_parse():
+    from scripts.SmartPlugController import SmartPlugController
+    return lambda: SmartPlugController.parse_netsh_interfaces(NETSH_OUTPUT)
+
+
+def write_config():
+    fd, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as file:
+        json.dump(CONFIG, file)
+    return path
+
+
+@benchmark('load_config')
+def bench_load_config():
+    from scripts.arg_parsing import load_config
+    path = write_config()
+    load_config(path)
+    return lambda: load_config(path)
+
+
+@benchmark('compile_config')
+def bench_compile_config():
+    from scripts.arg_parsing import compile_config
+    return lambda: compile_config(CONFIG)
+
+
+@benchmark('parse_args')
+def bench_parse_args():
+    from scripts.arg_parsing import parse_args
+    path = write_config()
+    argv = ['-config', path]
+    return lambda: parse_args(argv)
+
+
+@benchmark('email_message_build')
+def bench_email_message():
+    from scripts.EmailBot import EmailBot
+    bot = EmailBot('smtp.example.com', 'bot@example.com', 'password')
+    body = 'Battery (24%) is near or below specified minimum (25%) and is not charging.\nManual assistance is required.'
+
+    def build():
+        return bot.makeMessage('Laptop Auto Battery Monitor - Low Battery Alert', body, 'me@example.com',
+                               ['me@example.com'], important=True).as_string()
+    return build
+
+
+def run_benchmark(fnc, repeats: int, minTime: float) -> dict:
+    timer = timeit.Timer(fnc)
+    loops, _ = timer.autorange()
+    # autorange aims for 0.2s, scale up to the requested time per repeat
+    loops = max(1, int(loops * max(1.0, minTime / 0.2)))
+    times = [t / loops for t in timer.repeat(repeat=repeats, number=loops)]
+    return {
+        'min_us': min(times) * 1E6,
+        'mean_us': statistics.mean(times) * 1E6,
+        'stdev_us': (statistics.stdev(times) if len(times) > 1 else 0.0) * 1E6,
+        'loops': loops,
+        'repeats': repeats,
+    }
+
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo_dir, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> int:
+    '''
+    Prints a comparison of the min times of two result sets, returns the number of regressions above `threshold`.
+    '''
+    regressions = 0
+    print(f'{"benchmark":<30} {"baseline (us)":>14} {"current (us)":>14} {"change":>9}')
+    for name, res in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print(f'{name:<30} {"-":>14} {res["min_us"]:>14.2f} {"new":>9}')
+            continue
+        change = (res['min_us'] - base['min_us']) / base['min_us']
+        flag = ''
+        if change > threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        print(f'{name:<30} {base["min_us"]:>14.2f} {res["min_us"]:>14.2f} {change * 100:>8.1f}%{flag}')
+    return regressions
+
+
+def main():
+    argParser = argparse.ArgumentParser(description='Microbenchmarks for the battery monitor')
+    argParser.add_argument('-only', nargs='+', metavar='<name>', choices=list(BENCHMARKS), help='Only run these benchmarks')
+    argParser.add_argument('-repeats', type=int, default=5, help='Timing repeats per benchmark, default: 5')
+    argParser.add_argument('-min-time', type=float, default=0.2, help='Seconds per repeat, default: 0.2')
+    argParser.add_argument('-save', metavar='<file path>', help='Save results as JSON to this file')
+    argParser.add_argument('-compare', nargs='+', metavar='<file path>',
+                           help='Baseline results to compare this run against, or two result files to compare without running')
+    argParser.add_argument('-threshold', type=float, default=0.20, help='Slowdown counted as a regression, default: 0.20 (20%%)')
+    args = argParser.parse_args()
+
+    if args.compare is not None and len(args.compare) == 2:
+        with open(args.compare[0], 'r') as file:
+            baseline = json.load(file)
+        with open(args.compare[1], 'r') as file:
+            current = json.load(file)
+        return 1 if compare(baseline, current, args.threshold) > 0 else 0
+
+    names = args.only if args.only else list(BENCHMARKS)
+    results = {}
+    for name in names:
+        res = run_benchmark(BENCHMARKS[name](), args.repeats, args.min_time)
+        results[name] = res
+        print(f'{name:<30} min {res["min_us"]:>10.2f}us  mean {res["mean_us"]:>10.2f}us  +- {res["stdev_us"]:.2f}us')
+
+    current = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': datetime.now().isoformat(timespec='seconds'),
+        },
+        'results': results,
+    }
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(current, file, indent=2)
+        print(f'Results saved to {args.save}')
+
+    if args.compare is not None:
+        with open(args.compare[0], 'r') as file:
+            baseline = json.load(file)
+        print('')
+        return 1 if compare(baseline, current, args.threshold) > 0 else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
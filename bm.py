@@ -1,84 +1,106 @@
 import sys
 import os
 import subprocess
+import json
 import glob
-import re
-from enum import Enum
-
-BMTASKNAME= "BatteryMonitor"
-LOGFILEDIR= r'C:\Users\omnic\OneDrive\Computer Collection\Battery Monitor\bm_logs'
-
-TASKSTATES = {
-    'ready'
+import time
+from datetime import datetime
+
+script_loc_dir = os.path.split(os.path.realpath(__file__))[0]
+if script_loc_dir not in sys.path:  sys.path.append(script_loc_dir)
+
+from scripts.PidFile import PidFile, DEFAULT_PID_FILE_NAME
+from scripts.ServiceBackend import TaskStates, ServiceException, SERVICE_BACKENDS, make_service_backend
+
+# bm.py's settings are read from this JSON file (or the one BM_CONFIG points to), see "bm.py" in the README
+BM_CONFIG_ENV = 'BM_CONFIG'
+DEFAULT_BM_CONFIG = os.path.join(script_loc_dir, 'bm_config.json')
+
+BM_CONFIG_DEFAULTS = {
+    # how the monitor runs in the background: taskscheduler, systemd or daemon
+    'backend': 'taskscheduler' if sys.platform == 'win32' else 'daemon',
+    # name of the Task Scheduler task or systemd unit
+    'task': 'BatteryMonitor',
+    # -logdir of the monitor
+    'logDir': None,
+    # pid file of the monitor, default: battery_monitor.pid in the log directory
+    'pidFile': None,
+    # daemon backend: the command that starts the monitor, or just its arguments to run battery_monitor.py with
+    'command': None,
+    'monitorArgs': None,
 }
 
-class TaskStates(Enum):
-    none = 0
-    stopped = 1
-    running = 2
-
-    @staticmethod
-    def stateToStr(state):
-        # Takes a task state enum and returns a string for it=
-
-        enumstr = {
-            str(TaskStates.none) : 'Uknown',
-            str(TaskStates.running) : 'Running',
-            str(TaskStates.stopped) : 'Stopped'
-        }
-
-        s = enumstr.get(str(state))
-
-        if s is not None: return s
-        return enumstr.get(str(TaskStates.none))
-
-    @staticmethod
-    def strToState(statusstr):
-        # takes status string returned from an schtasks query and turns it into a state
-        enumstates = {
-            'running': TaskStates.running,
-            'ready': TaskStates.stopped
-        }
-
-        state = enumstates.get(statusstr.lower())
-
-        if state is not None: return state
-        return TaskStates.none
-
-def bm_task(args: list, getoutput=False):
-    # C:\Windows\System32\schtasks.exe /run /tn "BatteryMonitor"
-    cmd = ['schtasks.exe', "/tn", BMTASKNAME]
-    cmd = cmd + args
-
-    if getoutput:
-        child = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = child.communicate()
-        return out, err
-    else:
-        child = subprocess.Popen(cmd)
-        child.communicate()
-
-def get_re_matched_groups(search_str, pattern):
-    res = re.search(pattern, search_str)
-    if res is None:
-        return []
-    else:
-        return list(res.groups())
+BMTASKNAME = BM_CONFIG_DEFAULTS['task']
+LOGFILEDIR = None
+SERVICE = None
+
+def load_bm_config(path: str = None) -> dict:
+    '''
+    Returns bm.py's settings from the config file at `path` (or BM_CONFIG, or bm_config.json next to this script),
+    with the defaults for anything it leaves out. A missing default config file is the same as an empty one.
+    '''
+    config = dict(BM_CONFIG_DEFAULTS)
+    path = path or os.environ.get(BM_CONFIG_ENV) or None
+    if path is None:
+        path = DEFAULT_BM_CONFIG
+        if not os.path.exists(path):
+            return config
+
+    try:
+        with open(path, 'r') as file:
+            values = json.load(file)
+    except (OSError, ValueError) as e:
+        raise ServiceException(f'Could not read bm config "{path}": {e}')
+
+    unknown = set(values) - set(BM_CONFIG_DEFAULTS)
+    if unknown:
+        raise ServiceException(f'Unknown setting(s) in bm config "{path}": {", ".join(sorted(unknown))}')
+    config.update(values)
+    return config
+
+def configure(config: dict):
+    '''
+    Sets up the task name, log directory and service backend from bm.py's settings
+    '''
+    global BMTASKNAME, LOGFILEDIR, SERVICE
+
+    if config['backend'] not in SERVICE_BACKENDS:
+        raise ServiceException(f'Unknown backend "{config["backend"]}", expected one of: {", ".join(SERVICE_BACKENDS)}')
+
+    BMTASKNAME = config['task']
+    LOGFILEDIR = config['logDir']
+
+    pidFile = config['pidFile']
+    if pidFile is None and LOGFILEDIR is not None:
+        pidFile = os.path.join(LOGFILEDIR, DEFAULT_PID_FILE_NAME)
+
+    command = config['command']
+    if command is None and config['monitorArgs'] is not None:
+        command = [sys.executable, os.path.join(script_loc_dir, 'battery_monitor.py')] + list(config['monitorArgs'])
+
+    SERVICE = make_service_backend(config['backend'], BMTASKNAME, PidFile(pidFile) if pidFile is not None else None,
+                                   command=command, cwd=script_loc_dir)
 
 def get_task_state():
-    child = subprocess.Popen(f'schtasks /query /tn "{BMTASKNAME}" /v /fo list | find "Status:"', shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = child.communicate()
-    output = out.decode('utf-8')
-    res = get_re_matched_groups(output, 'Status: *(.*)')[0].strip()
-    return TaskStates.strToState(res)
+    try:
+        return SERVICE.state()
+    except ServiceException as e:
+        print(e.message)
+        return TaskStates.none
 
-def start_bm(getoutput=False):
+def start_bm():
     if get_task_state() == TaskStates.running:
         print('Battery Monitor Task is already running')
         return
 
     print('Starting Battery Monitor task')
-    return bm_task(["/run"], getoutput=getoutput)
+    try:
+        out = SERVICE.start()
+    except ServiceException as e:
+        print(f'Could not start the task: {e.message}')
+        return
+    if out.strip():
+        print(out.strip())
 
 def stop_bm():
     if get_task_state() == TaskStates.stopped:
@@ -86,27 +108,43 @@ def stop_bm():
         return
 
     print('Stopping Battery Monitor task')
-    bm_task(["/end"])
+    try:
+        out = SERVICE.stop()
+    except ServiceException as e:
+        print(f'Could not stop the task: {e.message}')
+        return
+    if out.strip():
+        print(out.strip())
 
 def restart_bm():
     stop_bm()
+    # the monitor refuses to start while the old one still holds the pid file
+    if not SERVICE.waitForState(TaskStates.stopped):
+        print('Battery Monitor Task did not stop in time, not starting it again')
+        return
     start_bm()
 
 def bm_status():
     st = get_task_state()
-    print('Status: {}'.format(TaskStates.stateToStr(st)))
+    pid = SERVICE.pid() if st == TaskStates.running else None
+    print('Status: {}{}'.format(TaskStates.stateToStr(st), '' if pid is None else f' (pid {pid})'))
 
-    if st == TaskStates.running:
+    if st == TaskStates.running and LOGFILEDIR is not None:
         print('')
         show_latest_log(linecnt=5)
 
 def pause_bm():
-    child = subprocess.Popen(['C:\\Python310\\pythonw.exe', r'C:\\Users\\omnic\\local\\GitRepos\\python-battery-monitor\\bmsched.py', '3'], stdout=None, stderr = None)
+    # windowless python where there is one, so no console pops up
+    python = sys.executable
+    pythonw = os.path.join(os.path.dirname(python), 'pythonw.exe')
+    if sys.platform == 'win32' and os.path.exists(pythonw):
+        python = pythonw
+    child = subprocess.Popen([python, os.path.join(script_loc_dir, 'bmsched.py'), '3'], stdout=None, stderr = None)
     print('Started!')
 
 def latest_log():
     # get the list of files in the log directory
-    list_of_files = glob.glob(f'{LOGFILEDIR}\\*.log')
+    list_of_files = glob.glob(os.path.join(LOGFILEDIR, '*.log'))
     # get the c time of each file and use that as the key to order the list
     # and identify the maximum
     latest_file = max(list_of_files, key=os.path.getmtime)
@@ -129,28 +167,185 @@ def show_latest_log(openlog=False, linecnt=13):
         print(line, end='')
 
 
+def parse_when(text: str) -> datetime:
+    '''
+    Parses a point in time given as a time string ago (e.g. 2h30m), a time today (HH:MM[:SS]) or a date and time (YYYY-MM-DD[ HH:MM[:SS]])
+    '''
+    from scripts.TimeString import TimeString
+    try:
+        return datetime.fromtimestamp(time.time() - TimeString.parse(text))
+    except Exception:
+        pass
+
+    try:
+        return datetime.combine(datetime.today(), datetime.strptime(text, '%H:%M:%S' if text.count(':') == 2 else '%H:%M').time())
+    except ValueError:
+        pass
+
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f'Could not parse time "{text}"')
+
+def show_log_range(argv: list) -> int:
+    '''
+    Prints the log records between --since and --until, across all the log files
+    '''
+    import argparse
+    from scripts.LogIndex import LogIndex, time_key
+
+    argParser = argparse.ArgumentParser(prog='bm.py logs', description='Show the log records in a time range')
+    argParser.add_argument('--since', metavar='<time>', help='Start of the range: a time string ago (2h), a time today (03:10) or a date and time (2024-05-14 03:10)')
+    argParser.add_argument('--until', metavar='<time>', help='End of the range (inclusive), in the same forms as --since')
+    args = argParser.parse_args(argv)
+
+    try:
+        since = None if args.since is None else time_key(parse_when(args.since))
+        until = None if args.until is None else time_key(parse_when(args.until))
+    except ValueError as e:
+        print(e)
+        return 1
+
+    current = None
+    for name, line in LogIndex(LOGFILEDIR).query(since, until):
+        if name != current:
+            print(f'==> {name} <==')
+            current = name
+        print(line, end='')
+
+    if current is None:
+        print(f'No log records between {since or "the start"} and {until or "now"}')
+    return 0
+
+def fmt_time(t: float) -> str:
+    return datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
+
+def fmt_rate(rate) -> str:
+    return '' if rate is None else f'{rate:.2f}'
+
+def print_events(rows: list):
+    for t, eventType, name, value, detail in rows:
+        value = '' if value is None else int(value) if float(value).is_integer() else round(value, 2)
+        print(f'{fmt_time(t)}  {eventType:<10} {name or "":<10} {value!s:>8}  {detail or ""}')
+
+def history_main(argv: list) -> int:
+    '''
+    Answers questions about the monitor's history database (see -history-db in battery_monitor.py)
+    '''
+    import argparse
+    from scripts.HistoryStore import HistoryQuery, HistoryStoreException, EVENT_TYPES
+
+    argParser = argparse.ArgumentParser(prog='bm.py history', description="Query the battery monitor's history database")
+    argParser.add_argument('-db', default=os.path.join(LOGFILEDIR, 'history.db'), metavar='<file path>', help='History database, default: history.db in the log directory')
+    sub = argParser.add_subparsers(dest='query', required=True)
+
+    rate = sub.add_parser('rate', help='Average discharge (or charge) rate')
+    rate.add_argument('-hours', type=float, default=24, help='How far back to look, default: 24')
+    rate.add_argument('--charging', action='store_true', help='Charge rate instead of discharge rate')
+
+    failures = sub.add_parser('plug-failures', help='Plug commands that did not succeed')
+    failures.add_argument('-days', type=float, default=7, help='How far back to look, default: 7')
+
+    events = sub.add_parser('events', help='Recorded events, newest last')
+    events.add_argument('type', nargs='?', choices=EVENT_TYPES, help='Only events of this type')
+    events.add_argument('-hours', type=float, default=24, help='How far back to look, default: 24')
+    events.add_argument('-limit', type=int, default=50, help='Most events shown, default: 50')
+
+    rollups = sub.add_parser('rollups', help='Hourly (or per minute) aggregates of samples that have been rolled up')
+    rollups.add_argument('-days', type=float, default=7, help='How far back to look, default: 7')
+    rollups.add_argument('--minutes', action='store_true', help='Per minute aggregates instead of hourly ones')
+
+    summary = sub.add_parser('summary', help='Sample and event counts and rates')
+    summary.add_argument('-hours', type=float, default=24, help='How far back to look, default: 24')
+
+    args = argParser.parse_args(argv)
+
+    try:
+        history = HistoryQuery(args.db)
+    except HistoryStoreException as e:
+        print(e.message)
+        return 1
+
+    now = time.time()
+    try:
+        if args.query == 'rate':
+            pct_per_hr, hours = history.rate(since=now - args.hours * 3600, charging=args.charging)
+            what = 'Charge' if args.charging else 'Discharge'
+            if pct_per_hr is None:
+                print(f'{what} rate over the last {args.hours:g}h: no {what.lower()} measured')
+            else:
+                print(f'{what} rate over the last {args.hours:g}h: {pct_per_hr:.2f}%/hr (measured over {hours:.1f}h)')
+
+        elif args.query == 'plug-failures':
+            rows = history.plugFailures(since=now - args.days * 86400)
+            print(f'{len(rows)} failed plug command(s) in the last {args.days:g} days')
+            print_events(rows)
+
+        elif args.query == 'events':
+            print_events(history.events(args.type, since=now - args.hours * 3600, limit=args.limit))
+
+        elif args.query == 'rollups':
+            rows = history.rollups(60 if args.minutes else 3600, since=now - args.days * 86400)
+            print(f'{"start":<19}  {"samples":>7}  {"min %":>6}  {"mean %":>6}  {"max %":>6}  {"charging":>8}  {"charge %/hr":>11}  {"drain %/hr":>10}')
+            for _, t, samples, pmin, pmax, pmean, charging_secs, charge_rate, discharge_rate in rows:
+                print(f'{fmt_time(t)}  {samples:>7}  {pmin:>6.1f}  {pmean:>6.1f}  {pmax:>6.1f}  {charging_secs / 60:>7.0f}m  {fmt_rate(charge_rate):>11}  {fmt_rate(discharge_rate):>10}')
+
+        elif args.query == 'summary':
+            since = now - args.hours * 3600
+            for name, count in history.counts(since=since).items():
+                print(f'{name:<15} {count}')
+            for charging in (False, True):
+                pct_per_hr, hours = history.rate(since=since, charging=charging)
+                if pct_per_hr is not None:
+                    print(f'{"charge" if charging else "discharge":<15} {pct_per_hr:.2f}%/hr over {hours:.1f}h')
+    finally:
+        history.close()
+
+    return 0
+
+def pop_option(rawArgs: list, name: str):
+    '''
+    Removes `name` and the value after it from `rawArgs` and returns the value, None if it is not there
+    '''
+    lowered = [a.lower() for a in rawArgs]
+    if name not in lowered:
+        return None
+    ind = lowered.index(name)
+    if ind + 1 >= len(rawArgs):
+        raise ServiceException(f'No value given for {name}')
+    value = rawArgs[ind+1]
+    del rawArgs[ind:ind+2]
+    return value
 
 def main():
-    global BMTASKNAME
+    rawArgs = sys.argv[1:]
+
+    # settings from the bm config, each can be overridden for one call
+    try:
+        config = load_bm_config(pop_option(rawArgs, '-config'))
+        for option, key in (('-task', 'task'), ('-logdir', 'logDir'), ('-backend', 'backend')):
+            value = pop_option(rawArgs, option)
+            if value is not None:
+                config[key] = value
+        configure(config)
+    except ServiceException as e:
+        print(e.message)
+        return 1
 
-    args = [a.lower() for a in sys.argv[1:]]
+    args = [a.lower() for a in rawArgs]
     argc = len(args)
 
     if argc < 1:
         print('No arguments were passed into script')
         return 0
 
-    # get task name
-    if "-task" not in args:
-        print('No -task name argument provided')
+    if args[0] in ('logs', 'history') and LOGFILEDIR is None:
+        print('No log directory set, set "logDir" in the bm config or pass -logdir')
         return 1
 
-    ind = args.index('-task')
-    BMTASKNAME = args[ind+1]
-    args.pop(ind+1)
-    args.pop(ind)
-    argc -= 2
-
+    if args[0] == 'history':
+        # history queries read the database, they do not need the task
+        return history_main(rawArgs[1:])
 
     uniword_commands = {
         'start': start_bm,
@@ -164,6 +359,10 @@ def main():
         uniword_commands[ args[0] ]()
 
 
+    elif args[0] == 'logs' and any(a.startswith(('--since', '--until')) for a in args[1:]):
+        # time range queries go through the log index, and work whether the task is running or not
+        return show_log_range(rawArgs[1:])
+
     elif args[0] == 'logs':
         # no other args we default to truncating
         # can specify a line count or use open
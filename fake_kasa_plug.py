@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+script_loc_dir = os.path.split(os.path.realpath(__file__))[0]
+if script_loc_dir not in sys.path:  sys.path.append(script_loc_dir)
+
+from scripts.FakeKasaPlug import FakePlugFleet, FakeKasaPlugException, DEFAULT_PORT
+
+
+def make_fleet(args) -> FakePlugFleet:
+    if args.script is not None:
+        return FakePlugFleet.fromScript(args.script, startPort=args.port, host=args.host, seed=args.seed)
+
+    return FakePlugFleet.consecutive(
+        args.plugs,
+        startPort=args.port,
+        host=args.host,
+        seed=args.seed,
+        latencySecs=args.latency,
+        jitterSecs=args.jitter,
+        lossRate=args.loss,
+        wrongStateRate=args.wrong_state,
+        timeoutRate=args.timeout)
+
+
+def print_stats(fleet: FakePlugFleet):
+    print(f'{"port":>6} {"on":>4} {"requests":>9} {"changes":>8} {"dropped":>8} {"timeouts":>9} {"ignored":>8}')
+    for s in fleet.stats():
+        print(f'{s["port"]:>6} {str(s["on"]):>4} {s["requests"]:>9} {s["relay_changes"]:>8} {s["dropped"]:>8} {s["timed_out"]:>9} {s["ignored_sets"]:>8}')
+
+
+async def serve(fleet: FakePlugFleet):
+    await fleet.start()
+    for plug in fleet.plugs:
+        print(f'{plug.alias} listening on {plug.host}:{plug.port}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fleet.stop()
+
+
+def loadtest(fleet: FakePlugFleet, toggles: int, concurrency: int):
+    '''
+    Starts the fake plugs and toggles each one `toggles` times through `SmartPlugController.set_plug`
+    (Python Kasa only, no home network check), measuring how long each call takes and what it returned.
+    '''
+    from scripts.SmartPlugController import SmartPlugController
+
+    fleet.startThread()
+
+    def run_plug(plug):
+        controller = SmartPlugController(plug.host, plug.alias, '', plug_port=plug.port, check_home_network=False)
+        results = []
+        for i in range(toggles):
+            on = (i % 2 == 0)
+            start = time.perf_counter()
+            try:
+                res = controller.set_plug(on=on, off=not on, use_tplink=False)
+            except Exception:
+                res = None
+            results.append((res, time.perf_counter() - start))
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = [r for plugResults in pool.map(run_plug, fleet.plugs) for r in plugResults]
+    elapsed = time.perf_counter() - start
+
+    fleet.stopThread()
+
+    latencies = sorted(secs for _, secs in results)
+    succeeded = sum(1 for res, _ in results if res == 0)
+    failed = sum(1 for res, _ in results if res == -1)
+    errors = sum(1 for res, _ in results if res is None)
+
+    print(f'Plugs             : {len(fleet.plugs)}')
+    print(f'Plug commands     : {len(results)}')
+    print(f'Elapsed           : {elapsed:.2f}s')
+    print(f'Succeeded         : {succeeded}')
+    print(f'Failed (-1)       : {failed}')
+    print(f'Errors            : {errors}')
+    print(f'Latency p50 / p99 : {latencies[len(latencies) // 2] * 1000:.1f}ms / {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms')
+    print('')
+    print_stats(fleet)
+
+
+def main():
+    argParser = argparse.ArgumentParser(description='Fake Kasa smart plugs for testing plug control without hardware')
+    sub = argParser.add_subparsers(dest='command', required=True)
+
+    serveParser = sub.add_parser('serve', help='Run fake plugs until interrupted')
+    loadParser = sub.add_parser('loadtest', help='Toggle fake plugs with SmartPlugController and report latency and failures')
+    loadParser.add_argument('-toggles', type=int, default=10, help='Times each plug is toggled, default: 10')
+    loadParser.add_argument('-concurrency', type=int, default=10, help='Plugs controlled at the same time, default: 10')
+
+    for parser in (serveParser, loadParser):
+        parser.add_argument('-host', default='127.0.0.1', help='Address to listen on, default: 127.0.0.1')
+        parser.add_argument('-port', type=int, default=DEFAULT_PORT, help=f'Port of the first plug, the rest use the following ports. 0 picks free ports, default: {DEFAULT_PORT}')
+        parser.add_argument('-plugs', type=int, default=1, help='Number of plugs, default: 1')
+        parser.add_argument('-latency', type=float, default=0, help='Seconds before each response, default: 0')
+        parser.add_argument('-jitter', type=float, default=0, help='Extra random seconds (up to this) before each response, default: 0')
+        parser.add_argument('-loss', type=float, default=0, help='Chance of closing the connection instead of responding, default: 0')
+        parser.add_argument('-wrong-state', type=float, default=0, help='Chance of acknowledging a relay change without making it, default: 0')
+        parser.add_argument('-timeout', type=float, default=0, help='Chance of never responding to a request, default: 0')
+        parser.add_argument('-seed', type=int, help='Seed for the random behaviour, so runs can be repeated')
+        parser.add_argument('-script', metavar='<file path>', help='JSON file describing each plug, overrides the behaviour flags')
+
+    args = argParser.parse_args()
+
+    try:
+        fleet = make_fleet(args)
+    except FakeKasaPlugException as e:
+        print(e.message)
+        return 1
+
+    try:
+        if args.command == 'serve':
+            asyncio.run(serve(fleet))
+        else:
+            loadtest(fleet, args.toggles, args.concurrency)
+    except KeyboardInterrupt:
+        print('')
+        print_stats(fleet)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+script_loc_dir = os.path.split(os.path.realpath(__file__))[0]
+if script_loc_dir not in sys.path:  sys.path.append(script_loc_dir)
+
+from scripts.FleetCollector import FleetCollector
+
+
+async def serve(host, port):
+    collector = FleetCollector(host=host, port=port)
+    await collector.start()
+    print(f'Fleet collector listening on http://{host}:{collector.port}')
+    await collector.serveForever()
+
+
+def make_batch(hostName, batchSize, startTime):
+    records = []
+    for i in range(batchSize):
+        records.append({
+            't': startTime + i,
+            'k': 'sample',
+            'percent': random.randint(1, 100),
+            'charging': random.random() < 0.5,
+        })
+    return zlib.compress(json.dumps({'host': hostName, 'records': records}, separators=(',', ':')).encode('utf-8'))
+
+
+async def simulate_host(host, port, hostName, reports, batchSize, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for n in range(reports):
+            body = make_batch(hostName, batchSize, time.time() + n * batchSize)
+            head = (
+                f'POST /ingest HTTP/1.1\r\n'
+                f'Host: {host}\r\n'
+                f'Content-Type: application/json\r\n'
+                f'Content-Encoding: deflate\r\n'
+                f'Content-Length: {len(body)}\r\n\r\n'
+            )
+            start = time.perf_counter()
+            writer.write(head.encode('latin-1') + body)
+            await writer.drain()
+
+            # read the response headers and body
+            length = 0
+            status = await reader.readline()
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+
+            if not status.startswith(b'HTTP/1.1 200'):
+                raise Exception(f'Collector rejected batch: {status.decode().strip()}')
+    finally:
+        writer.close()
+
+
+async def loadtest(hosts, reports, batchSize, concurrency):
+    '''
+    Starts a collector on a free localhost port and reports to it from `hosts` simulated monitors.
+    '''
+    collector = FleetCollector(host='127.0.0.1', port=0)
+    await collector.start()
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_host(i):
+        async with semaphore:
+            await simulate_host('127.0.0.1', collector.port, f'host-{i:05d}', reports, batchSize, latencies)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_host(i) for i in range(hosts)))
+    elapsed = time.perf_counter() - start
+
+    await collector.stop()
+
+    latencies.sort()
+    total_reports = hosts * reports
+    print(f'Hosts             : {hosts}')
+    print(f'Reports           : {total_reports} ({batchSize} records each)')
+    print(f'Elapsed           : {elapsed:.2f}s')
+    print(f'Reports/sec       : {total_reports / elapsed:.0f}')
+    print(f'Records/sec       : {collector.recordsReceived / elapsed:.0f}')
+    print(f'Latency p50 / p99 : {latencies[len(latencies) // 2] * 1000:.2f}ms / {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms')
+    print(f'Indexed hosts     : {len(collector.index)}')
+
+
+def main():
+    argParser = argparse.ArgumentParser(description='Fleet collector for battery monitor agents')
+    sub = argParser.add_subparsers(dest='command', required=True)
+
+    serveParser = sub.add_parser('serve', help='Run the collector')
+    serveParser.add_argument('-host', default='127.0.0.1', help='Address to listen on, default: 127.0.0.1')
+    serveParser.add_argument('-port', type=int, default=8470, help='Port to listen on, default: 8470')
+
+    loadParser = sub.add_parser('loadtest', help='Load test a collector on localhost')
+    loadParser.add_argument('-hosts', type=int, default=2000, help='Number of simulated hosts, default: 2000')
+    loadParser.add_argument('-reports', type=int, default=5, help='Reports sent by each host, default: 5')
+    loadParser.add_argument('-batch', type=int, default=20, help='Records per report, default: 20')
+    loadParser.add_argument('-concurrency', type=int, default=500, help='Simultaneous host connections, default: 500')
+
+    args = argParser.parse_args()
+
+    try:
+        if args.command == 'serve':
+            asyncio.run(serve(args.host, args.port))
+        else:
+            asyncio.run(loadtest(args.hosts, args.reports, args.batch, args.concurrency))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
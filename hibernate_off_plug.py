@@ -11,13 +11,15 @@ from scripts.functions import get_plug_password
 
 def main():
     config = get_args_from_config_in_sysargs()
+    plug_password = get_plug_password(config.plugAccUsername)
     plc = SmartPlugController(
         config.plugIP,
         config.plugName,
         config.wifi,
-        tplink_creds=(config.plugAccUsername, get_plug_password(config.plugAccUsername)),
-        TPLinkAvail=get_plug_password(config.plugAccUsername) is not None,
-        logger=None)
+        tplink_creds=(config.plugAccUsername, plug_password),
+        TPLinkAvail=plug_password is not None,
+        logger=None,
+        plug_port=config.plugPort)
 
     res = plc.set_plug(off=True)
     
@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import traceback
 from datetime import datetime as mydt
 
@@ -8,10 +9,21 @@ if script_loc_dir not in sys.path:
     sys.path.append(script_loc_dir)
 
 from scripts.bm_logging import console, logger, printer
-from scripts.functions import send_notification, get_battery_info, do_beeps_threaded
-from scripts.ScriptSleepController import ScriptSleepController
+from scripts.functions import send_notification, do_beeps_threaded
+from scripts.BatterySnapshot import BatterySnapshot
+from scripts.ScriptSleepController import ScriptSleepController, CONFIG_EVENT, POWER_EVENT
+from scripts.ConfigReloader import ConfigReloader
+from scripts.ChargeCutoff import ChargeCutoff
+from scripts.LoadModel import LoadSampler
+from scripts.HistoryStore import HistoryStore
+from scripts.MemoryMonitor import MemoryMonitor, MemoryCeilingException
 from scripts.SmartPlugController import *
 from scripts.EmailBot import EmailBot
+from scripts.FleetAgent import FleetAgent
+from scripts.PowerEvents import PowerEventSource
+from scripts.DeadlineScheduler import DeadlineScheduler
+from scripts.MetricsRegistry import metrics, notification_latency
+from scripts.PhaseTimer import phases
 from scripts.TimeString import TimeString
 
 
@@ -27,7 +39,10 @@ class EmailNotifier:
 
 
 class BatteryMonitor:
-    def __init__(self, batteryFloor: int, batteryCeiling: int, checkGrain: int, adaptivity: float, alertPeriodSecs: int, maxAttempts: int, plug: SmartPlugController, emailer: EmailNotifier, headless:bool = False):
+    def __init__(self, batteryFloor: int, batteryCeiling: int, checkGrain: int, adaptivity: float, alertPeriodSecs: int, maxAttempts: int, plug: SmartPlugController, emailer: EmailNotifier, headless:bool = False, agent: FleetAgent = None,
+                 powerEvents: PowerEventSource = None, countdownRedrawSecs: float = 1, metricsFile: str = None, configReloader: ConfigReloader = None,
+                 chargeCutoff: ChargeCutoff = None, loadModel: bool = True, watchdogPeriodSecs: float = 60,
+                 history: HistoryStore = None, memoryMonitor: MemoryMonitor = None):
         self.batteryMin = batteryFloor
         self.batteryMax = batteryCeiling
         self.grain = checkGrain
@@ -36,13 +51,46 @@ class BatteryMonitor:
         self.headless = headless
         self.plug = plug
         self.emailer = emailer
+        self.agent = agent
+        self.metricsFile = metricsFile
+        # Arms the plug's own timer to stop charging at the maximum, if enabled
+        self.chargeCutoff = chargeCutoff
+        # Records samples and events to the on-disk history, if enabled
+        self.history = history
+        # Logs memory use periodically and enforces the RSS ceiling, if enabled
+        self.memoryMonitor = memoryMonitor
+        # Set when the monitor stops so it can be restarted, to what the restarted monitor should continue from
+        self.restartState = None
+        self.restarts = 0
+        phases.setLogger(logger)
+
+        # Shared by the monitor, sleep controller and alerts so a cycle reads the sensor as few times as possible
+        self.battery = BatterySnapshot()
+
+        # All battery check, verification, alert and unlock signal waits are deadlines on this scheduler
+        self.scheduler = DeadlineScheduler(maxWaitSliceSecs=DeadlineScheduler.interactiveSlice(headless))
 
         self.sleepController = ScriptSleepController(
             self.batteryMin,
             self.batteryMax,
             checkIntervalPercentage=self.grain,
             headless=self.headless,
-            predAdaptivity=adaptivity)
+            predAdaptivity=adaptivity,
+            batterySnapshot=self.battery,
+            powerEvents=powerEvents,
+            scheduler=self.scheduler,
+            countdownRedrawSecs=countdownRedrawSecs,
+            loadSampler=LoadSampler() if loadModel else None,
+            watchdogPeriodSecs=watchdogPeriodSecs)
+
+        if self.memoryMonitor is not None:
+            self.memoryMonitor.start()
+            self.scheduler.every(self.memoryMonitor.periodSecs, self.checkMemory, name='memory')
+
+        # Reloaded configs are staged by the reloader and applied at the start of a battery check
+        self.configReloader = configReloader
+        if self.configReloader is not None:
+            self.configReloader.start(onReload=lambda: self.scheduler.post(CONFIG_EVENT))
 
     def monitorBattery(self):
         iters = 0
@@ -50,14 +98,27 @@ class BatteryMonitor:
             try:
                 # put sleep first, doing so to eliminate if statements
                 if iters > 0:
-                    self.sleepController.sleepTillNextBatteryCheck()
-                cur_percent, charging = get_battery_info()
+                    phases.endCycle()
+                    self.writeMetrics()
+                    self.sleepController.sleepTillNextBatteryCheck(beforeSleep=self.beforeSleep)
+                self.applyConfigUpdate()
+                self.dropPowerEvents()
+                # always read the sensor after sleeping
+                cur_percent, charging = self.battery.info(fresh=True)
 
                 printer.info('Battery Check: {}%, {}'.format(cur_percent, 'Charging' if charging else 'Not Charging'))
 
                 low_battery = (cur_percent <= self.batteryMin) and (not charging)
                 high_battery = (cur_percent >= self.batteryMax) and charging
 
+                decision = 'low' if low_battery else 'high' if high_battery else 'none'
+                if self.agent is not None:
+                    self.agent.recordSample(cur_percent, charging)
+                    self.agent.recordDecision(decision, cur_percent, charging)
+                if self.history is not None:
+                    self.history.recordSample(self.battery.get())
+                    self.history.recordDecision(decision, cur_percent)
+
                 if not (high_battery or low_battery):
                     printer.info('No Action Required')
                     iters += 1
@@ -66,9 +127,24 @@ class BatteryMonitor:
                 printer.info('{} Battery Detected'.format('Low' if low_battery else 'High'))
                 self.handleBatteryCase(high_battery, low_battery)
                 iters += 1
+            except MemoryCeilingException as e:
+                printer.warning(f'{e.message}, restarting the monitor')
+                self.restartState = self.exportState()
+                self.stop()
+                return
+            except SystemExit:
+                # raised by the stop signal handler, see battery_monitor.py
+                printer.info('Exiting due to stop signal')
+                self.stop()
+                return
+            except Exception:
+                # the fleet agent and history still hold records that would be lost with their threads
+                self.stop()
+                raise
             except KeyboardInterrupt:
                 if self.headless:
                     printer.info('Exiting due to keyboard interrupt')
+                    self.stop()
                     return
                 else:
                     try:
@@ -77,10 +153,124 @@ class BatteryMonitor:
                         iters = 0
                     except KeyboardInterrupt:
                         printer.info('Exiting due to keyboard interrupt')
+                        self.stop()
                         return
 
+    def dropPowerEvents(self):
+        '''
+        Drops plug changes posted before this battery check, the fresh reading it starts with already shows them,
+        and left pending they would end the next sleep as soon as it starts
+        '''
+        while self.scheduler.takeEvent((POWER_EVENT,)) is not None:
+            pass
+
+    def applyConfigUpdate(self):
+        '''
+        Applies a reloaded config (if one is staged) to the monitor, sleep controller and plug controller together,
+        between battery checks so a check never runs with a mix of old and new settings.
+        '''
+        if self.configReloader is None:
+            return
+
+        # the reloader's wake up event has done its job
+        while self.scheduler.takeEvent((CONFIG_EVENT,)) is not None:
+            pass
+
+        args = self.configReloader.takePending()
+        if args is None:
+            return
+
+        self.batteryMin = args.batteryMin
+        self.batteryMax = args.batteryMax
+        self.grain = args.grain
+        self.alertPeriod = TimeString.parse(args.alertPeriod)
+        self.maxAttempts = args.maxAttempts
+        self.sleepController.reconfigure(self.batteryMin, self.batteryMax, self.grain, args.adaptivity)
+        self.plug.reconfigure(args.plugIP, args.plugName, args.wifi, plug_port=args.plugPort)
+
+        printer.info('Config Reloaded')
+        logger.info(f'min={self.batteryMin}%, max={self.batteryMax}%, grain={self.grain}%, adaptivity={args.adaptivity} alertEvery={self.alertPeriod}s, maxAttempts={self.maxAttempts}')
+        logger.info(f'Plug Info: Network="{self.plug.home_network}", Plug IP={self.plug.plug_ip}, Plug Name="{self.plug.plug_name}"')
+
+    def checkMemory(self):
+        '''
+        Runs a memory check between battery checks, raises MemoryCeilingException if the monitor should restart
+        '''
+        with phases.phase('memory_check'):
+            self.memoryMonitor.check()
+
+    def exportState(self) -> dict:
+        '''
+        Returns the state a restarted monitor continues from, as JSON serialisable values
+        '''
+        return {'restarts': self.restarts + 1, 'sleepController': self.sleepController.exportState()}
+
+    def restoreState(self, state: dict):
+        '''
+        Continues from the state of the monitor that restarted into this one, see `exportState`
+        '''
+        self.restarts = state.get('restarts', 0)
+        self.sleepController.importState(state.get('sleepController', {}))
+
+    def beforeSleep(self):
+        '''
+        Called once the next sleep period is predicted, before the monitor goes to sleep
+        '''
+        if self.history is not None:
+            self.history.recordPrediction(self.sleepController.sleepPeriod, self.sleepController.sleepPeriodSource)
+        self.updateChargeCutoff()
+
+    def updateChargeCutoff(self):
+        '''
+        Arms, re-arms or cancels the plug's charge cut-off timer from the latest battery reading and prediction
+        '''
+        if self.chargeCutoff is None:
+            return
+        _, charging = self.battery.info()
+        with phases.phase('plug_timer'):
+            self.chargeCutoff.update(charging, self.sleepController.predictSecsToCeiling())
+
+    def stop(self):
+        '''
+        Stops the monitor's background work before exiting
+        '''
+        if self.configReloader is not None:
+            self.configReloader.stop()
+        if self.chargeCutoff is not None:
+            # the plug should not switch off by itself once the monitor is gone
+            self.chargeCutoff.cancel()
+        if self.history is not None:
+            self.history.stop()
+            logger.info(f'History: {self.history.rowsWritten} rows written in {self.history.commits} commits, {self.history.writeFailures} failed commits')
+            retention = self.history.retention
+            if retention is not None:
+                logger.info(f'History Retention: {retention.samplesRolled} samples and {retention.minutesRolled} minute rollups rolled up, {retention.eventsDeleted} events deleted in {retention.steps} steps')
+        if self.memoryMonitor is not None:
+            self.memoryMonitor.stop()
+        self.stopAgent()
+
+    def writeMetrics(self):
+        '''
+        Rewrites the metrics file (if any) with the metrics as of the end of this cycle
+        '''
+        if self.metricsFile is None:
+            return
+        try:
+            metrics.writeFile(self.metricsFile)
+        except OSError as e:
+            logger.warning(f'Could not write metrics file: {e}')
+
+    def stopAgent(self):
+        '''
+        Stops the fleet agent (if any), pushing or buffering whatever it still holds.
+        '''
+        if self.agent is None:
+            return
+        self.agent.stop()
+        logger.info(f'Fleet Agent: {self.agent.recordsSent} records sent, {self.agent.pushFailures} failed pushes')
+
     def handleBatteryCase(self, high_battery, low_battery):
-        _, charging = get_battery_info()
+        _, charging = self.battery.info()
         attempts_made = 0
 
         while (low_battery and not charging) or (high_battery and charging):
@@ -90,15 +280,21 @@ class BatteryMonitor:
 
             printer.info('Attempting Automatic Smart Plug Control')
             try:
-                self.plug.set_plug(on=low_battery, off=high_battery)
+                res = self.plug.set_plug(on=low_battery, off=high_battery)
             except SmartPlugControllerException as e:
+                res = None
                 printer.error(f'Plug Control Error: {e}')
                 logger.error(traceback.print_exc())
 
-            console.info('Waiting 5 seconds for verification')
-            self.sleepController.trackedSleep(5)
+            if self.agent is not None:
+                self.agent.recordPlugOutcome('on' if low_battery else 'off', res)
+            if self.history is not None:
+                self.history.recordPlugOutcome('on' if low_battery else 'off', res)
 
-            _, charging = get_battery_info()
+            console.info('Waiting 5 seconds for verification')
+            with phases.phase('verification_wait'):
+                self.sleepController.trackedSleep(5)
+                _, charging = self.battery.info(fresh=True)
             if (low_battery and charging) or (high_battery and not charging):
                 printer.info('Battery case has been handled')
                 break
@@ -111,6 +307,9 @@ class BatteryMonitor:
                 email=(attempts_made >= 2),
                 last=(attempts_made == self.maxAttempts - 1)
             )
+            if self.history is not None:
+                channels = ['toast'] + (['sound'] if attempts_made >= 1 else []) + (['email'] if attempts_made >= 2 and self.emailer is not None else [])
+                self.history.recordAlert('low' if low_battery else 'high', attempts_made + 1, channels)
 
             wait_for = 120 if attempts_made < 2 else self.alertPeriod
             printer.info(f'Waiting {TimeString.make(wait_for)} for user action...')
@@ -118,7 +317,7 @@ class BatteryMonitor:
 
             attempts_made += 1
 
-            _, charging = get_battery_info()
+            _, charging = self.battery.info(fresh=True)
 
     def sendBatteryAlerts(self, isLow, email=False, sound=False, last=False):
         '''
@@ -135,19 +334,28 @@ class BatteryMonitor:
 
         if sound:
             printer.info('Playing sound..')
-            do_beeps_threaded()
+            start = time.perf_counter()
+            with phases.phase('notify_sound'):
+                do_beeps_threaded()
+            notification_latency.observe(time.perf_counter() - start, channel='sound')
 
         printer.info('Showing Windows Notification...')
-        send_notification(title, body)
+        start = time.perf_counter()
+        with phases.phase('notify_toast'):
+            send_notification(title, body)
+        notification_latency.observe(time.perf_counter() - start, channel='toast')
 
         if email and self.emailer is not None:
             printer.info('Sending Email...')
             subject = '{} - {}'.format(email_title, mydt.now().strftime('%b %d %Y %H:%M'))
-            self.emailer.sendEmail(subject, body, important=(isLow or last))
+            start = time.perf_counter()
+            with phases.phase('notify_email'):
+                self.emailer.sendEmail(subject, body, important=(isLow or last))
+            notification_latency.observe(time.perf_counter() - start, channel='email')
             printer.info('Email Alert Sent!')
 
     def getAlert(self, isLow, last):
-        curbattery, _ = get_battery_info()
+        curbattery, _ = self.battery.info()
         descs = {
             'low': ('Low', 'below', 'minimum', 'not'),
             'high': ('High', 'above', 'maximum', 'still')
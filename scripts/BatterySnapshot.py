@@ -0,0 +1,71 @@
+import threading
+import time
+
+from scripts.BatterySource import BatteryReading, BatterySource, get_battery_source
+from scripts.MetricsRegistry import battery_reads
+from scripts.PhaseTimer import phases
+
+
+class BatterySnapshot:
+    '''
+    Shares one battery reading between everything that needs "the current battery state".
+
+    A reading is reused while it is younger than `maxAgeSecs`; callers that must observe a change
+    (e.g. verifying that plug control worked) ask for a fresh read with `get(fresh=True)`.
+
+    Sensor reads and shared (reused) readings are counted per monitor cycle, see `endCycle`.
+    '''
+
+    def __init__(self, maxAgeSecs: float = 10, source: BatterySource = None):
+        '''
+        - `maxAgeSecs` : How long a reading can be reused for.
+        - `source` : Battery source to read from, defaults to the monitor's configured source.
+        '''
+        self.maxAgeSecs = maxAgeSecs
+        self.source = source
+        self.reading = None
+        self.lock = threading.Lock()
+
+        self.totalReads = 0
+        self.cycleReads = 0
+        self.cycleShared = 0
+
+    def get(self, fresh: bool = False) -> BatteryReading:
+        '''
+        Returns the current reading, reading the sensor only if the last reading is stale or `fresh` is true.
+        '''
+        with self.lock:
+            if not fresh and self.reading is not None and (time.monotonic() - self.reading.timestamp) <= self.maxAgeSecs:
+                self.cycleShared += 1
+                return self.reading
+
+            source = self.source if self.source is not None else get_battery_source()
+            with phases.phase('sensor_read'):
+                self.reading = source.read()
+            self.totalReads += 1
+            self.cycleReads += 1
+            battery_reads.inc()
+            return self.reading
+
+    def info(self, fresh: bool = False) -> tuple:
+        '''
+        Returns (percent, plugged) like `functions.get_battery_info`
+        '''
+        reading = self.get(fresh=fresh)
+        return reading.percent, reading.power_plugged
+
+    def invalidate(self):
+        '''
+        Forces the next `get` to read the sensor.
+        '''
+        with self.lock:
+            self.reading = None
+
+    def endCycle(self) -> tuple:
+        '''
+        Returns (sensor reads, shared readings) since the last call and resets the counts.
+        '''
+        with self.lock:
+            counts = (self.cycleReads, self.cycleShared)
+            self.cycleReads, self.cycleShared = 0, 0
+        return counts
@@ -0,0 +1,280 @@
+import glob
+import os
+import sys
+import time
+
+# Same sentinel values as psutil.POWER_TIME_UNKNOWN and psutil.POWER_TIME_UNLIMITED
+SECSLEFT_UNKNOWN = -1
+SECSLEFT_UNLIMITED = -2
+
+SYSFS_POWER_SUPPLY_DIR = '/sys/class/power_supply'
+
+
+class BatterySourceException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class BatteryReading:
+    '''
+    A single reading of the battery.
+
+    `percent`, `power_plugged` and `secsleft` mirror the fields of `psutil.sensors_battery()`.
+    The remaining fields are the raw sysfs values (micro units: uWh, uW, uAh, uA, uV) and are None
+    when the source does not provide them.
+    '''
+    def __init__(self, percent, power_plugged, secsleft=SECSLEFT_UNKNOWN, status=None,
+                 energy_now=None, energy_full=None, power_now=None,
+                 charge_now=None, charge_full=None, current_now=None, voltage_now=None):
+        self.percent = percent
+        self.power_plugged = power_plugged
+        self.secsleft = secsleft
+        self.status = status
+        self.energy_now = energy_now
+        self.energy_full = energy_full
+        self.power_now = power_now
+        self.charge_now = charge_now
+        self.charge_full = charge_full
+        self.current_now = current_now
+        self.voltage_now = voltage_now
+        # monotonic time the reading was taken at
+        self.timestamp = time.monotonic()
+
+    def energyNowWh(self):
+        '''
+        Returns the energy remaining in Wh, derived from charge and voltage for charge based batteries.
+        None if not available.
+        '''
+        if self.energy_now is not None:
+            return self.energy_now / 1E6
+        if self.charge_now is not None and self.voltage_now is not None:
+            return (self.charge_now / 1E6) * (self.voltage_now / 1E6)
+        return None
+
+    def energyFullWh(self):
+        if self.energy_full is not None:
+            return self.energy_full / 1E6
+        if self.charge_full is not None and self.voltage_now is not None:
+            return (self.charge_full / 1E6) * (self.voltage_now / 1E6)
+        return None
+
+    def powerW(self):
+        '''
+        Returns the instantaneous power draw (or charge rate) in W, None if not available.
+        '''
+        if self.power_now is not None:
+            return self.power_now / 1E6
+        if self.current_now is not None and self.voltage_now is not None:
+            return (self.current_now / 1E6) * (self.voltage_now / 1E6)
+        return None
+
+    def __repr__(self):
+        return 'BatteryReading(percent={}, power_plugged={}, status={}, energy_now={}, power_now={})'.format(
+            self.percent, self.power_plugged, self.status, self.energy_now, self.power_now)
+
+
+class BatterySource:
+    '''
+    Base class for battery sources. `read` returns all available battery attributes in one pass.
+    '''
+    name = 'base'
+
+    def read(self) -> BatteryReading:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PsutilBatterySource(BatterySource):
+    '''
+    Reads the battery through `psutil.sensors_battery()`, works on every platform psutil supports.
+    '''
+    name = 'psutil'
+
+    def read(self) -> BatteryReading:
+        import psutil
+        battery = psutil.sensors_battery()
+        if battery is None:
+            raise BatterySourceException('psutil could not find a battery')
+
+        return BatteryReading(battery.percent, battery.power_plugged, secsleft=battery.secsleft)
+
+
+class SysfsBatterySource(BatterySource):
+    '''
+    Reads the battery directly from the Linux power_supply class in sysfs.
+
+    The attribute files are opened once and kept open; each read is a `pread` at offset 0 on every
+    descriptor, which makes the kernel regenerate the value without any path lookups or re-opens.
+    '''
+    name = 'sysfs'
+
+    ATTRIBUTES = ('capacity', 'status', 'energy_now', 'energy_full', 'power_now',
+                  'charge_now', 'charge_full', 'current_now', 'voltage_now')
+
+    def __init__(self, batteryDir: str = None, acDir: str = None):
+        '''
+        - `batteryDir` : power_supply directory of the battery, defaults to the first BAT* found.
+        - `acDir` : power_supply directory of the AC adapter, defaults to the first mains supply found.
+        If no AC adapter is found, the battery status is used to determine if the laptop is plugged in.
+        '''
+        if batteryDir is None:
+            batteryDir = SysfsBatterySource.findSupply('Battery')
+        if batteryDir is None:
+            raise BatterySourceException(f'No battery found in {SYSFS_POWER_SUPPLY_DIR}')
+
+        if acDir is None:
+            acDir = SysfsBatterySource.findSupply('Mains')
+
+        self.batteryDir = batteryDir
+        self.acDir = acDir
+        self.fds = {}
+        self.acOnlineFd = None
+
+        for attr in SysfsBatterySource.ATTRIBUTES:
+            fd = SysfsBatterySource.__open(os.path.join(batteryDir, attr))
+            if fd is not None:
+                self.fds[attr] = fd
+
+        if acDir is not None:
+            self.acOnlineFd = SysfsBatterySource.__open(os.path.join(acDir, 'online'))
+
+        if 'capacity' not in self.fds and 'energy_now' not in self.fds and 'charge_now' not in self.fds:
+            self.close()
+            raise BatterySourceException(f'Battery "{batteryDir}" exposes no charge information')
+
+    @staticmethod
+    def findSupply(supplyType: str):
+        for supply in sorted(glob.glob(os.path.join(SYSFS_POWER_SUPPLY_DIR, '*'))):
+            try:
+                with open(os.path.join(supply, 'type'), 'r') as file:
+                    if file.read().strip() == supplyType:
+                        return supply
+            except OSError:
+                continue
+        return None
+
+    @staticmethod
+    def __open(path):
+        try:
+            return os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+
+    @staticmethod
+    def __pread(fd):
+        try:
+            return os.pread(fd, 64, 0).decode('ascii').strip()
+        except OSError:
+            # e.g. ENODEV while the battery is being re-enumerated
+            return None
+
+    @staticmethod
+    def __toInt(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def read(self) -> BatteryReading:
+        values = {attr: SysfsBatterySource.__pread(fd) for attr, fd in self.fds.items()}
+        ints = {attr: SysfsBatterySource.__toInt(v) for attr, v in values.items() if attr != 'status'}
+        status = values.get('status')
+
+        energy_now, energy_full = ints.get('energy_now'), ints.get('energy_full')
+        charge_now, charge_full = ints.get('charge_now'), ints.get('charge_full')
+
+        # Computed the same way as psutil so both sources agree
+        if energy_now is not None and energy_full:
+            percent = 100.0 * energy_now / energy_full
+        elif charge_now is not None and charge_full:
+            percent = 100.0 * charge_now / charge_full
+        elif ints.get('capacity') is not None:
+            percent = ints['capacity']
+        else:
+            raise BatterySourceException(f'Could not read battery charge from "{self.batteryDir}"')
+        percent = min(percent, 100)
+
+        online = SysfsBatterySource.__pread(self.acOnlineFd) if self.acOnlineFd is not None else None
+        if online is not None:
+            plugged = online == '1'
+        elif status is not None:
+            plugged = status.lower() in ('charging', 'full', 'not charging')
+        else:
+            plugged = None
+
+        power_now = ints.get('power_now')
+        if plugged:
+            secsleft = SECSLEFT_UNLIMITED
+        elif energy_now is not None and power_now:
+            secsleft = int(energy_now / power_now * 3600)
+        elif charge_now is not None and ints.get('current_now'):
+            secsleft = int(charge_now / ints['current_now'] * 3600)
+        else:
+            secsleft = SECSLEFT_UNKNOWN
+
+        return BatteryReading(percent, plugged, secsleft=secsleft, status=status,
+                              energy_now=energy_now, energy_full=energy_full, power_now=power_now,
+                              charge_now=charge_now, charge_full=charge_full,
+                              current_now=ints.get('current_now'), voltage_now=ints.get('voltage_now'))
+
+    def close(self):
+        fds = list(self.fds.values())
+        if self.acOnlineFd is not None:
+            fds.append(self.acOnlineFd)
+        for fd in fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.fds = {}
+        self.acOnlineFd = None
+
+
+BATTERY_SOURCES = ('auto', 'sysfs', 'psutil')
+
+_source = None
+
+
+def make_battery_source(name: str = 'auto') -> BatterySource:
+    '''
+    Creates a battery source by name. `auto` uses sysfs on Linux when a battery is found there,
+    and falls back to psutil everywhere else.
+    '''
+    if name not in BATTERY_SOURCES:
+        raise BatterySourceException(f'Unknown battery source "{name}", expected one of {BATTERY_SOURCES}')
+
+    if name == 'psutil':
+        return PsutilBatterySource()
+
+    if name == 'sysfs' or sys.platform.startswith('linux'):
+        try:
+            return SysfsBatterySource()
+        except BatterySourceException:
+            if name == 'sysfs':
+                raise
+
+    return PsutilBatterySource()
+
+
+def set_battery_source(source: BatterySource):
+    global _source
+    if _source is not None and _source is not source:
+        _source.close()
+    _source = source
+
+
+def get_battery_source() -> BatterySource:
+    '''
+    Returns the battery source used by the monitor, creating the default one on first use.
+    '''
+    global _source
+    if _source is None:
+        _source = make_battery_source()
+    return _source
+
+
+def read_battery() -> BatteryReading:
+    return get_battery_source().read()
@@ -0,0 +1,107 @@
+import logging
+
+from scripts.SmartPlugController import SmartPlugController, SmartPlugControllerException
+from scripts.SuspendClock import SuspendClock
+from scripts.TimeString import TimeString
+
+
+class ChargeCutoff:
+    '''
+    Keeps a countdown timer armed on the smart plug that switches it off when the battery is predicted to reach the
+    maximum, so charging stops on time even if the laptop is asleep or hibernating when it does.
+
+    The timer is updated at every battery check: armed (or re-armed when the prediction moves) while charging,
+    and cancelled once the laptop is no longer charging. The monitor's own checks still switch the plug off as before,
+    the timer is there for when the laptop cannot.
+    '''
+
+    def __init__(self, plug: SmartPlugController, rearmToleranceSecs: float = 60, clock: SuspendClock = None,
+                 logger: logging.Logger = None):
+        '''
+        - `plug` : Controller of the plug the laptop charges from.
+        - `rearmToleranceSecs` : The timer is only re-armed if the new prediction moves the cut-off by more than this
+            (or 10% of the time left, whichever is larger), so the plug is not sent a command at every check.
+        - `clock` : Clock the timer is followed on, a new `SuspendClock` if None.
+        '''
+        self.plug = plug
+        self.rearmToleranceSecs = rearmToleranceSecs
+        self.logger = logger
+        self.clock = clock if clock is not None else SuspendClock()
+
+        # Total clock time when the armed timer goes off, None if no timer is armed. The plug keeps counting down
+        # while the laptop is suspended, which is when the timer matters, so it is followed on the clock that does too.
+        self.deadline = None
+
+        self.arms = 0
+        self.cancels = 0
+        self.failures = 0
+
+    def log(self, text: str, level: int = logging.INFO):
+        if self.logger is not None:
+            self.logger.log(level, text)
+
+    def armed(self) -> bool:
+        '''
+        Returns true if a timer armed by this object is still counting down on the plug
+        '''
+        if self.deadline is not None and self.clock.total() >= self.deadline:
+            # the plug has acted on it
+            self.deadline = None
+        return self.deadline is not None
+
+    def update(self, charging: bool, secsToCeiling):
+        '''
+        Called at each battery check with the charging state and the predicted seconds until the battery reaches the
+        maximum (None if there is no prediction). Arms, re-arms or cancels the timer to match.
+        '''
+        if not charging or secsToCeiling is None:
+            self.cancel()
+            return
+
+        secsToCeiling = max(1, int(secsToCeiling))
+        if self.armed():
+            left = self.deadline - self.clock.total()
+            if abs(secsToCeiling - left) <= max(self.rearmToleranceSecs, 0.1 * left):
+                return
+
+        self.arm(secsToCeiling)
+
+    def arm(self, secs: int):
+        try:
+            res = self.plug.set_plug_timer(secs, off=True)
+        except SmartPlugControllerException as e:
+            res = None
+            self.log(f'Charge Cut-off Timer Error: {e}', level=logging.ERROR)
+
+        if res is None or res < 0:
+            self.failures += 1
+            self.deadline = None
+            self.log('Could not arm the charge cut-off timer on the plug', level=logging.WARNING)
+            return
+
+        self.arms += 1
+        self.deadline = self.clock.total() + secs
+        self.log(f'Charge Cut-off Timer: plug switches off in {TimeString.make(secs)}')
+
+    def cancel(self):
+        '''
+        Cancels the timer if one is armed
+        '''
+        if not self.armed():
+            return
+
+        try:
+            res = self.plug.cancel_plug_timer()
+        except SmartPlugControllerException as e:
+            res = None
+            self.log(f'Charge Cut-off Timer Error: {e}', level=logging.ERROR)
+
+        if res is None or res < 0:
+            # tried again at the next check
+            self.failures += 1
+            self.log('Could not cancel the charge cut-off timer on the plug', level=logging.WARNING)
+            return
+
+        self.cancels += 1
+        self.deadline = None
+        self.log('Charge Cut-off Timer: cancelled')
@@ -0,0 +1,159 @@
+import logging
+import os
+import signal
+import threading
+
+from scripts.arg_parsing import ArgumentException, CommandLineArgs, parse_args
+
+# Arguments that can change while the monitor runs, and their flags
+RELOADABLE_ARGS = {
+    'batteryMin': '-min',
+    'batteryMax': '-max',
+    'grain': '-grain',
+    'adaptivity': '-adaptivity',
+    'alertPeriod': '-alert',
+    'maxAttempts': '-max-attempts',
+    'plugIP': '-plug-ip',
+    'plugName': '-plug-name',
+    'wifi': '-home-wifi',
+    'plugPort': '-plug-port',
+}
+
+
+class ConfigReloader:
+    '''
+    Watches the monitor's -config file and reloads it when it changes, or when asked to (e.g. on SIGHUP).
+
+    Reloads are parsed and validated on the reloader's own thread. A valid config is staged and picked up by the
+    monitor with `takePending` at its next cycle boundary; an invalid one is logged and the current config keeps running.
+    Only the arguments in `RELOADABLE_ARGS` are applied, changes to any others are logged as needing a restart.
+    '''
+
+    def __init__(self, args: CommandLineArgs, argv: list, pollSecs: float = 5, logger: logging.Logger = None):
+        '''
+        - `args` : The arguments the monitor was started with.
+        - `argv` : The command line the monitor was started with, its flags still take precedence over the config file.
+        - `pollSecs` : How often the config file's modification time is checked.
+        '''
+        self.current = args
+        self.configFile = args.configJSON
+        self.argv = list(argv)
+        self.pollSecs = pollSecs
+        self.logger = logger
+
+        self.lock = threading.Lock()
+        self.pending = None
+        self.version = self.__fileVersion()
+        self.requested = False
+        self.wake = threading.Event()
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.onReload = None
+
+        self.reloads = 0
+        self.rejected = 0
+
+    def log(self, text: str, level: int = logging.INFO):
+        if self.logger is not None:
+            self.logger.log(level, text)
+
+    def __fileVersion(self):
+        try:
+            stat = os.stat(self.configFile)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def start(self, onReload=None):
+        '''
+        Starts watching. `onReload()` is called from the reloader's thread after a new config is staged.
+        '''
+        if self.thread is not None:
+            return
+        self.onReload = onReload
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.run, name='ConfigReloader', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        self.wake.set()
+        self.thread = None
+
+    def installSignalHandler(self) -> bool:
+        '''
+        Reloads the config on SIGHUP, where the platform has it. Must be called from the main thread.
+        '''
+        if not hasattr(signal, 'SIGHUP'):
+            return False
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.requestReload())
+        return True
+
+    def requestReload(self):
+        '''
+        Reloads the config even if the file looks unchanged. Safe to call from signal handlers and other threads.
+        '''
+        self.requested = True
+        self.wake.set()
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            self.wake.wait(self.pollSecs)
+            self.wake.clear()
+            if self.stopEvent.is_set():
+                return
+            self.check()
+
+    def check(self) -> bool:
+        '''
+        Reloads the config if the file changed or a reload was requested, returns true if a new config was staged
+        '''
+        version = self.__fileVersion()
+        if version == self.version and not self.requested:
+            return False
+        self.version = version
+        self.requested = False
+        return self.reload()
+
+    def reload(self) -> bool:
+        try:
+            args = parse_args(self.argv, exitOnError=False)
+            args.checkArgs()
+        except ArgumentException as e:
+            self.rejected += 1
+            self.log(f'Rejected Config Reload: {e.message}. Keeping current config', level=logging.ERROR)
+            return False
+
+        with self.lock:
+            base = self.pending if self.pending is not None else self.current
+            changes = {attr: (getattr(base, attr), getattr(args, attr)) for attr in RELOADABLE_ARGS
+                       if getattr(base, attr) != getattr(args, attr)}
+            ignored = [attr for attr, value in vars(args).items()
+                       if attr not in RELOADABLE_ARGS and attr != 'configJSON' and getattr(base, attr, value) != value]
+            if changes:
+                self.pending = args
+
+        if ignored:
+            self.log(f'Config Reload: changes to {", ".join(ignored)} need a restart to take effect', level=logging.WARNING)
+
+        if not changes:
+            self.log('Config Reload: nothing to apply')
+            return False
+
+        self.log('Config Reload Staged: {}'.format(', '.join(f'{RELOADABLE_ARGS[a]} {old} -> {new}' for a, (old, new) in changes.items())))
+        if self.onReload is not None:
+            self.onReload()
+        return True
+
+    def takePending(self):
+        '''
+        Returns the staged config (a `CommandLineArgs`) and makes it current, or None if there is nothing new
+        '''
+        with self.lock:
+            args = self.pending
+            if args is None:
+                return None
+            self.pending = None
+            self.current = args
+            self.reloads += 1
+        return args
@@ -0,0 +1,109 @@
+import threading
+
+"""
+Credentials (passwords) stored in the OS credential store, looked up through keyring.
+
+Keyring backends can take hundreds of milliseconds per lookup, so each credential is looked up once and then kept
+in this process's memory for as long as it runs (it is never written anywhere). Credentials that are all needed at
+start up can be resolved together with `prefetch`, which looks them up concurrently.
+"""
+
+
+class CredentialLookup:
+    '''
+    A credential that is being, or has been, looked up
+    '''
+    __slots__ = ('done', 'password', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.password = None
+        self.error = None
+
+
+class CredentialProvider:
+    def __init__(self, lookupFnc=None):
+        '''
+        - `lookupFnc` : Called as `lookupFnc(store, username)` to look up a password, defaults to `keyring.get_password`.
+        '''
+        self.lookupFnc = lookupFnc
+        self.lock = threading.Lock()
+        # (store, username) -> CredentialLookup
+        self.credentials = {}
+
+        # lookups sent to the credential store, and requests answered from memory
+        self.lookups = 0
+        self.hits = 0
+
+    def __lookup(self, store: str, username: str):
+        if self.lookupFnc is not None:
+            return self.lookupFnc(store, username)
+        import keyring
+        return keyring.get_password(store, username)
+
+    def __resolve(self, key: tuple, entry: CredentialLookup):
+        try:
+            entry.password = self.__lookup(*key)
+        except Exception as e:
+            entry.error = e
+            # a failed lookup is not remembered, the next request tries again
+            with self.lock:
+                if self.credentials.get(key) is entry:
+                    del self.credentials[key]
+        finally:
+            entry.done.set()
+
+    def __entry(self, store: str, username: str) -> tuple:
+        '''
+        Returns (entry, True if the caller has to look it up)
+        '''
+        key = (store, username)
+        with self.lock:
+            entry = self.credentials.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry, False
+            entry = CredentialLookup()
+            self.credentials[key] = entry
+            self.lookups += 1
+            return entry, True
+
+    def get(self, store: str, username: str):
+        '''
+        Returns the password stored for `username` under `store`, or None if there is none.
+        Only the first request for a credential looks it up, requests made while it is being looked up wait for it.
+        '''
+        entry, mine = self.__entry(store, username)
+        if mine:
+            self.__resolve((store, username), entry)
+        else:
+            entry.done.wait()
+
+        if entry.error is not None:
+            raise entry.error
+        return entry.password
+
+    def prefetch(self, credentials: list):
+        '''
+        Looks up the (store, username) pairs in `credentials` concurrently and waits for them,
+        so later `get` calls for them return immediately. Lookup errors are raised by `get`.
+        '''
+        entries = []
+        for store, username in set(credentials):
+            entry, mine = self.__entry(store, username)
+            if mine:
+                threading.Thread(target=self.__resolve, args=((store, username), entry), name='CredentialLookup', daemon=True).start()
+            entries.append(entry)
+
+        for entry in entries:
+            entry.done.wait()
+
+    def forget(self):
+        '''
+        Drops every credential held in memory.
+        '''
+        with self.lock:
+            self.credentials = {}
+
+
+credentials = CredentialProvider()
@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import sys
+import threading
+from time import monotonic
+
+from scripts.MetricsRegistry import scheduler_wakeups
+
+
+class ScheduledTimer:
+    '''
+    Handle to a timer registered with `DeadlineScheduler`, pass it to `cancel` to remove it.
+    '''
+    def __init__(self, deadline: float, callback, name: str, period: float = None):
+        self.deadline = deadline
+        self.callback = callback
+        self.name = name
+        self.period = period
+        self.cancelled = False
+
+
+class DeadlineScheduler:
+    '''
+    Single place where the monitor waits for time to pass.
+
+    Timers (one-shot or periodic callbacks) are kept in a heap ordered by deadline, and event sources
+    running on other threads `post` events to wake the waiting thread. `sleep` blocks in one wait until
+    the earliest of: the sleep's own deadline, the next timer, or a posted event.
+
+    Timers due within `coalesceSecs` of each other are fired on the same wakeup, so e.g. a countdown
+    redraw and an unlock signal check never wake the process separately.
+    '''
+
+    def __init__(self, coalesceSecs: float = 0.25, maxWaitSliceSecs: float = None):
+        '''
+        - `coalesceSecs` : Timers due this close to the one that woke the scheduler are fired with it.
+        - `maxWaitSliceSecs` : Longest single blocking wait. Lock waits cannot be interrupted by Ctrl+C on Windows,
+            so interactive Windows runs need a bound, everything else can leave this as None.
+        '''
+        self.coalesceSecs = coalesceSecs
+        self.maxWaitSliceSecs = maxWaitSliceSecs
+        self.heap = []
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.events = []
+
+        self.wakeups = 0
+        self.timersFired = 0
+        self.cycleWakeups = 0
+
+    @staticmethod
+    def now() -> float:
+        return monotonic()
+
+    @staticmethod
+    def interactiveSlice(headless: bool):
+        '''
+        Returns the `maxWaitSliceSecs` needed for Ctrl+C to stay responsive on this platform
+        '''
+        if sys.platform == 'win32' and not headless:
+            return 0.5
+        return None
+
+    def schedule(self, delaySecs: float, callback, name: str = '', period: float = None) -> ScheduledTimer:
+        '''
+        Calls `callback()` once `delaySecs` have passed, and every `period` seconds after that if `period` is given.
+        Callbacks run on the thread that is sleeping, exceptions they raise end that sleep.
+        '''
+        timer = ScheduledTimer(self.now() + delaySecs, callback, name, period=period)
+        with self.cond:
+            heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+            self.cond.notify_all()
+        return timer
+
+    def every(self, periodSecs: float, callback, name: str = '') -> ScheduledTimer:
+        return self.schedule(periodSecs, callback, name=name, period=periodSecs)
+
+    def cancel(self, timer: ScheduledTimer):
+        # Lazily removed from the heap when it reaches the top
+        if timer is not None:
+            timer.cancelled = True
+
+    def post(self, name: str, payload=None):
+        '''
+        Posts an event from any thread, waking the sleeping thread
+        '''
+        with self.cond:
+            self.events.append((name, payload))
+            self.cond.notify_all()
+
+    def hasEvent(self, name: str) -> bool:
+        with self.cond:
+            return any(n == name for n, _ in self.events)
+
+    def takeEvent(self, names=None):
+        '''
+        Removes and returns the oldest pending event (name, payload) whose name is in `names` (any if None)
+        '''
+        with self.cond:
+            for i, (n, payload) in enumerate(self.events):
+                if names is None or n in names:
+                    return self.events.pop(i)
+        return None
+
+    def __popDue(self, now: float) -> list:
+        due = []
+        while self.heap:
+            deadline, _, timer = self.heap[0]
+            if timer.cancelled:
+                heapq.heappop(self.heap)
+                continue
+            if deadline > now + self.coalesceSecs:
+                break
+            heapq.heappop(self.heap)
+            due.append(timer)
+            if timer.period is not None:
+                # next deadline follows the previous one so periodic timers do not drift
+                timer.deadline = max(deadline + timer.period, now)
+                heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+        return due
+
+    def __nextTimerDeadline(self):
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def sleep(self, secs: float, wakeOn=None):
+        '''
+        Blocks for `secs` seconds, running timers as they come due.
+
+        Returns early with the event (name, payload) if an event named in `wakeOn` is posted
+        (any event if `wakeOn` is None), otherwise returns None once the time has passed.
+        Pending events are left for the caller to take, they are not consumed by the sleep.
+        '''
+        deadline = self.now() + secs
+
+        while True:
+            with self.cond:
+                for n, payload in self.events:
+                    if wakeOn is None or n in wakeOn:
+                        return n, payload
+
+                now = self.now()
+                if now >= deadline:
+                    return None
+
+                wakeAt = deadline
+                timerDeadline = self.__nextTimerDeadline()
+                if timerDeadline is not None:
+                    wakeAt = min(wakeAt, timerDeadline)
+
+                timeout = wakeAt - now
+                if self.maxWaitSliceSecs is not None:
+                    timeout = min(timeout, self.maxWaitSliceSecs)
+
+                if timeout > 0:
+                    self.cond.wait(timeout)
+                    self.wakeups += 1
+                    self.cycleWakeups += 1
+                    scheduler_wakeups.inc()
+
+                due = self.__popDue(self.now())
+
+            # Callbacks run outside the lock so they can schedule, cancel and post
+            for timer in due:
+                self.timersFired += 1
+                timer.callback()
+
+    def endCycle(self) -> int:
+        '''
+        Returns the number of wakeups since the last call and resets the count
+        '''
+        with self.cond:
+            wakeups = self.cycleWakeups
+            self.cycleWakeups = 0
+        return wakeups
@@ -1,9 +1,6 @@
 import os
-import smtplib
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email import encoders
+
+# smtplib and email are imported when an email is sent, most runs of the monitor never send one
 
 class EmailBotException(Exception):
     def __init__(self, message):
@@ -35,11 +32,35 @@ class EmailBot:
         if otherRecipients is None:
             otherRecipients = []
 
+        if mainRecipient not in otherRecipients: otherRecipients.insert(0, mainRecipient)
+
+        msg = self.makeMessage(subject, body, mainRecipient, otherRecipients, files=files, important=important, content=content)
+
+        import smtplib
+
+        # connect to email smpt server with this port, the session is closed even if sending fails
+        with smtplib.SMTP(self.__SMTPServer, self.__SMTPPort) as session:
+            #enable security
+            session.starttls()
+
+            #log in with the credentials of the bot
+            session.login(self.__email, self.__password)
+
+            session.sendmail(self.__email, otherRecipients, msg.as_string())
+
+    def makeMessage(self, subject: str, body: str, mainRecipient: str, otherRecipients: list, files: list = None, important: bool = False, content="text"):
+        '''
+        Builds the message sent by `sendEmail`, see `sendEmail` for the arguments.
+        `otherRecipients` should already include `mainRecipient`.
+        '''
+        from email import encoders
+        from email.mime.base import MIMEBase
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+
         if files is None:
             files = []
 
-        if mainRecipient not in otherRecipients: otherRecipients.insert(0, mainRecipient)
-        
         msg = MIMEMultipart()
         msg['Subject'] = subject
         msg['From'] = self.__email
@@ -61,16 +82,5 @@ class EmailBot:
                 encoders.encode_base64(part)
                 part.add_header('Content-Disposition', 'attachment; filename="{0}"'.format(os.path.basename(filename)))
                 msg.attach(part)
-        
-        # connect to email smpt server with this port
-        session = smtplib.SMTP(self.__SMTPServer, self.__SMTPPort)
-
-        #enable security
-        session.starttls()
 
-        #log in with the credentials of the bot
-        session.login(self.__email, self.__password)
-
-        session.sendmail(self.__email, otherRecipients, msg.as_string())
-        
-        session.quit()
\ No newline at end of file
+        return msg
\ No newline at end of file
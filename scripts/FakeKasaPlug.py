@@ -0,0 +1,464 @@
+import asyncio
+import json
+import random
+import struct
+import threading
+import time
+
+"""
+A local stand-in for a Kasa smart plug.
+
+The fake speaks the Kasa local protocol (JSON over TCP port 9999, each message prefixed with its
+big-endian length and XOR "autokey" encrypted) well enough for `kasa.SmartPlug` to update, query and
+toggle it. Each plug can be made to misbehave with a `FakePlugBehaviour`, so plug control latency and
+retry logic can be measured repeatably without hardware, and `FakePlugFleet` runs many plugs on
+consecutive ports.
+"""
+
+DEFAULT_PORT = 9999
+
+OUTCOME_OK = 'ok'
+# connection is closed without a response
+OUTCOME_LOSS = 'loss'
+# set_relay_state is acknowledged but the relay is not changed
+OUTCOME_WRONG_STATE = 'wrong_state'
+# request is read but never answered, the client times out
+OUTCOME_TIMEOUT = 'timeout'
+
+OUTCOMES = (OUTCOME_OK, OUTCOME_LOSS, OUTCOME_WRONG_STATE, OUTCOME_TIMEOUT)
+
+UNSUPPORTED = {'err_code': -1, 'err_msg': 'module not support'}
+
+
+class FakeKasaPlugException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def encrypt(data: bytes) -> bytes:
+    '''
+    Encrypts `data` with the Kasa XOR autokey cipher and prefixes it with its length
+    '''
+    key = 171
+    out = bytearray(len(data))
+    for i, b in enumerate(data):
+        key ^= b
+        out[i] = key
+    return struct.pack('>I', len(data)) + bytes(out)
+
+
+def decrypt(data: bytes) -> bytes:
+    '''
+    Decrypts a message body (without the length prefix) encrypted with the Kasa XOR autokey cipher
+    '''
+    key = 171
+    out = bytearray(len(data))
+    for i, c in enumerate(data):
+        out[i] = key ^ c
+        key = c
+    return bytes(out)
+
+
+class FakePlugBehaviour:
+    '''
+    How a fake plug responds to each request.
+
+    Every request is delayed by `latencySecs` plus up to `jitterSecs`, then gets one outcome:
+    the next entry of `script` while it lasts, otherwise one picked at random using the rates.
+    '''
+
+    def __init__(self,
+                 latencySecs: float = 0,
+                 jitterSecs: float = 0,
+                 lossRate: float = 0,
+                 wrongStateRate: float = 0,
+                 timeoutRate: float = 0,
+                 script: list = None,
+                 seed: int = None):
+        '''
+        - `latencySecs` : Delay before each response.
+        - `jitterSecs` : Extra random delay, between 0 and this, before each response.
+        - `lossRate` : Chance of closing the connection instead of responding.
+        - `wrongStateRate` : Chance of acknowledging a relay change without making it.
+        - `timeoutRate` : Chance of never responding to a request.
+        - `script` : Outcomes (ok, loss, wrong_state, timeout) for the first requests, in order.
+        - `seed` : Seed for the random outcomes and jitter, so runs can be repeated.
+        '''
+        for name, rate in (('lossRate', lossRate), ('wrongStateRate', wrongStateRate), ('timeoutRate', timeoutRate)):
+            if not 0 <= rate <= 1:
+                raise FakeKasaPlugException(f'{name} must be between 0 and 1, got {rate}')
+
+        if lossRate + wrongStateRate + timeoutRate > 1:
+            raise FakeKasaPlugException('Loss, wrong state and timeout rates add up to more than 1')
+
+        script = list(script) if script else []
+        for outcome in script:
+            if outcome not in OUTCOMES:
+                raise FakeKasaPlugException(f'Unknown outcome "{outcome}", outcomes are: {", ".join(OUTCOMES)}')
+
+        self.latencySecs = latencySecs
+        self.jitterSecs = jitterSecs
+        self.lossRate = lossRate
+        self.wrongStateRate = wrongStateRate
+        self.timeoutRate = timeoutRate
+        self.script = script
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def fromDict(data: dict, seed: int = None):
+        '''
+        Makes a behaviour from a plug entry of a fake plug script file, see `FakePlugFleet.fromScript`
+        '''
+        return FakePlugBehaviour(
+            latencySecs=data.get('latency', 0),
+            jitterSecs=data.get('jitter', 0),
+            lossRate=data.get('loss', 0),
+            wrongStateRate=data.get('wrong_state', 0),
+            timeoutRate=data.get('timeout', 0),
+            script=data.get('outcomes'),
+            seed=data.get('seed', seed))
+
+    def delay(self) -> float:
+        if self.jitterSecs <= 0:
+            return self.latencySecs
+        return self.latencySecs + self.random.uniform(0, self.jitterSecs)
+
+    def nextOutcome(self) -> str:
+        if self.script:
+            return self.script.pop(0)
+
+        roll = self.random.random()
+        for outcome, rate in ((OUTCOME_LOSS, self.lossRate), (OUTCOME_WRONG_STATE, self.wrongStateRate), (OUTCOME_TIMEOUT, self.timeoutRate)):
+            if roll < rate:
+                return outcome
+            roll -= rate
+        return OUTCOME_OK
+
+
+class FakeKasaPlug:
+    '''
+    One fake plug (an HS103 by default) listening on `host`:`port`.
+
+    Supports the `system` module (get_sysinfo, set_relay_state, set_led_off, set_dev_alias) and the
+    `count_down` rule module, other modules answer "module not support" like a real plug that lacks them.
+    '''
+
+    def __init__(self,
+                 port: int = DEFAULT_PORT,
+                 host: str = '127.0.0.1',
+                 alias: str = 'Fake Plug',
+                 on: bool = False,
+                 behaviour: FakePlugBehaviour = None,
+                 model: str = 'HS103(US)'):
+        self.host = host
+        self.port = port
+        self.alias = alias
+        self.model = model
+        self.behaviour = behaviour if behaviour is not None else FakePlugBehaviour()
+
+        self.relayState = 1 if on else 0
+        self.onSince = time.monotonic() if on else None
+        self.ledOff = 0
+        self.countdownRules = []
+        self.server = None
+        self.connections = set()
+
+        # counters, for checking what a client actually went through
+        self.requests = 0
+        self.relayChanges = 0
+        self.dropped = 0
+        self.timedOut = 0
+        self.ignoredSets = 0
+
+    # stable, unique ids derived from the port (known once started when port 0 is used)
+    @property
+    def mac(self) -> str:
+        return '50:C7:BF:00:{:02X}:{:02X}'.format((self.port >> 8) & 0xFF, self.port & 0xFF)
+
+    @property
+    def deviceId(self) -> str:
+        return f'{self.port:040X}'
+
+    @property
+    def isOn(self) -> bool:
+        return self.relayState == 1
+
+    def setRelay(self, state: int):
+        state = 1 if state else 0
+        if state != self.relayState:
+            self.relayChanges += 1
+            self.onSince = time.monotonic() if state else None
+        self.relayState = state
+
+    def sysinfo(self) -> dict:
+        rule = self.countdownRules[0] if self.countdownRules else None
+        return {
+            'sw_ver': '1.0.5 Build 201210 Rel.120316',
+            'hw_ver': '5.0',
+            'model': self.model,
+            'deviceId': self.deviceId,
+            'oemId': 'B' * 32,
+            'hwId': 'C' * 32,
+            'rssi': -50,
+            'latitude_i': 0,
+            'longitude_i': 0,
+            'alias': self.alias,
+            'status': 'new',
+            'obd_src': 'tplink',
+            'mic_type': 'IOT.SMARTPLUGSWITCH',
+            'feature': 'TIM',
+            'mac': self.mac,
+            'updating': 0,
+            'led_off': self.ledOff,
+            'relay_state': self.relayState,
+            'on_time': 0 if self.onSince is None else int(time.monotonic() - self.onSince),
+            'icon_hash': '',
+            'dev_name': 'Smart Wi-Fi Plug Mini',
+            'active_mode': 'count_down' if rule is not None else 'none',
+            'next_action': {'type': -1},
+            'ntc_state': 0,
+            'err_code': 0,
+        }
+
+    def __system(self, method: str, params: dict, outcome: str) -> dict:
+        if method == 'get_sysinfo':
+            return self.sysinfo()
+        if method == 'set_relay_state':
+            if outcome == OUTCOME_WRONG_STATE:
+                self.ignoredSets += 1
+            else:
+                self.setRelay(params.get('state', 0))
+            return {'err_code': 0}
+        if method == 'set_led_off':
+            self.ledOff = 1 if params.get('off') else 0
+            return {'err_code': 0}
+        if method == 'set_dev_alias':
+            self.alias = params.get('alias', self.alias)
+            return {'err_code': 0}
+        return {'err_code': -2, 'err_msg': 'member not support'}
+
+    def __countdown(self, method: str, params: dict) -> dict:
+        if method == 'get_rules':
+            rules = []
+            for rule in self.countdownRules:
+                remain = max(0, int(round(rule['deadline'] - time.monotonic())))
+                rules.append({k: v for k, v in rule.items() if k != 'deadline'} | {'remain': remain})
+            return {'rule_list': rules, 'err_code': 0}
+        if method == 'add_rule':
+            if self.countdownRules:
+                # real plugs only hold one countdown rule
+                return {'err_code': -10, 'err_msg': 'table is full'}
+            rule = {
+                'id': f'{len(self.countdownRules) + 1:032X}',
+                'name': params.get('name', ''),
+                'enable': params.get('enable', 1),
+                'delay': params.get('delay', 0),
+                'act': params.get('act', 0),
+                'deadline': time.monotonic() + params.get('delay', 0),
+            }
+            self.countdownRules.append(rule)
+            return {'id': rule['id'], 'err_code': 0}
+        if method in ('delete_all_rules', 'delete_rule'):
+            self.countdownRules = [r for r in self.countdownRules if method == 'delete_rule' and r['id'] != params.get('id')]
+            return {'err_code': 0}
+        if method == 'edit_rule':
+            for rule in self.countdownRules:
+                if rule['id'] == params.get('id'):
+                    rule.update({k: params[k] for k in ('name', 'enable', 'delay', 'act') if k in params})
+                    rule['deadline'] = time.monotonic() + rule['delay']
+                    return {'err_code': 0}
+            return {'err_code': -14, 'err_msg': 'entry not exist'}
+        return {'err_code': -2, 'err_msg': 'member not support'}
+
+    def runCountdown(self):
+        '''
+        Applies any countdown rule that has run out, like the plug's own timer would
+        '''
+        now = time.monotonic()
+        for rule in list(self.countdownRules):
+            if rule['enable'] and now >= rule['deadline']:
+                self.setRelay(rule['act'])
+                self.countdownRules.remove(rule)
+
+    def handleRequest(self, request: dict, outcome: str = OUTCOME_OK) -> dict:
+        '''
+        Returns the response to a decoded request e.g. {"system": {"get_sysinfo": {}}}
+        '''
+        self.runCountdown()
+        response = {}
+        for module, methods in request.items():
+            if module == 'system':
+                response[module] = {m: self.__system(m, p or {}, outcome) for m, p in methods.items()}
+            elif module == 'count_down':
+                response[module] = {m: self.__countdown(m, p or {}) for m, p in methods.items()}
+            else:
+                response[module] = dict(UNSUPPORTED)
+        return response
+
+    async def __handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(4)
+                    body = await reader.readexactly(struct.unpack('>I', header)[0])
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+
+                self.requests += 1
+                outcome = self.behaviour.nextOutcome()
+                delay = self.behaviour.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                if outcome == OUTCOME_LOSS:
+                    self.dropped += 1
+                    return
+
+                if outcome == OUTCOME_TIMEOUT:
+                    # hold the connection open until the client gives up
+                    self.timedOut += 1
+                    await reader.read()
+                    return
+
+                try:
+                    request = json.loads(decrypt(body))
+                except ValueError:
+                    return
+
+                response = self.handleRequest(request, outcome=outcome)
+                writer.write(encrypt(json.dumps(response, separators=(',', ':')).encode('utf-8')))
+                await writer.drain()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__handleConnection, self.host, self.port)
+        # port 0 picks a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            # clients may keep their connection open, close them or wait_closed never returns
+            connections = list(self.connections)
+            for task in connections:
+                task.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+            await self.server.wait_closed()
+            self.server = None
+
+    def stats(self) -> dict:
+        return {
+            'port': self.port,
+            'on': self.isOn,
+            'requests': self.requests,
+            'relay_changes': self.relayChanges,
+            'dropped': self.dropped,
+            'timed_out': self.timedOut,
+            'ignored_sets': self.ignoredSets,
+        }
+
+
+class FakePlugFleet:
+    '''
+    Runs many fake plugs in one event loop, either in the calling coroutine (`start`/`stop`) or on a
+    background thread (`startThread`/`stopThread`) so synchronous code like `SmartPlugController` can use them.
+    '''
+
+    def __init__(self, plugs: list):
+        self.plugs = plugs
+        self.loop = None
+        self.thread = None
+
+    @staticmethod
+    def consecutive(count: int, startPort: int = DEFAULT_PORT, host: str = '127.0.0.1', seed: int = None, **behaviour):
+        '''
+        Makes `count` plugs on ports `startPort`, `startPort` + 1... each with its own `FakePlugBehaviour(**behaviour)`
+        '''
+        plugs = []
+        for i in range(count):
+            plugSeed = None if seed is None else seed + i
+            plugs.append(FakeKasaPlug(
+                port=startPort + i if startPort else 0,
+                host=host,
+                alias=f'Fake Plug {i + 1}',
+                behaviour=FakePlugBehaviour(seed=plugSeed, **behaviour)))
+        return FakePlugFleet(plugs)
+
+    @staticmethod
+    def fromScript(path: str, startPort: int = DEFAULT_PORT, host: str = '127.0.0.1', seed: int = None):
+        '''
+        Makes plugs from a JSON script file:
+
+            {"plugs": [{"port": 9999, "alias": "Desk", "on": true, "latency": 0.2, "jitter": 0.1,
+                        "loss": 0.1, "wrong_state": 0, "timeout": 0, "outcomes": ["ok", "loss", "timeout"]}]}
+
+        Every key is optional, plugs without a port are given consecutive ports from `startPort`.
+        '''
+        with open(path, 'r') as file:
+            data = json.load(file)
+
+        plugs = []
+        for i, entry in enumerate(data.get('plugs', [])):
+            plugSeed = None if seed is None else seed + i
+            plugs.append(FakeKasaPlug(
+                port=entry.get('port', startPort + i if startPort else 0),
+                host=entry.get('host', host),
+                alias=entry.get('alias', f'Fake Plug {i + 1}'),
+                on=entry.get('on', False),
+                behaviour=FakePlugBehaviour.fromDict(entry, seed=plugSeed)))
+
+        if not plugs:
+            raise FakeKasaPlugException(f'No plugs in script "{path}"')
+        return FakePlugFleet(plugs)
+
+    async def start(self):
+        for plug in self.plugs:
+            await plug.start()
+
+    async def stop(self):
+        for plug in self.plugs:
+            await plug.stop()
+
+    def startThread(self):
+        '''
+        Starts the plugs on an event loop in a background thread, returns once they are listening
+        '''
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        errors = []
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.loop.run_until_complete(self.start())
+            except OSError as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name='FakePlugFleet', daemon=True)
+        self.thread.start()
+        started.wait()
+        if errors:
+            raise FakeKasaPlugException(f'Could not start fake plugs: {errors[0]}')
+
+    def stopThread(self):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop, self.thread = None, None
+
+    def stats(self) -> list:
+        return [plug.stats() for plug in self.plugs]
@@ -0,0 +1,216 @@
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+import logging
+
+
+class FleetAgentException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class FleetAgent:
+    '''
+    Batches the monitor's samples, decisions and plug outcomes and pushes them to a fleet collector
+    (see `scripts/FleetCollector.py`).
+
+    Records are pushed from a background thread so the monitor never blocks on the network.
+    While the collector is unreachable, records are appended to a local buffer file and are
+    resent (oldest first) once the collector can be reached again.
+    '''
+
+    INGEST_PATH = '/ingest'
+
+    def __init__(self, collectorUrl: str, bufferFile: str = None, hostName: str = None, batchSize: int = 200,
+                 flushPeriodSecs: int = 60, maxBufferedRecords: int = 100000, timeoutSecs: float = 5,
+                 logger: logging.Logger = None):
+        '''
+        Initialize a fleet agent.
+        - `collectorUrl` : Base URL of the collector e.g. http://127.0.0.1:8470
+        - `bufferFile` : File that records are buffered to while the collector is unreachable. No buffering if None.
+        - `hostName` : Name this monitor reports as, defaults to the machine's host name.
+        - `batchSize` : Number of records that triggers an early push.
+        - `flushPeriodSecs` : Maximum time records are held in memory before a push is attempted.
+        - `maxBufferedRecords` : Oldest buffered records are dropped past this count.
+        '''
+        if not collectorUrl.startswith(('http://', 'https://')):
+            raise FleetAgentException(f'Collector URL must be http:// or https://, got "{collectorUrl}"')
+
+        self.ingestUrl = collectorUrl.rstrip('/') + FleetAgent.INGEST_PATH
+        self.bufferFile = bufferFile
+        self.hostName = hostName if hostName else socket.gethostname()
+        self.batchSize = batchSize
+        self.flushPeriodSecs = flushPeriodSecs
+        self.maxBufferedRecords = maxBufferedRecords
+        self.timeoutSecs = timeoutSecs
+        self.logger = logger
+
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeEvent = threading.Event()
+        self.stopEvent = threading.Event()
+        self.thread = None
+
+        # Counters, useful for logging how the agent is doing
+        self.recordsSent = 0
+        self.pushFailures = 0
+
+    def log(self, text: str, level: int = logging.INFO):
+        if self.logger is None:
+            return
+
+        self.logger.log(level, text)
+
+    def start(self):
+        if self.thread is not None:
+            return
+
+        self.thread = threading.Thread(target=self.__run, name='FleetAgent', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stops the background thread, attempting one final push of pending records.
+        '''
+        if self.thread is None:
+            return
+
+        self.stopEvent.set()
+        self.wakeEvent.set()
+        self.thread.join(timeout=self.timeoutSecs * 2)
+        self.thread = None
+
+    def record(self, kind: str, **fields):
+        '''
+        Queues a record of type `kind` with the given fields, timestamped with the current time.
+        '''
+        rec = {'t': time.time(), 'k': kind}
+        rec.update(fields)
+
+        with self.lock:
+            self.pending.append(rec)
+            full = len(self.pending) >= self.batchSize
+
+        if full:
+            self.wakeEvent.set()
+
+    def recordSample(self, percent, charging):
+        self.record('sample', percent=percent, charging=bool(charging))
+
+    def recordDecision(self, decision: str, percent, charging):
+        self.record('decision', decision=decision, percent=percent, charging=bool(charging))
+
+    def recordPlugOutcome(self, action: str, result: int):
+        self.record('plug', action=action, result=result)
+
+    def __run(self):
+        while True:
+            self.wakeEvent.wait(timeout=self.flushPeriodSecs)
+            self.wakeEvent.clear()
+            self.flush()
+            if self.stopEvent.is_set():
+                return
+
+    def flush(self):
+        '''
+        Pushes buffered and pending records to the collector.
+        Records that could not be sent are appended to the buffer file.
+        '''
+        with self.lock:
+            records = self.pending
+            self.pending = []
+
+        buffered = self.__readBuffer()
+        if not records and not buffered:
+            return
+
+        # Send the buffered records first so the collector receives them in order
+        sent_buffered = True
+        for start in range(0, len(buffered), self.batchSize):
+            if not self.__push(buffered[start:start + self.batchSize]):
+                sent_buffered = False
+                # keep what is left of the buffer for the next attempt
+                buffered = buffered[start:]
+                break
+
+        if sent_buffered:
+            self.__clearBuffer()
+            if records and self.__push(records):
+                return
+        else:
+            self.__writeBuffer(buffered, truncate=True)
+
+        self.__writeBuffer(records)
+
+    def __push(self, records: list) -> bool:
+        if not records:
+            return True
+
+        # urllib.request pulls in http.client and ssl, so it is only imported once there is something to send
+        import urllib.error
+        import urllib.request
+
+        body = zlib.compress(json.dumps({'host': self.hostName, 'records': records},
+                                        separators=(',', ':')).encode('utf-8'))
+        req = urllib.request.Request(self.ingestUrl, data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'deflate',
+        })
+
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeoutSecs) as resp:
+                resp.read()
+        except (urllib.error.URLError, OSError) as e:
+            self.pushFailures += 1
+            self.log(f'Fleet collector push failed: {e}', level=logging.WARNING)
+            return False
+
+        self.recordsSent += len(records)
+        return True
+
+    def __readBuffer(self) -> list:
+        if self.bufferFile is None or not os.path.exists(self.bufferFile):
+            return []
+
+        records = []
+        with open(self.bufferFile, 'r') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # a partially written line from an interrupted run
+                    continue
+
+        return records
+
+    def __writeBuffer(self, records: list, truncate=False):
+        if self.bufferFile is None:
+            if records:
+                self.log(f'Dropped {len(records)} fleet records (no buffer file)', level=logging.WARNING)
+            return
+
+        if not truncate:
+            records = self.__readBuffer() + records
+
+        if len(records) > self.maxBufferedRecords:
+            dropped = len(records) - self.maxBufferedRecords
+            records = records[dropped:]
+            self.log(f'Fleet buffer full, dropped {dropped} oldest records', level=logging.WARNING)
+
+        tmp = self.bufferFile + '.tmp'
+        with open(tmp, 'w') as file:
+            for rec in records:
+                file.write(json.dumps(rec, separators=(',', ':')))
+                file.write('\n')
+        os.replace(tmp, self.bufferFile)
+
+    def __clearBuffer(self):
+        if self.bufferFile is not None and os.path.exists(self.bufferFile):
+            os.remove(self.bufferFile)
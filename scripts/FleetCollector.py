@@ -0,0 +1,213 @@
+import asyncio
+import json
+import zlib
+from bisect import bisect_left, bisect_right
+from urllib.parse import urlsplit, parse_qs
+
+
+class FleetCollectorException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class HostIndex:
+    '''
+    Records reported by a single host, kept sorted by timestamp.
+    Timestamps are held in their own list so time range lookups are a bisect.
+    '''
+    def __init__(self):
+        self.times = []
+        self.records = []
+
+    def add(self, rec: dict):
+        t = rec['t']
+        # Agents report in order, so the common case is a plain append
+        if not self.times or t >= self.times[-1]:
+            self.times.append(t)
+            self.records.append(rec)
+            return
+
+        ind = bisect_right(self.times, t)
+        self.times.insert(ind, t)
+        self.records.insert(ind, rec)
+
+    def range(self, since: float = None, until: float = None) -> list:
+        lo = 0 if since is None else bisect_left(self.times, since)
+        hi = len(self.times) if until is None else bisect_right(self.times, until)
+        return self.records[lo:hi]
+
+
+class FleetCollector:
+    '''
+    Asyncio HTTP service that receives batches from fleet agents (see `scripts/FleetAgent.py`)
+    and keeps an in-memory index of the records by host and time.
+
+    Endpoints:
+    - `POST /ingest` : Body is a (optionally deflate compressed) JSON object `{"host": ..., "records": [...]}`
+    - `GET /hosts` : Lists known hosts with their record counts and last report time
+    - `GET /query?host=<host>&since=<unix time>&until=<unix time>&kind=<record kind>` : Returns matching records
+
+    Only the small subset of HTTP/1.1 needed by the agent is implemented, with keep-alive support
+    so load generators can reuse connections.
+    '''
+
+    MAX_BODY_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8470, maxRecordsPerHost: int = 500000):
+        self.host = host
+        self.port = port
+        self.maxRecordsPerHost = maxRecordsPerHost
+        self.index = {}
+        self.server = None
+
+        self.batchesReceived = 0
+        self.recordsReceived = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__handleConnection, self.host, self.port)
+        # port 0 lets the OS pick a free port, report the one actually used
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serveForever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+
+    def ingest(self, payload: dict) -> int:
+        '''
+        Adds a decoded batch to the index, returns the number of records accepted.
+        '''
+        host = payload.get('host')
+        records = payload.get('records')
+        if not isinstance(host, str) or not isinstance(records, list):
+            raise FleetCollectorException('Batch must have a "host" string and a "records" list')
+
+        hostIndex = self.index.get(host)
+        if hostIndex is None:
+            hostIndex = HostIndex()
+            self.index[host] = hostIndex
+
+        accepted = 0
+        for rec in records:
+            if not isinstance(rec, dict) or not isinstance(rec.get('t'), (int, float)):
+                continue
+            hostIndex.add(rec)
+            accepted += 1
+
+        # bound memory by dropping the oldest records of chatty hosts
+        excess = len(hostIndex.times) - self.maxRecordsPerHost
+        if excess > 0:
+            del hostIndex.times[:excess]
+            del hostIndex.records[:excess]
+
+        self.batchesReceived += 1
+        self.recordsReceived += accepted
+        return accepted
+
+    def query(self, host: str, since: float = None, until: float = None, kind: str = None) -> list:
+        hostIndex = self.index.get(host)
+        if hostIndex is None:
+            return []
+
+        records = hostIndex.range(since, until)
+        if kind is not None:
+            records = [r for r in records if r.get('k') == kind]
+        return records
+
+    def hosts(self) -> dict:
+        return {
+            host: {'records': len(hi.times), 'last': hi.times[-1] if hi.times else None}
+            for host, hi in self.index.items()
+        }
+
+    async def __handleConnection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                keep_alive = await self.__handleRequest(reader, writer)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def __handleRequest(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await self.__respond(writer, 400, {'error': 'Malformed request line'}, False)
+            return False
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+        length = int(headers.get('content-length', 0))
+        if length > FleetCollector.MAX_BODY_BYTES:
+            await self.__respond(writer, 413, {'error': 'Body too large'}, False)
+            return False
+        body = await reader.readexactly(length) if length > 0 else b''
+
+        url = urlsplit(target)
+
+        try:
+            if method == 'POST' and url.path == '/ingest':
+                if headers.get('content-encoding', '') == 'deflate':
+                    body = zlib.decompress(body)
+                accepted = self.ingest(json.loads(body))
+                await self.__respond(writer, 200, {'accepted': accepted}, keep_alive)
+
+            elif method == 'GET' and url.path == '/hosts':
+                await self.__respond(writer, 200, self.hosts(), keep_alive)
+
+            elif method == 'GET' and url.path == '/query':
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if 'host' not in params:
+                    raise FleetCollectorException('Query requires a host parameter')
+                records = self.query(
+                    params['host'],
+                    since=float(params['since']) if 'since' in params else None,
+                    until=float(params['until']) if 'until' in params else None,
+                    kind=params.get('kind'))
+                await self.__respond(writer, 200, {'records': records}, keep_alive)
+
+            else:
+                await self.__respond(writer, 404, {'error': f'No route for {method} {url.path}'}, keep_alive)
+
+        except (FleetCollectorException, ValueError, zlib.error) as e:
+            await self.__respond(writer, 400, {'error': str(e)}, keep_alive)
+
+        return keep_alive
+
+    @staticmethod
+    async def __respond(writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large'}
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        head = (
+            f'HTTP/1.1 {status} {reasons.get(status, "")}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
@@ -0,0 +1,538 @@
+import logging
+import math
+import queue
+import threading
+import time
+
+"""
+On-disk history of the monitor in a SQLite database: battery samples and events (sleep predictions, decisions,
+plug actions and alerts), so questions like "how fast did the battery drain over the last day" or "which plug
+commands failed this week" are indexed queries instead of searches through log files.
+
+Tables:
+- `samples(t, percent, charging, energy_wh, power_w)` : One row per battery check. `energy_wh` and `power_w` are
+    NULL when the battery source does not report them.
+- `events(t, type, name, value, detail)` : `type` is one of `EVENT_TYPES`, `name` and `value` depend on it:
+    - prediction : name is how the sleep was chosen, value is the sleep in seconds
+    - decision   : name is low, high or none, value is the battery percent
+    - plug       : name is the action (on or off), value is the result (0 or 1 on success, -1 failed,
+                   -2 not home, NULL on error)
+    - alert      : name is low or high, value is the attempt, detail lists the channels used
+- `rollups(resolution, t, samples, percent_min, percent_max, percent_mean, charging_secs, charge_pct, discharge_secs,
+    discharge_pct)` : Samples aggregated over `resolution` seconds (60 or 3600) starting at `t`, see `HistoryRetention`.
+    The `rollup_rates` view adds the charge and discharge rates in percent per hour.
+`t` is unix time in seconds. Both tables are indexed on time, events also on (type, time).
+
+The database is in WAL mode so `bm` can query it while the monitor writes. Writes are queued and committed in
+batches from a background thread, so recording never blocks the monitor on disk.
+
+sqlite3 is imported on first use, it is only needed when the history is enabled or queried.
+"""
+
+EVENT_TYPES = ('prediction', 'decision', 'plug', 'alert')
+
+# Events written every battery check, deleted by the retention once older than its events horizon.
+# Plug actions and alerts are only written when something happens, so they are kept.
+ROUTINE_EVENT_TYPES = ('prediction', 'decision')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS samples (
+    t REAL NOT NULL,
+    percent REAL NOT NULL,
+    charging INTEGER NOT NULL,
+    energy_wh REAL,
+    power_w REAL
+);
+CREATE INDEX IF NOT EXISTS samples_t ON samples (t);
+
+CREATE TABLE IF NOT EXISTS events (
+    t REAL NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT,
+    value REAL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS events_t ON events (t);
+CREATE INDEX IF NOT EXISTS events_type_t ON events (type, t);
+
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution INTEGER NOT NULL,
+    t REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    percent_min REAL NOT NULL,
+    percent_max REAL NOT NULL,
+    percent_mean REAL NOT NULL,
+    charging_secs REAL NOT NULL,
+    charge_pct REAL NOT NULL,
+    discharge_secs REAL NOT NULL,
+    discharge_pct REAL NOT NULL,
+    PRIMARY KEY (resolution, t)
+);
+
+CREATE VIEW IF NOT EXISTS rollup_rates AS
+    SELECT resolution, t, samples, percent_min, percent_max, percent_mean, charging_secs,
+           charge_pct * 3600 / NULLIF(charging_secs, 0) AS charge_rate,
+           discharge_pct * 3600 / NULLIF(discharge_secs, 0) AS discharge_rate
+    FROM rollups;
+'''
+
+# Consecutive samples further apart than this are not used to measure a rate (e.g. the monitor was off in between)
+MAX_PAIR_GAP_SECS = 3 * 3600
+
+# Rolls the samples in [start, end) up into rollups of a minute. Each sample is paired with the one after it (which can
+# be past `end`) and the pair's time and percent change are counted in the bucket of the first sample, if both are in
+# the same charging state and close enough together.
+ROLLUP_SAMPLES_SQL = '''
+INSERT INTO rollups (resolution, t, samples, percent_min, percent_max, percent_mean, charging_secs, charge_pct, discharge_secs, discharge_pct)
+SELECT 60, CAST(t / 60 AS INTEGER) * 60 AS bucket, COUNT(*), MIN(percent), MAX(percent), AVG(percent),
+       TOTAL(CASE WHEN paired AND charging THEN next_t - t END),
+       TOTAL(CASE WHEN paired AND charging THEN next_percent - percent END),
+       TOTAL(CASE WHEN paired AND NOT charging THEN next_t - t END),
+       TOTAL(CASE WHEN paired AND NOT charging THEN percent - next_percent END)
+FROM (
+    SELECT t, percent, charging, next_t, next_percent, next_charging = charging AND next_t - t <= :max_gap AS paired
+    FROM (
+        SELECT t, percent, charging,
+               LEAD(t) OVER w AS next_t, LEAD(percent) OVER w AS next_percent, LEAD(charging) OVER w AS next_charging
+        FROM samples
+        WHERE t >= :start AND t <= COALESCE((SELECT MIN(t) FROM samples WHERE t >= :end), :end)
+        WINDOW w AS (ORDER BY t)
+    )
+    WHERE t < :end
+)
+WHERE true
+GROUP BY bucket
+ON CONFLICT (resolution, t) DO UPDATE SET
+    percent_mean = (percent_mean * samples + excluded.percent_mean * excluded.samples) / (samples + excluded.samples),
+    samples = samples + excluded.samples,
+    percent_min = MIN(percent_min, excluded.percent_min),
+    percent_max = MAX(percent_max, excluded.percent_max),
+    charging_secs = charging_secs + excluded.charging_secs,
+    charge_pct = charge_pct + excluded.charge_pct,
+    discharge_secs = discharge_secs + excluded.discharge_secs,
+    discharge_pct = discharge_pct + excluded.discharge_pct
+'''
+
+# Rolls the minute rollups in [start, end) up into rollups of an hour
+ROLLUP_MINUTES_SQL = '''
+INSERT INTO rollups (resolution, t, samples, percent_min, percent_max, percent_mean, charging_secs, charge_pct, discharge_secs, discharge_pct)
+SELECT 3600, CAST(t / 3600 AS INTEGER) * 3600 AS bucket, SUM(samples), MIN(percent_min), MAX(percent_max),
+       SUM(percent_mean * samples) / SUM(samples),
+       SUM(charging_secs), SUM(charge_pct), SUM(discharge_secs), SUM(discharge_pct)
+FROM rollups
+WHERE resolution = 60 AND t >= :start AND t < :end
+GROUP BY bucket
+ON CONFLICT (resolution, t) DO UPDATE SET
+    percent_mean = (percent_mean * samples + excluded.percent_mean * excluded.samples) / (samples + excluded.samples),
+    samples = samples + excluded.samples,
+    percent_min = MIN(percent_min, excluded.percent_min),
+    percent_max = MAX(percent_max, excluded.percent_max),
+    charging_secs = charging_secs + excluded.charging_secs,
+    charge_pct = charge_pct + excluded.charge_pct,
+    discharge_secs = discharge_secs + excluded.discharge_secs,
+    discharge_pct = discharge_pct + excluded.discharge_pct
+'''
+
+
+class HistoryStoreException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def connect(path: str, readOnly: bool = False):
+    '''
+    Opens the history database, creating its tables if needed (unless `readOnly`)
+    '''
+    import sqlite3
+
+    if readOnly:
+        from pathlib import Path
+        try:
+            conn = sqlite3.connect(Path(path).absolute().as_uri() + '?mode=ro', uri=True)
+            conn.execute('SELECT 1 FROM samples LIMIT 1')
+        except sqlite3.Error as e:
+            raise HistoryStoreException(f'Could not open history database "{path}": {e}')
+        return conn
+
+    try:
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # WAL with synchronous=NORMAL only syncs at checkpoints, a crash can lose the last batch but never corrupts
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(SCHEMA)
+    except sqlite3.Error as e:
+        raise HistoryStoreException(f'Could not open history database "{path}": {e}')
+    return conn
+
+
+class HistoryRetention:
+    '''
+    Keeps the history database from growing without bound by rolling old samples up into fixed interval aggregates:
+    - samples older than `keepRawSecs` become one rollup per minute,
+    - minute rollups older than `keepMinutesSecs` become one rollup per hour, which are kept.
+    - prediction and decision events older than `keepEventsSecs` are deleted (plug actions and alerts are kept).
+
+    Each rollup has the sample count, the min, max and mean percent, and the time spent and percent changed while
+    charging and while discharging, from which the rates are computed (see the `rollup_rates` view).
+    The rolled up rows are deleted in the same transaction, so every sample is counted exactly once.
+
+    The work is split into steps that each roll up at most `chunkSecs` of samples in one short transaction,
+    so memory stays bounded and the history writer is never held up for long, however large the backlog.
+    '''
+
+    def __init__(self, keepRawSecs: float = 86400, keepMinutesSecs: float = 30 * 86400, keepEventsSecs: float = 30 * 86400,
+                 periodSecs: float = 3600, chunkSecs: float = 6 * 3600):
+        '''
+        - `keepRawSecs` : Age after which samples are rolled up into minutes.
+        - `keepMinutesSecs` : Age after which minute rollups are rolled up into hours, at least `keepRawSecs`.
+        - `keepEventsSecs` : Age after which prediction and decision events are deleted.
+        - `periodSecs` : Time between runs, once a run has caught up.
+        - `chunkSecs` : Longest stretch of samples rolled up in one step (hourly rollups take 28 times as much).
+        '''
+        if keepRawSecs <= 0:
+            raise HistoryStoreException('Samples must be kept for some time before they are rolled up')
+        if keepMinutesSecs < keepRawSecs:
+            raise HistoryStoreException('Minute rollups cannot be kept for less time than the samples they come from')
+        if keepEventsSecs <= 0:
+            raise HistoryStoreException('Events must be kept for some time before they are deleted')
+
+        self.keepRawSecs = keepRawSecs
+        self.keepMinutesSecs = keepMinutesSecs
+        self.keepEventsSecs = keepEventsSecs
+        self.periodSecs = periodSecs
+        self.chunkSecs = chunkSecs
+
+        # time.monotonic() of the next run, a run continues until a step finds nothing left to roll up
+        self.nextRun = 0
+        self.running = False
+
+        self.samplesRolled = 0
+        self.minutesRolled = 0
+        self.eventsDeleted = 0
+        self.steps = 0
+
+    def due(self) -> bool:
+        return self.running or time.monotonic() >= self.nextRun
+
+    def defer(self):
+        '''
+        Ends the current run, the next one starts after `periodSecs`
+        '''
+        self.running = False
+        self.nextRun = time.monotonic() + self.periodSecs
+
+    def step(self, conn, now: float = None) -> bool:
+        '''
+        Rolls up the oldest chunk of samples or minute rollups that is due, or deletes the oldest chunk of routine
+        events that is due, on the connection `conn`.
+        Returns true if there may be more to roll up, false once the run has caught up.
+        '''
+        now = time.time() if now is None else now
+        self.running = True
+
+        cutoff = math.floor((now - self.keepRawSecs) / 60) * 60
+        start = conn.execute('SELECT MIN(t) FROM samples').fetchone()[0]
+        if start is not None and start < cutoff:
+            end = min(cutoff, math.floor(start / 60) * 60 + self.chunkSecs)
+            with conn:
+                conn.execute(ROLLUP_SAMPLES_SQL, {'start': start, 'end': end, 'max_gap': MAX_PAIR_GAP_SECS})
+                self.samplesRolled += conn.execute('DELETE FROM samples WHERE t < ?', (end,)).rowcount
+            self.steps += 1
+            return True
+
+        cutoff = math.floor((now - self.keepMinutesSecs) / 3600) * 3600
+        start = conn.execute('SELECT MIN(t) FROM rollups WHERE resolution = 60').fetchone()[0]
+        if start is not None and start < cutoff:
+            end = min(cutoff, math.floor(start / 3600) * 3600 + self.chunkSecs * 28)
+            with conn:
+                conn.execute(ROLLUP_MINUTES_SQL, {'start': start, 'end': end})
+                self.minutesRolled += conn.execute('DELETE FROM rollups WHERE resolution = 60 AND t < ?', (end,)).rowcount
+            self.steps += 1
+            return True
+
+        cutoff = now - self.keepEventsSecs
+        types = ', '.join('?' * len(ROUTINE_EVENT_TYPES))
+        start = conn.execute(f'SELECT MIN(t) FROM events WHERE type IN ({types})', ROUTINE_EVENT_TYPES).fetchone()[0]
+        if start is not None and start < cutoff:
+            end = min(cutoff, start + self.chunkSecs * 28)
+            with conn:
+                self.eventsDeleted += conn.execute(f'DELETE FROM events WHERE type IN ({types}) AND t < ?',
+                                                   ROUTINE_EVENT_TYPES + (end,)).rowcount
+            self.steps += 1
+            return True
+
+        self.defer()
+        return False
+
+    def run(self, conn, now: float = None):
+        '''
+        Rolls up everything that is due in one go
+        '''
+        while self.step(conn, now):
+            pass
+
+
+class HistoryStore:
+    '''
+    Records the monitor's history to a SQLite database from a background writer thread.
+    The `record*` methods only queue the row and return immediately.
+    '''
+
+    def __init__(self, path: str, batchSize: int = 100, flushPeriodSecs: float = 10, retention: HistoryRetention = None,
+                 logger: logging.Logger = None):
+        '''
+        - `path` : Database file, created if it does not exist.
+        - `batchSize` : Queued rows that trigger an early commit.
+        - `flushPeriodSecs` : Longest time a row is queued before it is committed.
+        - `retention` : If given, old samples are rolled up by the writer thread in between commits.
+        '''
+        self.path = path
+        self.batchSize = batchSize
+        self.flushPeriodSecs = flushPeriodSecs
+        self.retention = retention
+        self.logger = logger
+
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.conn = None
+
+        self.rowsWritten = 0
+        self.commits = 0
+        self.writeFailures = 0
+
+    def log(self, text: str, level: int = logging.INFO):
+        if self.logger is not None:
+            self.logger.log(level, text)
+
+    def start(self):
+        '''
+        Opens the database and starts the writer thread. Raises HistoryStoreException if the database cannot be opened.
+        '''
+        if self.thread is not None:
+            return
+        self.conn = connect(self.path)
+        self.thread = threading.Thread(target=self.__run, name='HistoryStore', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Commits everything still queued and stops the writer thread.
+        '''
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout=10)
+        if self.thread.is_alive():
+            # still in a commit or retention step, closing the connection under it would fail that and lose the rows
+            self.log('History writer did not finish within 10s, leaving the database open', level=logging.WARNING)
+            self.thread = None
+            return
+        self.thread = None
+        self.conn.close()
+        self.conn = None
+
+    def flush(self, timeoutSecs: float = 10) -> bool:
+        '''
+        Waits until everything queued so far is committed, returns false if it took longer than `timeoutSecs`
+        '''
+        if self.thread is None:
+            return False
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeoutSecs)
+
+    def __put(self, table: str, row: tuple):
+        if self.thread is not None:
+            self.queue.put((table, row))
+
+    def recordSample(self, reading, t: float = None):
+        '''
+        Records a `BatteryReading`
+        '''
+        self.__put('samples', (time.time() if t is None else t, reading.percent, 1 if reading.power_plugged else 0,
+                               reading.energyNowWh(), reading.powerW()))
+
+    def recordEvent(self, eventType: str, name: str = None, value: float = None, detail: str = None, t: float = None):
+        if eventType not in EVENT_TYPES:
+            raise HistoryStoreException(f'Unknown event type "{eventType}"')
+        self.__put('events', (time.time() if t is None else t, eventType, name, value, detail))
+
+    def recordPrediction(self, secs: float, how: str):
+        self.recordEvent('prediction', how, secs)
+
+    def recordDecision(self, decision: str, percent):
+        self.recordEvent('decision', decision, percent)
+
+    def recordPlugOutcome(self, action: str, result):
+        self.recordEvent('plug', action, result)
+
+    def recordAlert(self, kind: str, attempt: int, channels: list):
+        self.recordEvent('alert', kind, attempt, ','.join(channels))
+
+    def __run(self):
+        while True:
+            batch = {'samples': [], 'events': []}
+            waiters = []
+            deadline = time.monotonic() + self.flushPeriodSecs
+            count = 0
+            stop = False
+            # while a retention run has work left, only take what is already queued and get back to it
+            retain = self.retention is not None and self.retention.due()
+
+            # gather rows until the batch is full, the period is up, or someone waits for a flush
+            while count < self.batchSize:
+                timeout = 0 if retain else deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=max(0, timeout)) if timeout > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch[item[0]].append(item[1])
+                count += 1
+
+            if stop:
+                # take whatever was queued behind the stop request too
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, threading.Event):
+                        waiters.append(item)
+                    elif item is not None:
+                        batch[item[0]].append(item[1])
+                        count += 1
+
+            if count:
+                self.__write(batch, count)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+            if retain:
+                self.__retain()
+
+    def __write(self, batch: dict, count: int):
+        import sqlite3
+        try:
+            with self.conn:
+                if batch['samples']:
+                    self.conn.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?)', batch['samples'])
+                if batch['events']:
+                    self.conn.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?)', batch['events'])
+        except sqlite3.Error as e:
+            self.writeFailures += 1
+            self.log(f'History write failed, {count} rows dropped: {e}', level=logging.WARNING)
+            return
+        self.rowsWritten += count
+        self.commits += 1
+
+
+    def __retain(self):
+        import sqlite3
+        try:
+            self.retention.step(self.conn)
+        except sqlite3.Error as e:
+            self.retention.defer()
+            self.log(f'History retention failed, retrying in {self.retention.periodSecs:.0f}s: {e}', level=logging.WARNING)
+
+
+class HistoryQuery:
+    '''
+    Read only queries over a history database, used by `bm history`.
+    '''
+
+    def __init__(self, path: str):
+        self.conn = connect(path, readOnly=True)
+
+    def close(self):
+        self.conn.close()
+
+    def samples(self, since: float = None, until: float = None) -> list:
+        '''
+        Returns (t, percent, charging, energy_wh, power_w) rows between `since` and `until`, oldest first
+        '''
+        return self.conn.execute(
+            'SELECT t, percent, charging, energy_wh, power_w FROM samples WHERE t >= ? AND t <= ? ORDER BY t',
+            (since if since is not None else 0, until if until is not None else float('inf'))).fetchall()
+
+    def events(self, eventType: str = None, since: float = None, until: float = None, limit: int = None) -> list:
+        '''
+        Returns (t, type, name, value, detail) rows between `since` and `until`, oldest first
+        '''
+        sql = 'SELECT t, type, name, value, detail FROM events WHERE t >= ? AND t <= ?'
+        params = [since if since is not None else 0, until if until is not None else float('inf')]
+        if eventType is not None:
+            sql += ' AND type = ?'
+            params.append(eventType)
+        sql += ' ORDER BY t'
+        if limit is not None:
+            sql = f'SELECT * FROM ({sql} DESC LIMIT ?) ORDER BY t'
+            params.append(limit)
+        return self.conn.execute(sql, params).fetchall()
+
+    def plugFailures(self, since: float = None, until: float = None) -> list:
+        '''
+        Returns the plug events that did not succeed (failed, not home or errored)
+        '''
+        return self.conn.execute(
+            "SELECT t, type, name, value, detail FROM events WHERE type = 'plug' AND t >= ? AND t <= ? AND (value IS NULL OR value < 0) ORDER BY t",
+            (since if since is not None else 0, until if until is not None else float('inf'))).fetchall()
+
+    def rollups(self, resolution: int = None, since: float = None, until: float = None) -> list:
+        '''
+        Returns (resolution, t, samples, percent_min, percent_max, percent_mean, charging_secs, charge_rate, discharge_rate)
+        rows from `rollup_rates` between `since` and `until`, oldest first. Rates are in percent per hour, None if unmeasured.
+        '''
+        sql = 'SELECT * FROM rollup_rates WHERE t >= ? AND t <= ?'
+        params = [since if since is not None else 0, until if until is not None else float('inf')]
+        if resolution is not None:
+            sql += ' AND resolution = ?'
+            params.append(resolution)
+        return self.conn.execute(sql + ' ORDER BY t', params).fetchall()
+
+    def rate(self, since: float = None, until: float = None, charging: bool = False, maxGapSecs: float = MAX_PAIR_GAP_SECS) -> tuple:
+        '''
+        Returns (percent per hour, hours measured) of discharge (or charge if `charging`) between `since` and `until`.
+        Only pairs of consecutive samples that are both in that state and less than `maxGapSecs` apart are counted,
+        so plug changes and long gaps (e.g. the monitor being off) are left out. Rate is None if nothing was measured.
+        Samples that have been rolled up are counted from their rollups.
+        '''
+        since = since if since is not None else 0
+        until = until if until is not None else float('inf')
+        row = self.conn.execute('''
+            SELECT TOTAL(CASE WHEN charging THEN percent - prev_percent ELSE prev_percent - percent END), TOTAL(t - prev_t) FROM (
+                SELECT t, percent, charging,
+                       LAG(t) OVER (ORDER BY t) AS prev_t,
+                       LAG(percent) OVER (ORDER BY t) AS prev_percent,
+                       LAG(charging) OVER (ORDER BY t) AS prev_charging
+                FROM samples WHERE t >= ? AND t <= ?
+            ) WHERE charging = ? AND prev_charging = ? AND t - prev_t <= ?
+        ''', (since, until, int(charging), int(charging), maxGapSecs)).fetchone()
+
+        pct, secs = ('charge_pct', 'charging_secs') if charging else ('discharge_pct', 'discharge_secs')
+        rolled = self.conn.execute(f'SELECT TOTAL({pct}), TOTAL({secs}) FROM rollups WHERE t >= ? AND t <= ?', (since, until)).fetchone()
+
+        changed, secs = row[0] + rolled[0], row[1] + rolled[1]
+        if not secs:
+            return None, 0
+        return changed / (secs / 3600), secs / 3600
+
+    def counts(self, since: float = None, until: float = None) -> dict:
+        '''
+        Returns the number of samples and of each event type between `since` and `until`
+        '''
+        since = since if since is not None else 0
+        until = until if until is not None else float('inf')
+        counts = {'samples': self.conn.execute('SELECT COUNT(*) FROM samples WHERE t >= ? AND t <= ?', (since, until)).fetchone()[0]}
+        for eventType, count in self.conn.execute('SELECT type, COUNT(*) FROM events WHERE t >= ? AND t <= ? GROUP BY type', (since, until)):
+            counts[eventType] = count
+        for resolution, count in self.conn.execute('SELECT resolution, COUNT(*) FROM rollups WHERE t >= ? AND t <= ? GROUP BY resolution', (since, until)):
+            counts['minute rollups' if resolution == 60 else 'hour rollups'] = count
+        return counts
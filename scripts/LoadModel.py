@@ -0,0 +1,204 @@
+import glob
+import os
+import sys
+import time
+
+"""
+Load features for the sleep predictor and a table of battery rates learned under each kind of load.
+
+The battery drains (and charges) at very different rates depending on what the laptop is doing, so a rate learned
+while it idled says little about how long it lasts under a build or a game. Each battery check records the average
+CPU utilisation since the previous check and whether the screen is on, and the rate measured over that interval is
+learned for the matching load bucket. Predictions then use the rate of the bucket matching the current load.
+"""
+
+PROC_STAT = '/proc/stat'
+SYSFS_BACKLIGHT_DIR = '/sys/class/backlight'
+
+# Upper CPU utilisation (%) of each load bucket, the last bucket takes everything above
+CPU_BUCKET_LIMITS = (10, 35, 70)
+CPU_BUCKET_NAMES = ('idle', 'light', 'medium', 'heavy')
+
+
+class LoadSample:
+    '''
+    The load over the interval ending at a battery check.
+    - `cpuPercent` : Average CPU utilisation since the previous sample, None for the first sample or if unavailable.
+    - `screenOn` : True if the screen is on (and in use), None if unknown.
+    '''
+    __slots__ = ('cpuPercent', 'screenOn', 'timestamp')
+
+    def __init__(self, cpuPercent: float = None, screenOn: bool = None):
+        self.cpuPercent = cpuPercent
+        self.screenOn = screenOn
+        self.timestamp = time.monotonic()
+
+    def __repr__(self):
+        return 'LoadSample(cpuPercent={}, screenOn={})'.format(
+            None if self.cpuPercent is None else round(self.cpuPercent, 1), self.screenOn)
+
+
+class LoadSampler:
+    '''
+    Takes cheap load samples: two reads of the CPU time counters and of the screen state per battery check.
+
+    CPU utilisation comes from /proc/stat on Linux and `psutil.cpu_times()` elsewhere.
+    The screen is read from the backlight in sysfs on Linux; on Windows it is counted as off once there
+    has been no keyboard or mouse input for `idleScreenSecs`, as the display is usually turned off by then.
+    '''
+
+    def __init__(self, idleScreenSecs: float = 300):
+        self.idleScreenSecs = idleScreenSecs
+        self.prevTimes = None
+        self.backlights = sorted(glob.glob(os.path.join(SYSFS_BACKLIGHT_DIR, '*'))) if sys.platform.startswith('linux') else []
+
+    @staticmethod
+    def readCpuTimes():
+        '''
+        Returns (busy, total) CPU time since boot in any unit, None if unavailable
+        '''
+        if sys.platform.startswith('linux'):
+            try:
+                with open(PROC_STAT, 'r') as file:
+                    fields = file.readline().split()
+            except OSError:
+                return None
+            # cpu user nice system idle iowait irq softirq steal ...
+            values = [int(v) for v in fields[1:9]]
+            idle = values[3] + values[4]
+            return sum(values) - idle, sum(values)
+
+        try:
+            import psutil
+        except ImportError:
+            return None
+        times = psutil.cpu_times()
+        idle = times.idle + getattr(times, 'iowait', 0)
+        total = sum(times)
+        return total - idle, total
+
+    def readScreenOn(self):
+        '''
+        Returns true if the screen is on, false if off and None if it cannot be told
+        '''
+        if self.backlights:
+            for backlight in self.backlights:
+                try:
+                    with open(os.path.join(backlight, 'bl_power'), 'r') as file:
+                        # FB_BLANK_UNBLANK is 0, everything else is some level of off
+                        if int(file.read().strip()) == 0:
+                            return True
+                except (OSError, ValueError):
+                    return None
+            return False
+
+        if sys.platform == 'win32':
+            return self.secsSinceInput() < self.idleScreenSecs
+
+        return None
+
+    @staticmethod
+    def secsSinceInput() -> float:
+        '''
+        Windows only, seconds since the last keyboard or mouse input
+        '''
+        import ctypes
+
+        class LASTINPUTINFO(ctypes.Structure):
+            _fields_ = [('cbSize', ctypes.c_uint), ('dwTime', ctypes.c_uint)]
+
+        info = LASTINPUTINFO()
+        info.cbSize = ctypes.sizeof(info)
+        if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+            return 0
+        # both tick counts wrap at 2^32 ms
+        return ((ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000
+
+    def sample(self) -> LoadSample:
+        '''
+        Returns the load since the previous call
+        '''
+        times = LoadSampler.readCpuTimes()
+        cpuPercent = None
+        if times is not None and self.prevTimes is not None:
+            busy, total = times[0] - self.prevTimes[0], times[1] - self.prevTimes[1]
+            if total > 0:
+                cpuPercent = min(100.0, max(0.0, 100.0 * busy / total))
+        self.prevTimes = times
+
+        return LoadSample(cpuPercent, self.readScreenOn())
+
+
+class LoadRateTable:
+    '''
+    Battery rates (seconds per 1% change) learned for each combination of charging state, CPU load bucket and
+    screen state, stored in a flat list indexed by `LoadRateTable.bucket`. Each rate is an exponential average
+    of the rates measured under that load, like the controller's overall prediction.
+    '''
+
+    SIZE = 2 * len(CPU_BUCKET_NAMES) * 2
+
+    def __init__(self, adaptivity: float = 0.9):
+        self.adaptivity = adaptivity
+        self.rates = [None] * LoadRateTable.SIZE
+        self.samples = [0] * LoadRateTable.SIZE
+
+    @staticmethod
+    def cpuBucket(cpuPercent: float) -> int:
+        for i, limit in enumerate(CPU_BUCKET_LIMITS):
+            if cpuPercent < limit:
+                return i
+        return len(CPU_BUCKET_LIMITS)
+
+    @staticmethod
+    def bucket(charging: bool, load: LoadSample):
+        '''
+        Returns the table index for the load, None if the load has no CPU utilisation.
+        A screen in an unknown state is counted as on.
+        '''
+        if load is None or load.cpuPercent is None:
+            return None
+        screen = 0 if load.screenOn is False else 1
+        return ((1 if charging else 0) * len(CPU_BUCKET_NAMES) + LoadRateTable.cpuBucket(load.cpuPercent)) * 2 + screen
+
+    @staticmethod
+    def bucketName(index: int) -> str:
+        rest, screen = divmod(index, 2)
+        charging, cpu = divmod(rest, len(CPU_BUCKET_NAMES))
+        return '{}/{} cpu/screen {}'.format('charging' if charging else 'discharging', CPU_BUCKET_NAMES[cpu], 'on' if screen else 'off')
+
+    def observe(self, charging: bool, load: LoadSample, secsPerPercent: float):
+        '''
+        Learns a rate measured while the laptop was under `load`
+        '''
+        index = LoadRateTable.bucket(charging, load)
+        if index is None:
+            return
+        prev = self.rates[index]
+        self.rates[index] = secsPerPercent if prev is None else self.adaptivity * secsPerPercent + (1 - self.adaptivity) * prev
+        self.samples[index] += 1
+
+    def lookup(self, charging: bool, load: LoadSample) -> tuple:
+        '''
+        Returns (secs per percent, bucket index) learned for `load`, or (None, None) if there is nothing to go on.
+        If this load has not been seen yet, the nearest heavier CPU bucket that has been is used instead,
+        since a rate learned under a lighter load would overestimate how long the battery lasts.
+        '''
+        index = LoadRateTable.bucket(charging, load)
+        if index is None:
+            return None, None
+        if self.rates[index] is not None:
+            return self.rates[index], index
+
+        rest, screen = divmod(index, 2)
+        charging, cpu = divmod(rest, len(CPU_BUCKET_NAMES))
+        for heavier in range(cpu + 1, len(CPU_BUCKET_NAMES)):
+            for s in (screen, 1 - screen):
+                candidate = (charging * len(CPU_BUCKET_NAMES) + heavier) * 2 + s
+                if self.rates[candidate] is not None:
+                    return self.rates[candidate], candidate
+        return None, None
+
+    def reset(self):
+        self.rates = [None] * LoadRateTable.SIZE
+        self.samples = [0] * LoadRateTable.SIZE
@@ -0,0 +1,245 @@
+import bisect
+import glob
+import json
+import os
+import re
+from datetime import datetime
+
+from scripts.functions import get_log_format_str, get_log_date_format_str
+
+"""
+Sparse timestamp index over the monitor's log files, so a time range can be read from the logs without reading
+whole files.
+
+Every record in the logs starts with its timestamp (see `get_log_format_str`), and the timestamps are fixed width
+with the largest unit first, so they sort as strings and never need parsing. For each log file the index keeps the
+timestamp and byte offset of the first record at or after every `strideBytes` of the file. A query binary-searches
+that list for where its range starts, seeks there and reads records until the range ends, so at most `strideBytes`
+is read before the first matching record.
+
+Building the index reads one record per stride, and updating it only looks at what was appended to a file since
+the last update. The index is saved as JSON in the log directory.
+
+Lines that do not start with a timestamp (e.g. tracebacks) belong to the record before them.
+"""
+
+INDEX_FILE_NAME = 'log_index.json'
+INDEX_VERSION = 1
+
+# Bytes read from the end of a file to find its last record
+TAIL_BYTES = 16 * 1024
+
+
+class LogIndexException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def line_time_pattern(logFormat: str = None, dateFormat: str = None) -> re.Pattern:
+    '''
+    Returns a pattern for bytes that matches the start of a record in the log format, up to and including its
+    timestamp, which is the first group
+    '''
+    logFormat = get_log_format_str() if logFormat is None else logFormat
+    dateFormat = get_log_date_format_str() if dateFormat is None else dateFormat
+
+    if '%(asctime)s' not in logFormat:
+        raise LogIndexException('Log format has no timestamp')
+    prefix = logFormat[:logFormat.index('%(asctime)s')]
+
+    pattern = '^'
+    for i, part in enumerate(re.split(r'(%\(\w+\)[-#0 +]?\d*[sd])', prefix)):
+        if i % 2 == 0:
+            pattern += re.escape(part)
+        elif part.endswith('d'):
+            pattern += r' *-?\d+'
+        else:
+            pattern += '.*?'
+
+    fields = {'%Y': r'\d{4}', '%m': r'\d\d', '%d': r'\d\d', '%H': r'\d\d', '%M': r'\d\d', '%S': r'\d\d'}
+    timePattern = ''
+    for i, part in enumerate(re.split(r'(%\w)', dateFormat)):
+        if i % 2 == 0:
+            timePattern += re.escape(part)
+        elif part in fields:
+            timePattern += fields[part]
+        else:
+            raise LogIndexException(f'Unsupported field {part} in log date format')
+
+    return re.compile(f'{pattern}({timePattern})'.encode())
+
+
+def time_key(when: datetime) -> str:
+    '''
+    Returns `when` as it would appear in the logs
+    '''
+    return when.strftime(get_log_date_format_str())
+
+
+class LogIndex:
+    '''
+    Index of the log files (including rotated ones, e.g. `x.log.1`) in `logDir`
+    '''
+
+    def __init__(self, logDir: str, indexFile: str = None, strideBytes: int = 64 * 1024):
+        '''
+        - `logDir` : Directory the monitor writes its logs to.
+        - `indexFile` : Where the index is saved, default: log_index.json in `logDir`.
+        - `strideBytes` : Bytes between indexed records, the most read before the start of a query's range.
+        '''
+        self.logDir = logDir
+        self.indexFile = indexFile if indexFile is not None else os.path.join(logDir, INDEX_FILE_NAME)
+        self.strideBytes = strideBytes
+        self.pattern = line_time_pattern()
+
+        # file name -> {'size', 'next', 'first', 'last', 'entries': [[timestamp, offset], ...]}
+        self.files = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.indexFile, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == INDEX_VERSION and data.get('stride') == self.strideBytes:
+            self.files = data.get('files', {})
+
+    def save(self):
+        tmp = self.indexFile + '.tmp'
+        with open(tmp, 'w') as file:
+            json.dump({'version': INDEX_VERSION, 'stride': self.strideBytes, 'files': self.files}, file, separators=(',', ':'))
+        os.replace(tmp, self.indexFile)
+
+    def segments(self) -> list:
+        '''
+        Returns the names of the log files in the log directory
+        '''
+        paths = glob.glob(os.path.join(self.logDir, '*.log')) + glob.glob(os.path.join(self.logDir, '*.log.[0-9]*'))
+        return [os.path.basename(p) for p in paths]
+
+    def firstRecord(self, file, offset: int):
+        '''
+        Returns (timestamp, offset) of the first complete record starting at or after `offset`, None if there is none yet
+        '''
+        file.seek(offset)
+        if offset > 0:
+            # finish the line the offset falls in
+            file.readline()
+        while True:
+            pos = file.tell()
+            line = file.readline()
+            if not line.endswith(b'\n'):
+                # end of file, or a line that is still being written
+                return None
+            match = self.pattern.match(line)
+            if match is not None:
+                return match.group(1).decode(), pos
+
+    def lastTimestamp(self, file, size: int):
+        file.seek(max(0, size - TAIL_BYTES))
+        last = None
+        for line in file.read().splitlines():
+            match = self.pattern.match(line)
+            if match is not None:
+                last = match.group(1).decode()
+        return last
+
+    def updateFile(self, name: str) -> bool:
+        '''
+        Brings the index of a log file up to date, returns true if it changed
+        '''
+        path = os.path.join(self.logDir, name)
+        try:
+            size = os.path.getsize(path)
+            file = open(path, 'rb')
+        except OSError:
+            return False
+
+        with file:
+            entry = self.files.get(name)
+            if entry is not None and entry['size'] == size:
+                return False
+
+            if entry is not None:
+                # a file that shrank or starts with a different record was replaced (e.g. rotated), index it again
+                first = self.firstRecord(file, 0)
+                if size < entry['size'] or first is None or first[0] != entry['first']:
+                    entry = None
+
+            if entry is None:
+                first = self.firstRecord(file, 0)
+                if first is None:
+                    return self.files.pop(name, None) is not None
+                entry = {'size': 0, 'next': self.strideBytes, 'first': first[0], 'last': first[0], 'entries': [list(first)]}
+
+            entries = entry['entries']
+            while entry['next'] < size:
+                record = self.firstRecord(file, entry['next'])
+                if record is None:
+                    break
+                if record[1] > entries[-1][1]:
+                    entries.append(list(record))
+                # continue after the record found, a single record can span several strides
+                entry['next'] = max(entry['next'], record[1]) + self.strideBytes
+
+            entry['size'] = size
+            entry['last'] = self.lastTimestamp(file, size) or entry['last']
+            self.files[name] = entry
+        return True
+
+    def update(self):
+        '''
+        Brings the index of every log file up to date and saves it if anything changed
+        '''
+        names = self.segments()
+        changed = False
+        for name in names:
+            changed = self.updateFile(name) or changed
+
+        for name in set(self.files) - set(names):
+            del self.files[name]
+            changed = True
+
+        if changed:
+            try:
+                self.save()
+            except OSError:
+                # the index is rebuilt next time
+                pass
+
+    def query(self, since: str = None, until: str = None):
+        '''
+        Yields (file name, line) for every line of the records timestamped between `since` and `until` (inclusive,
+        as returned by `time_key`), in time order across the log files. None leaves that end of the range open.
+        '''
+        self.update()
+
+        overlapping = [(entry['first'], name) for name, entry in self.files.items()
+                       if (until is None or entry['first'] <= until) and (since is None or entry['last'] >= since)]
+
+        for _, name in sorted(overlapping):
+            entries = self.files[name]['entries']
+            start = 0
+            if since is not None:
+                i = bisect.bisect_left([e[0] for e in entries], since)
+                start = entries[max(0, i - 1)][1]
+
+            try:
+                file = open(os.path.join(self.logDir, name), 'rb')
+            except OSError:
+                continue
+
+            with file:
+                file.seek(start)
+                inRange = False
+                for line in file:
+                    match = self.pattern.match(line)
+                    if match is not None:
+                        timestamp = match.group(1).decode()
+                        if until is not None and timestamp > until:
+                            break
+                        inRange = since is None or timestamp >= since
+                    if inRange:
+                        yield name, line.decode('utf-8', errors='replace')
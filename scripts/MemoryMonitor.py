@@ -0,0 +1,180 @@
+import logging
+import os
+import sys
+import time
+
+from scripts.MetricsRegistry import memory_rss, memory_traced
+
+"""
+Memory diagnostics for long headless runs.
+
+Every `periodSecs` the monitor's resident memory (RSS) is logged, and with tracing on, a `tracemalloc` snapshot is
+compared against the first one to log the allocation sites that have grown the most since the monitor started,
+which is where a slow leak shows up after a few days.
+
+With an RSS ceiling, a check that finds the monitor above it raises `MemoryCeilingException`, which the monitor
+handles by saving its learned state and restarting itself (see `BatteryMonitor.monitorBattery`).
+
+tracemalloc (and the pickle module it pulls in) is only imported when tracing is on.
+"""
+
+# Frames of the import system's own allocations, left out of the snapshots along with tracemalloc's
+IGNORED_FILES = ('<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>', '<unknown>')
+
+
+class MemoryCeilingException(Exception):
+    def __init__(self, rssBytes: int, ceilingBytes: int):
+        self.rssBytes = rssBytes
+        self.ceilingBytes = ceilingBytes
+        self.message = f'Resident memory {fmt_bytes(rssBytes)} is above the ceiling of {fmt_bytes(ceilingBytes)}'
+        super().__init__(self.message)
+
+
+def fmt_bytes(size: float) -> str:
+    sign = '-' if size < 0 else ''
+    size = abs(size)
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{sign}{size:.0f} {unit}' if unit == 'B' else f'{sign}{size:.1f} {unit}'
+        size /= 1024
+    return f'{sign}{size:.2f} GiB'
+
+
+def read_rss():
+    '''
+    Returns the resident memory of this process in bytes, None if it cannot be read
+    '''
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/statm', 'r') as file:
+                return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.WorkingSetSize
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class MemoryMonitor:
+    '''
+    Logs the monitor's memory use every `periodSecs`, see the module docstring
+    '''
+
+    def __init__(self, periodSecs: float = 3600, trace: bool = False, topSites: int = 10, traceFrames: int = 1,
+                 rssCeilingBytes: int = None, minUptimeSecs: float = 600, logger: logging.Logger = None):
+        '''
+        - `periodSecs` : Time between checks.
+        - `trace` : Trace Python allocations with tracemalloc and log the sites that grow. Tracing makes every
+            allocation slower and uses memory of its own, so it is meant for diagnosing, not for every run.
+        - `topSites` : Allocation sites logged per check.
+        - `traceFrames` : Frames kept per traced allocation, sites are grouped by the innermost one.
+        - `rssCeilingBytes` : If given, `check` raises MemoryCeilingException once RSS is above it.
+        - `minUptimeSecs` : The ceiling is not enforced before the monitor has run this long, so a ceiling set below
+            what the monitor needs to start cannot make it restart over and over.
+        '''
+        self.periodSecs = periodSecs
+        self.trace = trace
+        self.topSites = topSites
+        self.traceFrames = traceFrames
+        self.rssCeilingBytes = rssCeilingBytes
+        self.minUptimeSecs = minUptimeSecs
+        self.logger = logger
+
+        self.startTime = None
+        self.startedTracing = False
+        self.firstSnapshot = None
+        self.prevSnapshot = None
+
+        self.checks = 0
+        self.startRss = None
+        self.peakRss = None
+
+    def log(self, text: str, level: int = logging.INFO):
+        if self.logger is not None:
+            self.logger.log(level, text)
+
+    def start(self):
+        self.startTime = time.monotonic()
+        self.startRss = self.peakRss = read_rss()
+        if self.trace:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.traceFrames)
+                self.startedTracing = True
+            self.firstSnapshot = self.snapshot()
+
+    def stop(self):
+        if self.startedTracing:
+            import tracemalloc
+            tracemalloc.stop()
+            self.startedTracing = False
+        self.firstSnapshot = self.prevSnapshot = None
+
+    def snapshot(self):
+        import tracemalloc
+        ignored = (tracemalloc.__file__,) + IGNORED_FILES
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, f) for f in ignored])
+
+    def growth(self, snapshot) -> list:
+        '''
+        Returns (growth since the first snapshot, growth since the previous one or None) for the `topSites`
+        allocation sites that have grown the most since the first snapshot
+        '''
+        sinceFirst = [d for d in snapshot.compare_to(self.firstSnapshot, 'lineno') if d.size_diff > 0][:self.topSites]
+        sincePrev = {}
+        if self.prevSnapshot is not None:
+            sincePrev = {d.traceback: d for d in snapshot.compare_to(self.prevSnapshot, 'lineno')}
+        return [(d, sincePrev.get(d.traceback)) for d in sinceFirst]
+
+    def check(self):
+        '''
+        Logs the memory use (and growing allocation sites if tracing), raises MemoryCeilingException if RSS is over the ceiling
+        '''
+        self.checks += 1
+        rss = read_rss()
+        if rss is not None:
+            memory_rss.set(rss)
+            self.peakRss = rss if self.peakRss is None else max(self.peakRss, rss)
+            change = '' if self.startRss is None else f' ({fmt_bytes(rss - self.startRss)} since start)'
+            self.log(f'Memory: RSS {fmt_bytes(rss)}{change}, peak {fmt_bytes(self.peakRss)}')
+
+        if self.trace and self.firstSnapshot is not None:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            memory_traced.set(current)
+            snapshot = self.snapshot()
+            sites = self.growth(snapshot)
+            self.log(f'Memory: {fmt_bytes(current)} traced (peak {fmt_bytes(peak)}), top growing allocation sites since start:')
+            for sinceFirst, sincePrev in sites:
+                frame = sinceFirst.traceback[0]
+                recent = '' if sincePrev is None else f' ({fmt_bytes(sincePrev.size_diff)} since last check)'
+                self.log(f'  {fmt_bytes(sinceFirst.size_diff):>10}{recent}, {sinceFirst.count_diff:+d} blocks: {frame.filename}:{frame.lineno}')
+            self.prevSnapshot = snapshot
+
+        if self.rssCeilingBytes is not None and rss is not None and rss > self.rssCeilingBytes:
+            if time.monotonic() - self.startTime < self.minUptimeSecs:
+                self.log(f'Memory: RSS {fmt_bytes(rss)} is above the ceiling of {fmt_bytes(self.rssCeilingBytes)}, '
+                         f'but the monitor has only just started', level=logging.WARNING)
+                return
+            raise MemoryCeilingException(rss, self.rssCeilingBytes)
@@ -0,0 +1,225 @@
+import os
+import threading
+from bisect import bisect_left
+
+"""
+Metrics for the monitor process.
+
+The registry holds counters, gauges and histograms, and renders them in the OpenMetrics text format
+(https://github.com/OpenObservability/OpenMetrics). The monitor's own metrics are defined at the bottom
+of this module and are shared through the global `metrics` registry, similar to the loggers in bm_logging.
+"""
+
+# Default histogram buckets in seconds, from sub-millisecond reads up to day long sleeps
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SLEEP_BUCKETS = (10, 30, 60, 300, 600, 1800, 3600, 7200, 14400, 28800, 86400)
+
+
+def _labelsKey(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _formatLabels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _formatValue(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'unknown'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# TYPE {self.name} {self.type}', f'# HELP {self.name} {self.help}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labelsKey(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_labelsKey(labels), 0)
+
+    def samples(self) -> list:
+        with self.lock:
+            items = list(self.values.items())
+        return [f'{self.name}_total{_formatLabels(k)} {_formatValue(v)}' for k, v in items]
+
+
+class Gauge(Metric):
+    '''
+    A value that goes up and down. Either `set` it, or give a `fnc` that is called when the metrics are rendered.
+    '''
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, fnc=None):
+        super().__init__(name, help)
+        self.values = {}
+        self.fnc = fnc
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[_labelsKey(labels)] = value
+
+    def samples(self) -> list:
+        with self.lock:
+            items = list(self.values.items())
+        if self.fnc is not None:
+            items = [((), self.fnc())]
+        return [f'{self.name}{_formatLabels(k)} {_formatValue(v)}' for k, v in items]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., sum, count]
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = _labelsKey(labels)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = [0] * (len(self.buckets) + 2)
+                self.values[key] = data
+            # counts are stored per bucket and made cumulative when rendered
+            ind = bisect_left(self.buckets, value)
+            if ind < len(self.buckets):
+                data[ind] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self) -> list:
+        with self.lock:
+            items = [(k, list(v)) for k, v in self.values.items()]
+
+        lines = []
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_formatLabels(key, (("le", _formatValue(float(bound))),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_formatLabels(key, (("le", "+Inf"),))} {data[-1]}')
+            lines.append(f'{self.name}_count{_formatLabels(key)} {data[-1]}')
+            lines.append(f'{self.name}_sum{_formatLabels(key)} {_formatValue(float(data[-2]))}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def __register(self, metric: Metric) -> Metric:
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.__register(Counter(name, help))
+
+    def gauge(self, name: str, help: str, fnc=None) -> Gauge:
+        return self.__register(Gauge(name, help, fnc=fnc))
+
+    def histogram(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.__register(Histogram(name, help, buckets=buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(m.render() for m in metrics) + '\n# EOF\n'
+
+    def writeFile(self, path: str):
+        '''
+        Writes the metrics to `path` atomically, so scrapers never read a partially written file.
+        '''
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', newline='\n') as file:
+            file.write(self.render())
+        os.replace(tmp, path)
+
+    def serve(self, port: int, host: str = '127.0.0.1'):
+        '''
+        Serves the metrics at http://<host>:<port>/metrics from a background thread.
+        '''
+        # http.server pulls in the email and http.client packages, only import it when metrics are served
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/openmetrics-text; version=1.0.0; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # scrapes are not worth a log line each
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True)
+        thread.start()
+        return self.server
+
+    def stopServing(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+metrics = MetricsRegistry()
+
+# The monitor's metrics
+battery_reads = metrics.counter('bm_battery_reads', 'Battery sensor reads')
+scheduler_wakeups = metrics.counter('bm_wakeups', 'Times the monitor woke up from a wait')
+sleep_predicted = metrics.histogram('bm_sleep_predicted_seconds', 'Sleep period chosen before each battery check', buckets=SLEEP_BUCKETS)
+sleep_actual = metrics.histogram('bm_sleep_actual_seconds', 'Measured awake time between battery checks', buckets=SLEEP_BUCKETS)
+watchdog_wakeups = metrics.counter('bm_watchdog_wakeups', 'Sleeps cut short by the watchdog because the battery would fall below the minimum')
+plug_control_latency = metrics.histogram('bm_plug_control_seconds', 'Time taken to send a plug command, by backend')
+plug_control = metrics.counter('bm_plug_control', 'Plug commands sent, by backend and result')
+plug_timer = metrics.counter('bm_plug_timer', 'Plug countdown timer commands sent, by action and result')
+memory_rss = metrics.gauge('bm_rss_bytes', 'Resident memory of the monitor as of the last memory check')
+memory_traced = metrics.gauge('bm_traced_bytes', 'Python allocations traced by tracemalloc as of the last memory check')
+notification_latency = metrics.histogram('bm_notification_seconds', 'Time taken to send a notification, by channel')
@@ -0,0 +1,136 @@
+import logging
+import threading
+from time import perf_counter
+
+from scripts.MetricsRegistry import metrics
+
+phase_latency = metrics.histogram('bm_phase_seconds', 'Time spent in each phase of a monitor cycle')
+
+# Phases that are expected to be slow have larger default budgets
+DEFAULT_PHASE_BUDGETS = {
+    'sensor_read': 0.5,
+    'network_check': 5,
+    'plug_query': 5,
+    'plug_command': 10,
+    'plug_timer': 15,
+    'verification_wait': 10,
+    'notify_sound': 1,
+    'notify_toast': 5,
+    'notify_email': 30,
+    'log_flush': 1,
+    'memory_check': 2,
+}
+
+
+class PhaseTimerException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class PhaseSpan:
+    '''
+    Context manager timing one run of a phase, made by `PhaseTimer.phase`
+    '''
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name: str):
+        self.timer = timer
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timer.record(self.name, perf_counter() - self.start)
+        return False
+
+
+class PhaseTimer:
+    '''
+    Times the phases of a monitor cycle (sensor reads, network checks, plug commands, notifications...).
+
+    Wrap a phase with `with phases.phase('plug_command'): ...`. Each phase's total time and run count are accumulated
+    until `endCycle`, which logs one summary line for the cycle. A warning is logged as soon as a single run
+    of a phase takes longer than its budget.
+    '''
+
+    def __init__(self, budgets: dict = None, logger: logging.Logger = None):
+        self.budgets = dict(DEFAULT_PHASE_BUDGETS)
+        if budgets:
+            self.budgets.update(budgets)
+        self.logger = logger
+        self.lock = threading.Lock()
+        # phase name -> [total seconds, runs]
+        self.cycle = {}
+
+    def setLogger(self, logger: logging.Logger):
+        self.logger = logger
+
+    def setBudgets(self, budgets: dict):
+        self.budgets.update(budgets)
+
+    @staticmethod
+    def parseBudgets(budgetStr: str) -> dict:
+        '''
+        Parses budgets in the form "<phase>=<seconds>,<phase>=<seconds>" e.g. "plug_command=5,notify_email=20"
+        '''
+        budgets = {}
+        for part in budgetStr.split(','):
+            if not part.strip():
+                continue
+            name, sep, value = part.partition('=')
+            name = name.strip()
+            if not sep or name not in DEFAULT_PHASE_BUDGETS:
+                raise PhaseTimerException(f'Invalid phase budget "{part.strip()}", phases are: {", ".join(DEFAULT_PHASE_BUDGETS)}')
+            try:
+                budgets[name] = float(value)
+            except ValueError:
+                raise PhaseTimerException(f'Invalid budget for phase "{name}": "{value.strip()}"')
+        return budgets
+
+    def phase(self, name: str) -> PhaseSpan:
+        return PhaseSpan(self, name)
+
+    def record(self, name: str, secs: float):
+        with self.lock:
+            data = self.cycle.get(name)
+            if data is None:
+                self.cycle[name] = [secs, 1]
+            else:
+                data[0] += secs
+                data[1] += 1
+
+        phase_latency.observe(secs, phase=name)
+
+        budget = self.budgets.get(name)
+        if budget is not None and secs > budget and self.logger is not None:
+            self.logger.warning(f'Slow Phase: {name} took {secs:.2f}s (budget {budget:g}s)')
+
+    def endCycle(self) -> str:
+        '''
+        Logs and returns the summary of the phases timed since the last call, then resets them
+        '''
+        with self.lock:
+            cycle = self.cycle
+            self.cycle = {}
+
+        if not cycle:
+            return ''
+
+        parts = []
+        for name, (total, runs) in cycle.items():
+            part = f'{name}={total * 1000:.1f}ms'
+            if runs > 1:
+                part += f'(x{runs})'
+            parts.append(part)
+
+        summary = ' '.join(parts)
+        if self.logger is not None:
+            self.logger.info(f'Cycle Phases: {summary}')
+        return summary
+
+
+phases = PhaseTimer()
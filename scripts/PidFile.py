@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+
+"""
+A pid file that the running monitor holds an exclusive lock on for as long as it runs.
+
+The lock (not the file being there) is what says the monitor is running: the operating system drops it when the
+process exits however it exits, so a pid file left behind by a crash is never mistaken for a running monitor.
+Checking takes one open and one non-blocking lock attempt, no processes are started.
+
+A monitor starting up retries the lock for a moment, as a check holds it briefly, and makes sure the file it locked
+is still the one at the path, as the monitor that held it before removes it on exit.
+
+On Windows a byte past the end of the file is locked rather than the pid itself, as locked bytes cannot be read
+by other processes.
+"""
+
+DEFAULT_PID_FILE_NAME = 'battery_monitor.pid'
+
+# Offset of the locked byte on Windows
+WIN_LOCK_OFFSET = 4096
+
+# How long a monitor starting up keeps trying for the lock, `probe` holds it for a moment while checking
+ACQUIRE_RETRY_SECS = 0.1
+
+
+class PidFileException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+def lock_fd(fd: int) -> bool:
+    '''
+    Tries to take the lock on an open pid file without blocking, returns false if another process holds it
+    '''
+    if sys.platform == 'win32':
+        import msvcrt
+        os.lseek(fd, WIN_LOCK_OFFSET, os.SEEK_SET)
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    import fcntl
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def unlock_fd(fd: int):
+    if sys.platform == 'win32':
+        import msvcrt
+        os.lseek(fd, WIN_LOCK_OFFSET, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        return
+
+    import fcntl
+    fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class PidFile:
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+
+    def acquire(self):
+        '''
+        Takes the lock and writes this process's pid, raises PidFileException if another process holds it
+        '''
+        deadline = time.monotonic() + ACQUIRE_RETRY_SECS
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if lock_fd(fd):
+                if self.isPathOf(fd):
+                    break
+                # the file was removed by the monitor that held it before we got the lock, lock the new one instead
+                unlock_fd(fd)
+                os.close(fd)
+                continue
+
+            os.close(fd)
+            if time.monotonic() >= deadline:
+                raise PidFileException(f'Battery monitor is already running (pid {self.readPid()}, pid file "{self.path}")')
+            # may only be `probe` checking on it
+            time.sleep(0.01)
+
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, f'{os.getpid()}\n'.encode())
+        self.fd = fd
+
+    def release(self):
+        '''
+        Removes the pid file and drops the lock
+        '''
+        if self.fd is None:
+            return
+        try:
+            # removed while still locked, so nothing can read it as held by another process in between
+            os.remove(self.path)
+        except OSError:
+            # Windows cannot remove an open file, it is left unlocked instead which reads as stopped
+            pass
+        unlock_fd(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+    def isPathOf(self, fd: int) -> bool:
+        '''
+        Returns true if the open file `fd` is still the file at the pid file's path
+        '''
+        try:
+            pathStat = os.stat(self.path)
+        except OSError:
+            return False
+        fdStat = os.fstat(fd)
+        return (fdStat.st_dev, fdStat.st_ino) == (pathStat.st_dev, pathStat.st_ino)
+
+    def readPid(self):
+        try:
+            with open(self.path, 'r') as file:
+                return int(file.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def probe(self) -> tuple:
+        '''
+        Returns (running, pid): running is None if there is no pid file (the monitor was started without one),
+        otherwise whether a process holds the lock. pid is the last pid written to the file.
+        '''
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            return None, None
+        except OSError:
+            # the file is there but cannot be opened for locking, e.g. it belongs to another user
+            return None, self.readPid()
+
+        try:
+            if lock_fd(fd):
+                unlock_fd(fd)
+                return False, self.readPid()
+            return True, self.readPid()
+        finally:
+            os.close(fd)
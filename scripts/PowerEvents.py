@@ -0,0 +1,193 @@
+import socket
+import sys
+import threading
+
+from scripts.BatterySource import BatterySource, get_battery_source
+
+# From linux/netlink.h
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group the kernel broadcasts uevents on
+UEVENT_KERNEL_GROUP = 1
+
+# Battery statuses that mean external power is connected
+PLUGGED_STATUSES = ('charging', 'full', 'not charging')
+# Battery statuses that mean it is not. Anything else (e.g. Unknown, which some laptops report on AC while charging
+# is paused at a threshold) says nothing about the plug
+UNPLUGGED_STATUSES = ('discharging',)
+
+
+class PowerEventException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class PowerEventSource:
+    '''
+    Watches for the laptop being plugged in or unplugged and calls `onChange(plugged)` when it happens.
+    `plugged` is None if the new state is not known.
+    '''
+    name = 'base'
+
+    def __init__(self):
+        self.onChange = None
+        self.thread = None
+        self.stopEvent = threading.Event()
+
+    def start(self, onChange, scheduler=None):
+        '''
+        Starts watching. Sources that poll register with `scheduler` (a `DeadlineScheduler`) when given,
+        so polls share the monitor's wakeups instead of running on their own thread.
+        '''
+        if self.thread is not None:
+            return
+
+        self.onChange = onChange
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.run, name=f'PowerEvents-{self.name}', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        self.thread = None
+
+    def notify(self, plugged):
+        if self.onChange is not None:
+            self.onChange(plugged)
+
+    def run(self):
+        raise NotImplementedError
+
+
+class UeventPowerEventSource(PowerEventSource):
+    '''
+    Listens to the kernel's `power_supply` uevents over netlink (Linux only).
+    The kernel sends one when an AC adapter goes online/offline or a battery changes status,
+    so this costs nothing while the power state is unchanged.
+    '''
+    name = 'uevent'
+
+    def __init__(self):
+        super().__init__()
+        if not sys.platform.startswith('linux'):
+            raise PowerEventException('uevent power events are only available on Linux')
+
+        try:
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            self.sock.bind((0, UEVENT_KERNEL_GROUP))
+        except OSError as e:
+            raise PowerEventException(f'Could not subscribe to kernel uevents: {e}')
+
+        # timeout lets the thread notice stop requests
+        self.sock.settimeout(5)
+        # Plugged state told by the adapter and batteries together, None until one of them reports it
+        self.plugged = None
+
+    @staticmethod
+    def parseUevent(data: bytes) -> dict:
+        '''
+        Parses a uevent message, which is a header followed by null separated KEY=VALUE pairs
+        '''
+        fields = {}
+        for part in data.split(b'\0')[1:]:
+            key, sep, value = part.decode('utf-8', errors='replace').partition('=')
+            if sep:
+                fields[key] = value
+        return fields
+
+    def handleUevent(self, fields: dict):
+        if fields.get('SUBSYSTEM') != 'power_supply':
+            return
+
+        prev = self.plugged
+
+        if 'POWER_SUPPLY_ONLINE' in fields and fields.get('POWER_SUPPLY_TYPE') != 'Battery':
+            # adapters only send uevents when they go online or offline
+            plugged = fields['POWER_SUPPLY_ONLINE'] == '1'
+            changed = prev != plugged
+        elif 'POWER_SUPPLY_STATUS' in fields:
+            # batteries send uevents on every capacity change, only report actual status changes
+            status = fields['POWER_SUPPLY_STATUS'].lower()
+            if status not in PLUGGED_STATUSES + UNPLUGGED_STATUSES:
+                return
+            plugged = status in PLUGGED_STATUSES
+            changed = prev is not None and prev != plugged
+        else:
+            return
+
+        # one plug change makes both the adapter and the battery send a uevent, only the first is reported
+        self.plugged = plugged
+        if changed:
+            self.notify(plugged)
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            try:
+                data = self.sock.recv(16384)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.handleUevent(UeventPowerEventSource.parseUevent(data))
+
+    def stop(self):
+        super().stop()
+        self.sock.close()
+
+
+class PollingPowerEventSource(PowerEventSource):
+    '''
+    Polls the battery source's plugged state every `periodSecs` seconds.
+    Used where no kernel notification is available, it still catches plug changes
+    far sooner than the next scheduled battery check.
+    '''
+    name = 'polling'
+
+    def __init__(self, periodSecs: float = 15, source: BatterySource = None):
+        super().__init__()
+        self.periodSecs = periodSecs
+        self.source = source
+        self.prev = None
+        self.timer = None
+        self.scheduler = None
+
+    def start(self, onChange, scheduler=None):
+        if scheduler is None:
+            super().start(onChange)
+            return
+
+        # Plug changes only matter while the monitor is waiting, which is when the scheduler runs timers
+        self.onChange = onChange
+        self.scheduler = scheduler
+        self.timer = scheduler.every(self.periodSecs, self.poll, name='power-poll')
+
+    def stop(self):
+        super().stop()
+        if self.scheduler is not None:
+            self.scheduler.cancel(self.timer)
+            self.timer = None
+
+    def poll(self):
+        source = self.source if self.source is not None else get_battery_source()
+        plugged = source.read().power_plugged
+        if self.prev is not None and plugged != self.prev:
+            self.notify(plugged)
+        self.prev = plugged
+
+    def run(self):
+        self.poll()
+        while not self.stopEvent.wait(self.periodSecs):
+            self.poll()
+
+
+def make_power_event_source() -> PowerEventSource:
+    '''
+    Returns the cheapest power event source available on this platform
+    '''
+    if sys.platform.startswith('linux'):
+        try:
+            return UeventPowerEventSource()
+        except PowerEventException:
+            pass
+
+    return PollingPowerEventSource()
@@ -2,15 +2,38 @@ from scripts.bm_logging import logger, printer, flush_logs
 from scripts.functions import send_notification
 from scripts.TimeString import TimeString
 from scripts.TimerSleep import timerSleep
-from time import time_ns, sleep
-import psutil
+from scripts.BatterySnapshot import BatterySnapshot
+from scripts.BatterySource import BatteryReading, SECSLEFT_UNKNOWN, SECSLEFT_UNLIMITED
+from scripts.PowerEvents import PowerEventSource
+from scripts.DeadlineScheduler import DeadlineScheduler
+from scripts.SuspendClock import SuspendClock, ClockInterval
+from scripts.LoadModel import LoadSampler, LoadRateTable
+from scripts.SleepWatchdog import SleepWatchdog, LoadSpikeException
+from scripts.MetricsRegistry import sleep_predicted, sleep_actual, watchdog_wakeups
+from scripts.PhaseTimer import phases
+from scripts.unlock_signal import UNLOCK_FILE
+from time import time_ns
 
 class UnlockSignalException(Exception):
     def __init__(self):
         self.message = 'Unlock signal was set to high'
         super().__init__(self.message)
 
-UNLOCK_FILE = ''
+class ConfigChangedException(Exception):
+    def __init__(self):
+        self.message = 'Config was reloaded during sleep'
+        super().__init__(self.message)
+
+class PowerStateChangedException(Exception):
+    def __init__(self, plugged=None):
+        self.plugged = plugged
+        self.message = 'Laptop was {} during sleep'.format('unplugged' if plugged is False else 'plugged in' if plugged else 'plugged in or unplugged')
+        super().__init__(self.message)
+
+# Name of the scheduler event posted when the laptop is plugged in or unplugged
+POWER_EVENT = 'power'
+# Name of the scheduler event posted when a reloaded config is waiting to be applied
+CONFIG_EVENT = 'config'
 
 class ScriptSleepController:
     '''
@@ -22,7 +45,9 @@ class ScriptSleepController:
     '''
 
     def __init__(self, batteryFloor: int, batteryCeiling: int, checkIntervalPercentage: int = 5, initPred: int = 10,
-                 predAdaptivity: float = 0.93, headless:bool = False):
+                 predAdaptivity: float = 0.93, headless:bool = False, batterySnapshot: BatterySnapshot = None,
+                 powerEvents: PowerEventSource = None, scheduler: DeadlineScheduler = None, countdownRedrawSecs: float = 1,
+                 loadSampler: LoadSampler = None, watchdogPeriodSecs: float = None):
         '''
         Initialize a sleep controller object.
         - `batteryFloor`   : The minimum battery percentage.
@@ -31,19 +56,71 @@ class ScriptSleepController:
         - `initPred` : The initial sleep prediction to make without any history.
         - `predAdaptivity` : A value between 0 and 1 that indicates how adaptive the controller's predictions are to recent behaviour instead overall history.
             Higher values result in recent behaviour having more weight than overall history.
+        - `batterySnapshot` : Battery snapshot shared with the monitor, a private one is made if None.
+        - `powerEvents` : If given, sleeps are cut short when the laptop is plugged in or unplugged.
+        - `scheduler` : Scheduler that all of the monitor's waits go through, a private one is made if None.
+        - `countdownRedrawSecs` : How often the console countdown is redrawn while sleeping.
+        - `loadSampler` : If given, the load (CPU utilisation, screen state) is sampled at each check and battery rates are
+            learned per load bucket, so predictions follow what the laptop is doing. See `scripts/LoadModel.py`.
+        - `watchdogPeriodSecs` : If given, the battery is checked this often while sleeping through a discharge and the sleep
+            is cut short if it would fall below the floor before the next check. See `scripts/SleepWatchdog.py`.
         '''
         self.curPercent = None
         self.charging = None
         self.prevPercent = None
+        self.prevCharging = None
+        # Full battery readings behind the current and previous samples, for energy based rates
+        self.reading = None
+        self.prevReading = None
+        # Last prediction learned while charging and while discharging
+        self.learnedPredictions = {}
+        # Set when the predictions were imported from a previous run, so its first prediction continues from them
+        self.importedPredictions = False
         self.sleepPeriod = None
+        # Set when the last sleep was cut short by a config or power event, and the sleep period it was cut short of
+        self.sleepEndedEarly = False
+        self.continuedPeriod = None
+        # How the current sleep period was chosen: 'prediction' or 'threshold'
+        self.sleepPeriodSource = None
+        # When the current battery sample was taken, and the time between it and the previous one
+        self.sampleMark = None
+        self.sampleInterval = None
+        self.clock = SuspendClock()
         self.batteryFloor = batteryFloor
         self.batteryCeiling = batteryCeiling
         self.checkIntervalPercentage = checkIntervalPercentage
         self.predAdaptivity = predAdaptivity
         self.initSleepPred = initPred
-        self.drift = 0
         self.lastUnlockTime = None
         self.headless = headless
+        self.countdownRedrawSecs = countdownRedrawSecs
+        self.battery = batterySnapshot if batterySnapshot is not None else BatterySnapshot()
+
+        # Load over the interval ending at the current sample, and the rates learned under each load
+        self.loadSampler = loadSampler
+        self.load = None
+        self.loadRates = LoadRateTable(predAdaptivity) if loadSampler is not None else None
+
+        self.watchdog = None
+        if watchdogPeriodSecs:
+            self.watchdog = SleepWatchdog(watchdogPeriodSecs, battery=self.battery, loadRates=self.loadRates)
+
+        # Every wait the monitor makes goes through this scheduler
+        self.scheduler = scheduler if scheduler is not None else DeadlineScheduler(
+            maxWaitSliceSecs=DeadlineScheduler.interactiveSlice(headless))
+
+        self.powerEvents = powerEvents
+        if self.powerEvents is not None:
+            self.powerEvents.start(self.onPowerEvent, scheduler=self.scheduler)
+
+    def onPowerEvent(self, plugged):
+        '''
+        Called by the power event source when the laptop is plugged in or unplugged.
+        '''
+        logger.info('Power Event: Laptop was {}'.format('plugged in' if plugged else 'unplugged'))
+        # the cached reading is now wrong about the plug state
+        self.battery.invalidate()
+        self.scheduler.post(POWER_EVENT, plugged)
 
     def unlock_signal_high(self):
         with open(UNLOCK_FILE, 'r') as file:
@@ -71,7 +148,12 @@ class ScriptSleepController:
         if self.unlock_signal_high():
             raise UnlockSignalException()
 
-    def sleep(self, secs: int = 0, mins: int = 0, hours: int = 0, verbose=True, checkUnlockSignal=False):
+    def checkWatchdog(self):
+        reason = self.watchdog.check()
+        if reason is not None:
+            raise LoadSpikeException(reason)
+
+    def sleep(self, secs: int = 0, mins: int = 0, hours: int = 0, verbose=True, checkUnlockSignal=False, wakeOnConfigChange=False, watch=False):
         """
         Puts process to sleep for specified amount of time.
 
@@ -80,6 +162,9 @@ class ScriptSleepController:
         If script is headless, `verbose` will always be false.
         If checkUnlockSignal is true, unlock file will be checked
         Will throw UnlockSignalException if unlock signal caused it to break
+        Will throw PowerStateChangedException if the laptop was plugged in or unplugged
+        Will throw ConfigChangedException if `wakeOnConfigChange` and a reloaded config is waiting to be applied
+        Will throw LoadSpikeException if `watch` and the watchdog projects the battery falling below the floor before the sleep ends
         """
         # TODO: Doing override for testing purposes, remove when done
         checkUnlockSignal = False
@@ -94,47 +179,168 @@ class ScriptSleepController:
         verbose = False if self.headless else verbose
 
         # flush logs before going to sleep
-        flush_logs()
-
-        if verbose:
-            try:
-                timerSleep(secs, checkFnc=self.checkUnlockSignal if checkUnlockSignal else None)
-            except KeyboardInterrupt:
-                # Timer sleep writes on the same line, so if interrupt occurs we want to push to next line
-                # Do so by printing new line character to next line then raising interrupt
-                if not self.headless:
-                    print('')
-                raise KeyboardInterrupt
+        with phases.phase('log_flush'):
+            flush_logs()
 
-            return
+        wakeOn = (POWER_EVENT, CONFIG_EVENT) if wakeOnConfigChange else (POWER_EVENT,)
 
+        timers = []
         if checkUnlockSignal:
-            # Sleep 1 second and check the signal each time
-            for _ in range(secs):
-                sleep(1)
-                self.checkUnlockSignal()
+            # polled on the scheduler so the check shares wakeups with the countdown
+            timers.append(self.scheduler.every(1, self.checkUnlockSignal, name='unlock-signal'))
+        if watch and self.watchdog is not None and not self.charging and secs > self.watchdog.periodSecs:
+            # only a discharge can cross the floor
+            self.watchdog.start(self.curPercent, self.batteryFloor, secs)
+            timers.append(self.scheduler.every(self.watchdog.periodSecs, self.checkWatchdog, name='watchdog'))
+
+        try:
+            if verbose:
+                try:
+                    event = timerSleep(secs, scheduler=self.scheduler, wakeOn=wakeOn, redrawSecs=self.countdownRedrawSecs)
+                except KeyboardInterrupt:
+                    # Timer sleep writes on the same line, so if interrupt occurs we want to push to next line
+                    # Do so by printing new line character to next line then raising interrupt
+                    if not self.headless:
+                        print('')
+                    raise KeyboardInterrupt
+            else:
+                event = self.scheduler.sleep(secs, wakeOn=wakeOn)
+        finally:
+            for timer in timers:
+                self.scheduler.cancel(timer)
+
+        if event is not None:
+            name, payload = self.scheduler.takeEvent(wakeOn)
+            if name == CONFIG_EVENT:
+                raise ConfigChangedException()
+            raise PowerStateChangedException(payload)
+
+    def trackedSleep(self, secs: int):
+        """
+        Sleep the specified number of seconds during a cycle e.g. for alerts or verification.
+        Returns early if the laptop is plugged in or unplugged.
+
+        Time between battery samples is measured by the controller's clock, so waits no longer need to be tracked
+        by hand; the name is kept for callers.
+        """
+        try:
+            self.sleep(secs=secs)
+        except PowerStateChangedException as e:
+            logger.info(f'Tracked sleep ended early: {e}')
+
+    def reconfigure(self, batteryFloor: int, batteryCeiling: int, checkIntervalPercentage: int, predAdaptivity: float):
+        '''
+        Applies new thresholds, check interval and adaptivity, keeping the learned sleep predictions.
+        Predictions are for the time to change by `checkIntervalPercentage`%, so they are rescaled if it changes.
+        '''
+        if checkIntervalPercentage != self.checkIntervalPercentage:
+            scale = checkIntervalPercentage / self.checkIntervalPercentage
+            self.learnedPredictions = {charging: int(pred * scale) for charging, pred in self.learnedPredictions.items()}
+            if self.sleepPeriod is not None:
+                self.sleepPeriod = int(self.sleepPeriod * scale)
+
+        self.batteryFloor = batteryFloor
+        self.batteryCeiling = batteryCeiling
+        self.checkIntervalPercentage = checkIntervalPercentage
+        self.predAdaptivity = predAdaptivity
+        if self.loadRates is not None:
+            self.loadRates.adaptivity = predAdaptivity
+
+    def exportState(self) -> dict:
+        '''
+        Returns what the controller has learned as JSON serialisable values, for `importState` in a restarted monitor
+        '''
+        state = {'learnedPredictions': [[charging, pred] for charging, pred in self.learnedPredictions.items()]}
+        if self.loadRates is not None:
+            state['loadRates'] = {'rates': self.loadRates.rates, 'samples': self.loadRates.samples}
+        return state
+
+    def importState(self, state: dict):
+        '''
+        Continues from the predictions and load rates learned by a previous run, see `exportState`
+        '''
+        self.learnedPredictions = {bool(charging): int(pred) for charging, pred in state.get('learnedPredictions', [])}
+        self.importedPredictions = bool(self.learnedPredictions)
+        loadRates = state.get('loadRates')
+        if self.loadRates is not None and loadRates is not None and len(loadRates['rates']) == LoadRateTable.SIZE:
+            self.loadRates.rates = list(loadRates['rates'])
+            self.loadRates.samples = list(loadRates['samples'])
+
+    def resetSleepHistory(self):
+        '''
+        Forgets the last sample and sleep period, so the next prediction starts from scratch
+        '''
+        self.prevPercent = None
+        self.prevReading = None
+        self.sampleMark = None
+        self.sleepPeriod = None
+        self.sleepEndedEarly = False
+        self.continuedPeriod = None
+
+    def takeSample(self):
+        '''
+        Records the current battery reading as the latest sample and measures the awake time since the previous one.
+        Time spent suspended or hibernating is excluded, since the laptop is barely drawing power then.
+        '''
+        self.prevPercent = self.curPercent
+        self.prevCharging = self.charging
+        self.prevReading = self.reading
+        # Shares the reading made by the battery check that ended this cycle
+        self.reading = self.battery.get()
+        self.curPercent, self.charging = self.reading.percent, self.reading.power_plugged
+        if self.loadSampler is not None:
+            self.load = self.loadSampler.sample()
+
+        prevMark = self.sampleMark
+        self.sampleMark = self.clock.mark()
+        if prevMark is None:
+            self.sampleInterval = None
             return
 
-        # Just regular timer sleep
-        sleep(secs)
-        return
+        self.sampleInterval = ClockInterval(self.sampleMark.awake - prevMark.awake, self.sampleMark.total - prevMark.total)
+        sleep_actual.observe(self.sampleInterval.awakeSecs)
+        if self.sampleInterval.suspendedSecs >= 1:
+            logger.info(f'Detected {TimeString.make(self.sampleInterval.suspendedSecs)} suspended since last battery check, excluded from rate estimation')
 
-    def addToDrift(self, secs):
+    @staticmethod
+    def instantRate(reading: BatteryReading):
         '''
-        Adds `secs` to drift.
-        Sleep predictions are based on the battery percentage between calls to sleep function.
-        We can't use time.time() to track the time between calls as that is the UNIX timestamp, so if the PC hibernates then sleep periods become invalid
-        To make predictions more accurate, significant time spent inbetween calls must be tracked e.g. alert sleeps
-        These can be tracked with the drift member, which is included when predicting the next sleep period.
+        Returns (percent change per second, source) estimated from a single reading, or None if the battery source
+        does not report enough. Uses the instantaneous power draw (or charge rate) where available, and otherwise
+        the OS's own time left estimate (`secsleft`, discharging only).
         '''
-        self.drift += secs
+        if reading is None:
+            return None
 
-    def trackedSleep(self, secs: int):
-        """
-        Sleep the specified number of seconds and adds it as drift
-        """
-        self.addToDrift(secs)
-        self.sleep(secs=secs)
+        powerW, fullWh = reading.powerW(), reading.energyFullWh()
+        if powerW and fullWh:
+            return powerW / (fullWh / 100) / 3600, 'power draw'
+
+        if not reading.power_plugged and reading.percent and reading.secsleft not in (None, SECSLEFT_UNKNOWN, SECSLEFT_UNLIMITED) and reading.secsleft > 0:
+            return reading.percent / reading.secsleft, 'time left estimate'
+
+        return None
+
+    def measuredRate(self, awakeSecs: float):
+        '''
+        Returns (percent change per second, source) measured between the previous and current samples.
+        The energy readings are used where the battery reports them, as they change long before a whole percent does.
+        Falls back to the instantaneous rate if neither energy nor percent changed, None if nothing changed at all.
+        '''
+        prev, cur = self.prevReading, self.reading
+        if prev is not None and cur is not None:
+            # raw counters, charge is not converted to energy as the voltage moves with the load
+            for now, full, source in (('energy_now', 'energy_full', 'energy change'), ('charge_now', 'charge_full', 'charge change')):
+                prevVal, curVal, fullVal = getattr(prev, now), getattr(cur, now), getattr(cur, full)
+                if prevVal is not None and curVal is not None and fullVal:
+                    if curVal != prevVal:
+                        return abs(curVal - prevVal) / (fullVal / 100) / awakeSecs, source
+                    break
+
+        if self.curPercent != self.prevPercent:
+            return abs(self.curPercent - self.prevPercent) / awakeSecs, 'percent change'
+
+        return self.instantRate(self.reading)
 
     def predictSleepPeriod(self):
         """
@@ -150,35 +356,114 @@ class ScriptSleepController:
         # pred_ct (q_n) is the predicted time it took to change delta% ( corresponds to q_(n-1))
         # next_pred_ct (q_(n+1)) is the predicted time to change delta% for next iteration
 
-        if self.prevPercent is None or self.sleepPeriod is None:
+        if self.prevPercent is None or self.sampleInterval is None:
+            imported, self.importedPredictions = self.importedPredictions, False
+            instant = self.instantRate(self.reading)
+            if instant is not None:
+                # no history yet, but the battery says how fast it is changing right now
+                pred = max(1, int(self.checkIntervalPercentage / instant[0]))
+                logger.info(f'Calculated Prediction: {pred}s (Initial Prediction from {instant[1]})')
+                return pred
+            learned = self.learnedPredictions.get(self.charging) if imported else None
+            if learned is not None:
+                # a restarted monitor, not one whose history was reset for a change in power use
+                logger.info(f'Calculated Prediction: {learned}s (Prediction learned by the previous run while {"charging" if self.charging else "discharging"})')
+                return learned
             logger.info(f'Calculated Prediction: {self.initSleepPred}s (Initial Prediction used)')
             return self.initSleepPred
 
-        # Include tracked drift as time between calls
-        prev_period = self.sleepPeriod + self.drift
-        logger.info(f'Previously Predicted Sleep Period: {prev_period}s ({self.sleepPeriod}s sleep period + {self.drift}s drift)')
-        self.drift = 0
+        if self.prevCharging is not None and self.prevCharging != self.charging:
+            # Rate measured across a plug change says nothing about either direction
+            # so continue from what was learned the last time the laptop was in this state
+            instant = self.instantRate(self.reading)
+            if instant is not None:
+                pred = max(1, int(self.checkIntervalPercentage / instant[0]))
+                logger.info(f'Calculated Prediction: {pred}s (Charging state changed, prediction from {instant[1]})')
+                return pred
+            learned = self.learnedPredictions.get(self.charging)
+            if learned is None:
+                logger.info(f'Calculated Prediction: {self.initSleepPred}s (Initial Prediction used, charging state changed)')
+                return self.initSleepPred
+            logger.info(f'Calculated Prediction: {learned}s (Last prediction learned while {"charging" if self.charging else "discharging"})')
+            return learned
+
+        # Awake time between samples, includes alert waits, plug control and emails but not suspended time
+        prev_period = max(1, int(round(self.sampleInterval.awakeSecs)))
+        logger.info(f'Previously Predicted Sleep Period: {self.sleepPeriod}s, Measured Time Between Checks: {prev_period}s awake ({int(self.sampleInterval.suspendedSecs)}s suspended)')
+
+        rate = self.measuredRate(float(prev_period))
+
+        continuedPeriod, self.continuedPeriod = self.continuedPeriod, None
+        if rate is None or rate[0] == 0.0:
+            if self.sleepEndedEarly and self.sleepPeriod is not None and prev_period < self.sleepPeriod:
+                # nothing could change in the part of the sleep that was slept, sleep the rest of it
+                # rather than doubling a few seconds and ramping up from scratch
+                self.continuedPeriod = self.sleepPeriod
+                pred = self.sleepPeriod - prev_period
+                logger.info(f'Calculated Prediction: {pred}s (Rest of the {self.sleepPeriod}s sleep that was cut short)')
+                return pred
+
+            if continuedPeriod is not None and continuedPeriod > prev_period:
+                # the sleep before was the rest of one cut short, the whole of it passed without a change
+                logger.info(f'Calculated Prediction: {continuedPeriod*2}s (Doubled the sleep that was cut short since no change was detected)')
+                return continuedPeriod * 2
 
-        percent_drop_per_sec = abs(self.curPercent - self.prevPercent) / float(prev_period)
-
-        if percent_drop_per_sec == 0.0:
             # double predictions until we get some percentage drop
             logger.info(f'Calculated Prediction: {prev_period*2}s (Doubled prediction since no change was detected)')
             return prev_period * 2
 
+        percent_drop_per_sec, rate_source = rate
+
         # calculate the actual time it would take to drop by our desired percent
         actual_drop_period = self.checkIntervalPercentage / percent_drop_per_sec
 
+        if self.loadRates is not None:
+            self.loadRates.observe(self.charging, self.load, 1 / percent_drop_per_sec)
+
         # use the round robin formulat to calculate our next prediction
         next_pred = int(self.predAdaptivity * actual_drop_period + (1 - self.predAdaptivity) * prev_period)
 
         logger.info('Calculated Prediction: %.2fs (Exponential Averaging with alpha=%.2f)' % (next_pred, self.predAdaptivity))
         logger.info(f'Exponential Averaging - Previous Prediction To Change By {self.checkIntervalPercentage}% = {TimeString.make(prev_period)}')
-        logger.info(f'Exponential Averaging - Actual Percentage Change = {abs(self.curPercent - self.prevPercent)}%')
+        logger.info(f'Exponential Averaging - Actual Percentage Change = {abs(self.curPercent - self.prevPercent)}%, Rate From {rate_source} = {percent_drop_per_sec * 3600:.2f}%/hr')
         logger.info(f'Exponential Averaging - Actual Time Required To Change By {self.checkIntervalPercentage}% = {TimeString.make(actual_drop_period)} ')
 
+        self.learnedPredictions[self.charging] = next_pred
         return next_pred
 
+    def predictSecsToCeiling(self):
+        '''
+        Predicts how long until the battery reaches the ceiling, using the charging rate learned from measurements.
+        Returns None if the laptop is not charging, is already at the ceiling, or no charging rate has been learned yet.
+        '''
+        if not self.charging or self.curPercent is None or self.curPercent >= self.batteryCeiling:
+            return None
+
+        secs_per_percent, _ = self.loadRates.lookup(True, self.load) if self.loadRates is not None else (None, None)
+        if secs_per_percent is None:
+            learned = self.learnedPredictions.get(True)
+            if learned is None:
+                return None
+            secs_per_percent = learned / self.checkIntervalPercentage
+
+        return int(secs_per_percent * (self.batteryCeiling - self.curPercent))
+
+    def predictForLoad(self, pred_sleep_period):
+        '''
+        Replaces the overall prediction with the rate learned under the current load, if there is one
+        '''
+        if self.loadRates is None:
+            return pred_sleep_period
+
+        secs_per_percent, bucket = self.loadRates.lookup(self.charging, self.load)
+        if secs_per_percent is None:
+            logger.info(f'Load: {self.load}, no rate learned for this load yet')
+            return pred_sleep_period
+
+        load_pred = max(1, int(secs_per_percent * self.checkIntervalPercentage))
+        logger.info(f'Load: {self.load}, Load Prediction: {load_pred}s (rate learned for {LoadRateTable.bucketName(bucket)} over {self.loadRates.samples[bucket]} checks)')
+        return load_pred
+
     def getNextSleepPeriod(self):
         '''
         Used to get the next sleep period for battery checks.
@@ -187,7 +472,7 @@ class ScriptSleepController:
         if the time to reach one of the thresholds is less than the prediction.
         '''
         cur_percent = self.curPercent
-        pred_sleep_period = self.predictSleepPeriod()
+        pred_sleep_period = self.predictForLoad(self.predictSleepPeriod())
 
         secs_per_percent = pred_sleep_period / self.checkIntervalPercentage
 
@@ -204,24 +489,47 @@ class ScriptSleepController:
 
         if use_below_thresh or use_above_thresh:
             logger.info('Next Sleep Period: Pre-emptive Threshold Prediction')
+            self.sleepPeriodSource = 'threshold'
             return fall_below_thresh_time if use_below_thresh else go_above_thresh_time
 
         logger.info('Next Sleep Period: Calculated Prediction')
+        self.sleepPeriodSource = 'prediction'
         return pred_sleep_period
 
-    def sleepTillNextBatteryCheck(self):
-        self.prevPercent = self.curPercent
-        battery = psutil.sensors_battery()
-        self.curPercent, self.charging = battery.percent, battery.power_plugged
+    def sleepTillNextBatteryCheck(self, beforeSleep=None):
+        '''
+        Samples the battery, predicts the next sleep period and sleeps for it.
+        `beforeSleep()` (if given) is called once the prediction is made, before going to sleep.
+        '''
+        self.takeSample()
+
+        reads, shared = self.battery.endCycle()
+        logger.info(f'Battery Sensor Reads This Cycle: {reads} ({shared} shared readings), Scheduler Wakeups: {self.scheduler.endCycle()}')
 
         self.sleepPeriod = self.getNextSleepPeriod()
+        self.sleepEndedEarly = False
+        sleep_predicted.observe(self.sleepPeriod)
+
+        if beforeSleep is not None:
+            beforeSleep()
 
         printer.info(f'Sleeping {TimeString.make(self.sleepPeriod)}...')
         try:
-            self.sleep(secs=self.sleepPeriod, checkUnlockSignal=True)
+            self.sleep(secs=self.sleepPeriod, checkUnlockSignal=True, wakeOnConfigChange=True, watch=True)
+        except (PowerStateChangedException, ConfigChangedException) as e:
+            # The clock measures how long was actually slept for the next prediction
+            printer.info(f'{e}, checking battery early')
+            self.sleepEndedEarly = True
+        except LoadSpikeException as e:
+            # the prediction was made for a lighter load, start measuring again from this check
+            printer.info(f'{e}, checking battery early')
+            logger.info('Resetting Sleep History and Predictions')
+            watchdog_wakeups.inc()
+            self.resetSleepHistory()
         except UnlockSignalException as e:
             logger.info('Recieved UnlockSignalException. Resetting Sleep History and Predictions')
-            self.prevPercent = None
-            self.sleepPeriod = None
+            self.resetSleepHistory()
+            if self.loadRates is not None:
+                self.loadRates.reset()
             send_notification('Sleep History Reset',
                               "The script's learned sleep history has been reset to accomodate for the increase in power usage")
\ No newline at end of file
@@ -0,0 +1,247 @@
+import csv
+import os
+import signal
+import subprocess
+import sys
+import time
+from enum import Enum
+
+from scripts.PidFile import PidFile
+
+"""
+The ways the battery monitor can run in the background, behind one interface used by `bm.py`:
+- taskscheduler : A Windows Task Scheduler task
+- systemd       : A systemd user unit
+- daemon        : A plain background process started by `bm.py` itself
+
+Each backend starts and stops the monitor with its own tools, but the state is read from the monitor's pid file
+(see `scripts/PidFile.py`) for all of them, so `bm.py status` costs a file open instead of a process.
+The backend's own query is only used if there is no pid file, e.g. for a monitor older than the pid file.
+"""
+
+SERVICE_BACKENDS = ('taskscheduler', 'systemd', 'daemon')
+
+
+class ServiceException(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class TaskStates(Enum):
+    none = 0
+    stopped = 1
+    running = 2
+
+    @staticmethod
+    def stateToStr(state):
+        # Takes a task state enum and returns a string for it=
+
+        enumstr = {
+            str(TaskStates.none) : 'Uknown',
+            str(TaskStates.running) : 'Running',
+            str(TaskStates.stopped) : 'Stopped'
+        }
+
+        s = enumstr.get(str(state))
+
+        if s is not None: return s
+        return enumstr.get(str(TaskStates.none))
+
+    @staticmethod
+    def strToState(statusstr):
+        # takes status string returned from an schtasks query and turns it into a state
+        enumstates = {
+            'running': TaskStates.running,
+            'ready': TaskStates.stopped
+        }
+
+        state = enumstates.get(statusstr.lower())
+
+        if state is not None: return state
+        return TaskStates.none
+
+
+def run_command(cmd: list) -> str:
+    '''
+    Runs `cmd` (without a shell) and returns its output, raises ServiceException if it cannot be run or fails
+    '''
+    try:
+        child = subprocess.run(cmd, capture_output=True, text=True)
+    except OSError as e:
+        raise ServiceException(f'Could not run {cmd[0]}: {e}')
+    if child.returncode != 0:
+        raise ServiceException((child.stderr or child.stdout).strip() or f'{cmd[0]} exited with {child.returncode}')
+    return child.stdout
+
+
+class ServiceBackend:
+    '''
+    Base of the backends, see the module docstring
+    '''
+    name = ''
+
+    def __init__(self, taskName: str, pidFile: PidFile):
+        '''
+        - `taskName` : Name of the task or unit the monitor runs as.
+        - `pidFile` : Pid file the monitor holds while it runs, None if it is not known.
+        '''
+        self.taskName = taskName
+        self.pidFile = pidFile
+
+    def state(self) -> TaskStates:
+        if self.pidFile is None:
+            return self.queryState()
+        running, _ = self.pidFile.probe()
+        if running is not None:
+            return TaskStates.running if running else TaskStates.stopped
+        return self.queryState()
+
+    def stateOrNone(self) -> TaskStates:
+        try:
+            return self.state()
+        except ServiceException:
+            return TaskStates.none
+
+    def pid(self):
+        if self.pidFile is None:
+            return None
+        running, pid = self.pidFile.probe()
+        return pid if running else None
+
+    def queryState(self) -> TaskStates:
+        '''
+        State as told by the backend itself, only used when there is no pid file
+        '''
+        return TaskStates.none
+
+    def start(self) -> str:
+        raise NotImplementedError
+
+    def stop(self) -> str:
+        raise NotImplementedError
+
+    def stopPid(self, pid: int) -> str:
+        '''
+        Stops the monitor running as `pid`
+        '''
+        try:
+            # the monitor stops cleanly on SIGTERM, on Windows this terminates the process
+            os.kill(pid, signal.SIGTERM)
+        except OSError as e:
+            raise ServiceException(f'Could not stop process {pid}: {e}')
+        return f'Sent stop to process {pid}'
+
+    def waitForState(self, state: TaskStates, timeoutSecs: float = 15) -> bool:
+        '''
+        Waits until the monitor is in `state`, returns false if it was not within `timeoutSecs`
+        '''
+        deadline = time.monotonic() + timeoutSecs
+        while self.stateOrNone() != state:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+
+class TaskSchedulerBackend(ServiceBackend):
+    name = 'taskscheduler'
+
+    def schtasks(self, args: list) -> str:
+        return run_command(['schtasks.exe'] + args + ['/tn', self.taskName])
+
+    def queryState(self) -> TaskStates:
+        # one CSV row: "TaskName","Next Run Time","Status"
+        rows = list(csv.reader(self.schtasks(['/query', '/fo', 'csv', '/nh']).splitlines()))
+        if not rows or len(rows[0]) < 3:
+            return TaskStates.none
+        return TaskStates.strToState(rows[0][2])
+
+    def start(self) -> str:
+        return self.schtasks(['/run'])
+
+    def stop(self) -> str:
+        pid = self.pid()
+        try:
+            out = self.schtasks(['/end'])
+        except ServiceException:
+            if pid is None:
+                raise
+            out = ''
+
+        # a monitor that restarted itself (see restart_monitor in battery_monitor.py) runs outside the task,
+        # where /end does not reach it
+        if pid is not None and not self.waitForState(TaskStates.stopped, timeoutSecs=5):
+            out = f'{out}\n{self.stopPid(pid)}'.strip()
+        return out
+
+
+class SystemdBackend(ServiceBackend):
+    name = 'systemd'
+
+    def systemctl(self, args: list) -> str:
+        return run_command(['systemctl', '--user'] + args + [self.taskName])
+
+    def queryState(self) -> TaskStates:
+        # is-active exits non-zero for anything but active
+        try:
+            out = self.systemctl(['is-active'])
+        except ServiceException as e:
+            return TaskStates.stopped if e.message in ('inactive', 'failed') else TaskStates.none
+        return TaskStates.running if out.strip() == 'active' else TaskStates.none
+
+    def start(self) -> str:
+        return self.systemctl(['start'])
+
+    def stop(self) -> str:
+        return self.systemctl(['stop'])
+
+
+class DaemonBackend(ServiceBackend):
+    '''
+    Starts the monitor as a detached background process running `command`, and stops it through its pid file
+    '''
+    name = 'daemon'
+
+    def __init__(self, taskName: str, pidFile: PidFile, command: list = None, cwd: str = None):
+        super().__init__(taskName, pidFile)
+        self.command = command
+        self.cwd = cwd
+
+    def queryState(self) -> TaskStates:
+        # the monitor creates its pid file when it starts and removes it when it exits
+        return TaskStates.stopped
+
+    def start(self) -> str:
+        if not self.command:
+            raise ServiceException('No command to start the monitor with, set "command" or "monitorArgs" in the bm config')
+
+        kwargs = {}
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            # not killed with the terminal bm.py was run from
+            kwargs['start_new_session'] = True
+
+        try:
+            child = subprocess.Popen(self.command, cwd=self.cwd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL, close_fds=True, **kwargs)
+        except OSError as e:
+            raise ServiceException(f'Could not start the monitor: {e}')
+        return f'Started process {child.pid}'
+
+    def stop(self) -> str:
+        pid = self.pid()
+        if pid is None:
+            raise ServiceException('Monitor is not running')
+        return self.stopPid(pid)
+
+
+def make_service_backend(name: str, taskName: str, pidFile: PidFile, command: list = None, cwd: str = None) -> ServiceBackend:
+    if name == 'taskscheduler':
+        return TaskSchedulerBackend(taskName, pidFile)
+    if name == 'systemd':
+        return SystemdBackend(taskName, pidFile)
+    if name == 'daemon':
+        return DaemonBackend(taskName, pidFile, command=command, cwd=cwd)
+    raise ServiceException(f'Unknown service backend "{name}", expected one of: {", ".join(SERVICE_BACKENDS)}')
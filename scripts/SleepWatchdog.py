@@ -0,0 +1,123 @@
+from time import monotonic
+
+from scripts.BatterySnapshot import BatterySnapshot
+from scripts.LoadModel import LoadSampler, LoadSample, LoadRateTable
+from scripts.TimeString import TimeString
+
+
+class LoadSpikeException(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+        self.message = f'Battery would fall below minimum before next check: {reason}'
+        super().__init__(self.message)
+
+
+class SleepWatchdog:
+    '''
+    Checks on the battery every `periodSecs` while the monitor sleeps through a discharge, so a jump in power use
+    (a build, a game) cannot drain the battery past the minimum before the scheduled check.
+
+    Each check takes one battery reading and reads the CPU time counters, and projects how long the battery has
+    left above the minimum from the fastest of:
+    - the drain observed since the sleep started, once the battery has dropped at least two percent,
+    - the instantaneous power draw, where the battery source reports it (sysfs),
+    - the rate learned for the current CPU load, if the sleep controller has a load model.
+
+    If that is sooner than the scheduled check, `check` returns why and the sleep is cut short.
+    '''
+
+    def __init__(self, periodSecs: float = 60, battery: BatterySnapshot = None, loadRates: LoadRateTable = None):
+        '''
+        - `periodSecs` : Time between checks.
+        - `battery` : Battery snapshot shared with the monitor.
+        - `loadRates` : Rates learned per load by the sleep controller, None to only use the battery readings.
+        '''
+        self.periodSecs = periodSecs
+        self.battery = battery if battery is not None else BatterySnapshot()
+        self.loadRates = loadRates
+
+        self.startTime = None
+        self.startPercent = None
+        self.floor = None
+        self.wakeAt = None
+        self.prevCpuTimes = None
+
+        self.checks = 0
+        self.trips = 0
+
+    def start(self, percent: float, floor: int, sleepSecs: float):
+        '''
+        Called as a sleep starts, with the battery percent at the start and the minimum it must stay above
+        '''
+        self.startTime = monotonic()
+        self.startPercent = percent
+        self.floor = floor
+        self.wakeAt = self.startTime + sleepSecs
+        self.prevCpuTimes = LoadSampler.readCpuTimes()
+
+    def cpuPercent(self):
+        times = LoadSampler.readCpuTimes()
+        prev, self.prevCpuTimes = self.prevCpuTimes, times
+        if times is None or prev is None or times[1] <= prev[1]:
+            return None
+        return min(100.0, max(0.0, 100.0 * (times[0] - prev[0]) / (times[1] - prev[1])))
+
+    def projections(self, reading) -> list:
+        '''
+        Returns (source, secs per percent) for each drain rate that can be told from `reading` and the CPU load
+        '''
+        rates = []
+        now = monotonic()
+
+        # sources that report whole percents (psutil on Windows) can tick down a percent moments after the sleep
+        # starts, so one percent can be anything up to twice the real drain, two or more are close enough
+        dropped = self.startPercent - reading.percent
+        if dropped >= 2 and (now - self.startTime) >= self.periodSecs:
+            rates.append(('observed drain', (now - self.startTime) / dropped))
+
+        powerW, fullWh = reading.powerW(), reading.energyFullWh()
+        if powerW and fullWh:
+            # percentages are of the full energy
+            rates.append(('power draw', (fullWh / 100) / powerW * 3600))
+
+        cpu = self.cpuPercent()
+        if cpu is not None and self.loadRates is not None:
+            rate, bucket = self.loadRates.lookup(False, LoadSample(cpu))
+            if rate is not None:
+                rates.append((f'{LoadRateTable.bucketName(bucket)} load', rate))
+
+        return rates
+
+    def check(self):
+        '''
+        Returns the reason the sleep should be cut short, or None if the battery is projected to last until the scheduled check
+        '''
+        if self.startTime is None:
+            return None
+
+        remaining = self.wakeAt - monotonic()
+        if remaining <= self.periodSecs:
+            # the scheduled check comes before the next watchdog check would
+            return None
+
+        self.checks += 1
+        reading = self.battery.get(fresh=True)
+        if reading.power_plugged:
+            return None
+
+        margin = reading.percent - self.floor
+        if margin <= 0:
+            self.trips += 1
+            return f'battery is at {reading.percent}%'
+
+        rates = self.projections(reading)
+        if not rates:
+            return None
+
+        source, secsPerPercent = min(rates, key=lambda r: r[1])
+        secsToFloor = margin * secsPerPercent
+        if secsToFloor >= remaining:
+            return None
+
+        self.trips += 1
+        return f'{source} reaches {self.floor}% in {TimeString.make(secsToFloor) or "under a second"}, next check was in {TimeString.make(remaining)}'
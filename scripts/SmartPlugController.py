@@ -1,10 +1,17 @@
 import subprocess
 import re
+import sys
 import time
-import asyncio
 import logging
-from kasa import SmartDeviceException
-from kasa import SmartPlug #https://python-kasa.readthedocs.io/en/latest/index.html
+from scripts.MetricsRegistry import plug_control, plug_control_latency, plug_timer
+from scripts.PhaseTimer import phases
+
+
+# The kasa module (https://python-kasa.readthedocs.io/en/latest/index.html) takes longer to import than the rest
+# of the monitor combined and is only needed when the plug is controlled, so it (and asyncio) is imported on first use
+
+# Name given to the countdown rules the monitor sets on the plug
+COUNTDOWN_RULE_NAME = 'battery_monitor'
 
 
 class SmartPlugControllerException(Exception):
@@ -20,7 +27,9 @@ class SmartPlugController:
                  home_network_name:str, 
                  tplink_creds:tuple=None, 
                  TPLinkAvail:bool = False,
-                 logger: logging.Logger = None):
+                 logger: logging.Logger = None,
+                 plug_port: int = None,
+                 check_home_network: bool = True):
         '''
         Initialize a SmartPlug Controller, takes:
 
@@ -29,6 +38,8 @@ class SmartPlugController:
         - `home_network_name` : Name of your home network.
         - `tplink_creds`: TP Link Account credentials in the form of tuple: `(username, password)`
         - `TPLinkAvail` : True if the TP Link Command Line Utility (https://apps.microsoft.com/store/detail/tplink-kasa-control-command-line/9ND8C9SJB8H6?hl=en-ca&gl=ca) is installed on the computer
+        - `plug_port` : Port the plug listens on, only needed for plugs not on the default port e.g. a fake plug (see `scripts/FakeKasaPlug.py`).
+        - `check_home_network` : If false, the plug is controlled without checking the home network first.
         '''
         
         self.plug_ip = plug_ip
@@ -37,9 +48,22 @@ class SmartPlugController:
         self.tplink_creds = tplink_creds
         self.TPLinkAvail = TPLinkAvail
         self.logger = logger
+        self.plug_port = plug_port
+        self.check_home_network = check_home_network
 
         # set the event loop policy on initialization
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        if sys.platform == 'win32':
+            import asyncio
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    def reconfigure(self, plug_ip: str, plug_name: str, home_network_name: str, plug_port: int = None):
+        '''
+        Points the controller at a different plug or home network, used when the config is reloaded.
+        '''
+        self.plug_ip = plug_ip
+        self.plug_name = plug_name
+        self.home_network = home_network_name
+        self.plug_port = plug_port
 
     def log(self, text: str, level: int=logging.INFO):
         if self.logger is None:
@@ -65,7 +89,25 @@ class SmartPlugController:
         if self.home_network == '':
             raise SmartPlugControllerException('No home network provided!')
 
-        data, _ = SmartPlugController.__get_process_output(['netsh', 'WLAN', 'show', 'interfaces'])
+        with phases.phase('network_check'):
+            data, _ = SmartPlugController.__get_process_output(['netsh', 'WLAN', 'show', 'interfaces'])
+
+        info = SmartPlugController.parse_netsh_interfaces(data)
+
+        adapter = info['name'].lower()
+        network = info['ssid']
+        connected = ( info['state'].lower() == 'connected')
+
+        if adapter != 'wi-fi':
+            raise SmartPlugControllerException('Unrecognized interface name: "{}", reconfigure parsing!'.format(info['name']))
+        
+        return ( connected and network == self.home_network )
+
+    @staticmethod
+    def parse_netsh_interfaces(data: str) -> dict:
+        '''
+        Parses the output of `netsh WLAN show interfaces` into a dictionary with the interface's name, ssid and state.
+        '''
         data_lines = data.split('\n')
 
         info = {
@@ -93,14 +135,7 @@ class SmartPlugController:
                 info[field_name] = field_value
                 if all( info[k] != '' for k in info.keys()): break
 
-        adapter = info['name'].lower()
-        network = info['ssid']
-        connected = ( info['state'].lower() == 'connected')
-
-        if adapter != 'wi-fi':
-            raise SmartPlugControllerException('Unrecognized interface name: "{}", reconfigure parsing!'.format(info['name']))
-        
-        return ( connected and network == self.home_network )
+        return info
 
     def run_tplinkcmd(self, cmdargs: list) -> None:
         '''
@@ -145,34 +180,82 @@ class SmartPlugController:
         time.sleep(2)
 
     def start_plug_timer(self, secs, on=False, off=False):
-        hours = int(secs / 3600)
-        mins = int((secs % 3600) / 60)
+        '''
+        Starts the plug's timer with TPLinkCmd.exe, which turns the plug on or off in `secs` seconds.
+        TPLinkCmd timers are set in whole minutes, so `secs` is rounded down to the minute (at least 1 minute).
+        '''
+        mins = max(1, int(secs / 60))
+        hours = int(mins / 60)
+        mins = mins % 60
 
         self.run_tplinkcmd([
             '-device', self.plug_name,
-            '-timer', 'start', 
-            '-h', hours, '-m', mins,
+            '-timer', 'start',
+            '-h', str(hours), '-m', str(mins),
             '-action', '1' if on else '0'])
         self.log('Started Timer for  {} hours and {} mins'.format(hours, mins))
 
+    def stop_plug_timer(self):
+        '''
+        Stops the plug's timer with TPLinkCmd.exe
+        '''
+        self.run_tplinkcmd(['-device', self.plug_name, '-timer', 'stop'])
+        self.log('Stopped Timer')
+
+    def make_plug(self):
+        from kasa import DeviceConfig, SmartPlug
+        if self.plug_port is None:
+            return SmartPlug(self.plug_ip)
+        return SmartPlug(self.plug_ip, config=DeviceConfig(self.plug_ip, port_override=self.plug_port))
+
     async def set_plug_with_pykasa(self, on=False, off=False) -> None:
         '''
         Sets the plug to the desired on or off using the python Kasa module.
         '''
-        plug = SmartPlug(self.plug_ip)
-        if on: await plug.turn_on()
-        else: await plug.turn_off()
+        plug = self.make_plug()
+        try:
+            if on: await plug.turn_on()
+            else: await plug.turn_off()
+        finally:
+            # each call runs in its own event loop, the plug's connection cannot outlive it
+            await plug.disconnect()
+
+    async def set_countdown_with_pykasa(self, secs: int = None, on=False, off=False) -> None:
+        '''
+        Replaces the plug's countdown rules using the python Kasa module. If `secs` is given, a rule is added that turns
+        the plug on or off in `secs` seconds, otherwise the plug is left without a countdown.
+        '''
+        methods = {'delete_all_rules': {}}
+        if secs is not None:
+            methods['add_rule'] = {'name': COUNTDOWN_RULE_NAME, 'enable': 1, 'delay': int(secs), 'act': 1 if on else 0}
+
+        plug = self.make_plug()
+        try:
+            response = await plug.protocol.query({'count_down': methods})
+        finally:
+            await plug.disconnect()
+
+        results = response.get('count_down', {})
+        for method in methods:
+            res = results.get(method, results)
+            if res.get('err_code', 0) != 0:
+                raise SmartPlugControllerException(f'Countdown {method} failed: {res.get("err_msg", res)}')
 
     async def __is_plug_on(self) -> bool:
-        plug = SmartPlug(self.plug_ip)
-        await plug.update()  # Request the update
-        return plug.is_on
+        plug = self.make_plug()
+        try:
+            await plug.update()  # Request the update
+            return plug.is_on
+        finally:
+            await plug.disconnect()
         
     def is_plug_on(self) -> bool:
         '''
         Checks if the plug is on.
         '''
-        return asyncio.run(self.__is_plug_on())
+        import asyncio
+        with phases.phase('plug_query'):
+            return asyncio.run(self.__is_plug_on())
     
     def isPlugSetTo(self, on: bool = False, off: bool = False) -> bool:
         '''
@@ -183,6 +266,7 @@ class SmartPlugController:
         
         or plug is off and `off` is true.
         '''
+        from kasa import SmartDeviceException
         try:
             plug_on = self.is_plug_on()
             return (on and plug_on) or ( off and not plug_on)
@@ -204,10 +288,13 @@ class SmartPlugController:
         '''
         if not (on or off):
             raise SmartPlugControllerException('No plug control was set!')
+
+        import asyncio
+        from kasa import SmartDeviceException
         
         self.log('Setting plug to {} state'.format('on' if on else 'off'))
 
-        if not self.on_home_network():
+        if self.check_home_network and not self.on_home_network():
             self.log('Not on home network', level=logging.ERROR)
             return -2
 
@@ -219,22 +306,34 @@ class SmartPlugController:
         use_tplink = False if not self.TPLinkAvail else use_tplink
         
         if use_pykasa:
+            start = time.perf_counter()
             try:
                 self.log('Setting plug with Python Kasa')
-                asyncio.run(self.set_plug_with_pykasa(on=on, off=off))
+                with phases.phase('plug_command'):
+                    asyncio.run(self.set_plug_with_pykasa(on=on, off=off))
             except SmartDeviceException as e:
                 self.log(f'Python Control Failed: {e}', level=logging.WARNING)
-        
-        if self.isPlugSetTo(on=on, off=off): return 0
+            plug_control_latency.observe(time.perf_counter() - start, backend='pykasa')
+
+            if self.isPlugSetTo(on=on, off=off):
+                plug_control.inc(backend='pykasa', result='success')
+                return 0
+            plug_control.inc(backend='pykasa', result='failure')
 
         if use_tplink:
             self.log('Setting plug with TP Link CL Utility')
+            start = time.perf_counter()
             try:
-                self.set_plug_via_tplink(on=on, off=off)
+                with phases.phase('plug_command'):
+                    self.set_plug_via_tplink(on=on, off=off)
             except SmartPlugControllerException as e:
                 self.log(f'CL Utility Failed: {e}', level=logging.WARNING)
+            plug_control_latency.observe(time.perf_counter() - start, backend='tplink')
 
-        if self.isPlugSetTo(on=on, off=off): return 1
+            if self.isPlugSetTo(on=on, off=off):
+                plug_control.inc(backend='tplink', result='success')
+                return 1
+            plug_control.inc(backend='tplink', result='failure')
         
         self.log('Plug control failed', level=logging.ERROR)
         return -1
@@ -242,3 +341,58 @@ class SmartPlugController:
 
 
 
+
+
+    def set_plug_timer(self, secs: int = None, on=False, off=False, use_pykasa=True, use_tplink=True) -> int:
+        '''
+        Sets the plug's own countdown timer to turn it on or off in `secs` seconds, replacing any timer already running.
+        The plug acts on the timer by itself, whether or not the laptop is awake by then.
+        If `secs` is None the timer is cancelled instead.
+
+        Attempts the Kasa module first (if allowed), then TPLinkCmd.exe (if allowed), like `set_plug`.
+
+        Returns 0 if the timer was set with the Kasa module, 1 if it was set with TPLinkCmd.exe, -1 if it could not be set, and -2 if not on the home network.
+        '''
+        if secs is not None and not (on or off):
+            raise SmartPlugControllerException('No plug control was set!')
+
+        import asyncio
+        from kasa import SmartDeviceException
+
+        action = 'cancel' if secs is None else 'arm'
+
+        if self.check_home_network and not self.on_home_network():
+            self.log('Not on home network', level=logging.ERROR)
+            return -2
+
+        if use_pykasa:
+            try:
+                with phases.phase('plug_command'):
+                    asyncio.run(self.set_countdown_with_pykasa(secs, on=on, off=off))
+                plug_timer.inc(action=action, result='success')
+                return 0
+            except (SmartDeviceException, SmartPlugControllerException) as e:
+                self.log(f'Python Timer Control Failed: {e}', level=logging.WARNING)
+                plug_timer.inc(action=action, result='failure')
+
+        if use_tplink and self.TPLinkAvail and self.tplink_creds is not None:
+            try:
+                with phases.phase('plug_command'):
+                    if secs is None:
+                        self.stop_plug_timer()
+                    else:
+                        self.start_plug_timer(secs, on=on, off=off)
+                plug_timer.inc(action=action, result='success')
+                return 1
+            except SmartPlugControllerException as e:
+                self.log(f'CL Utility Timer Control Failed: {e}', level=logging.WARNING)
+                plug_timer.inc(action=action, result='failure')
+
+        self.log('Plug timer control failed', level=logging.ERROR)
+        return -1
+
+    def cancel_plug_timer(self, use_pykasa=True, use_tplink=True) -> int:
+        '''
+        Cancels the plug's countdown timer, returns the same as `set_plug_timer`.
+        '''
+        return self.set_plug_timer(None, use_pykasa=use_pykasa, use_tplink=use_tplink)
@@ -0,0 +1,77 @@
+import sys
+import time
+
+
+class ClockMark:
+    '''
+    A point in time read from both of `SuspendClock`'s clocks.
+    '''
+    def __init__(self, awake: float, total: float):
+        self.awake = awake
+        self.total = total
+
+
+class ClockInterval:
+    '''
+    Time between two `ClockMark`s, split into time awake and time suspended.
+    '''
+    def __init__(self, awakeSecs: float, totalSecs: float):
+        self.awakeSecs = awakeSecs
+        self.totalSecs = totalSecs
+        # clocks are read one after the other, so tiny negative values are possible
+        self.suspendedSecs = max(0.0, totalSecs - awakeSecs)
+
+
+class SuspendClock:
+    '''
+    Pairs a clock that stops while the computer is suspended or hibernating with one that keeps counting,
+    so the time between two points can be split into awake time and suspended time.
+
+    | Platform | Awake clock                  | Total clock          |
+    | :---     | :---                         | :---                 |
+    | Linux    | CLOCK_MONOTONIC              | CLOCK_BOOTTIME       |
+    | macOS    | CLOCK_UPTIME_RAW             | CLOCK_MONOTONIC      |
+    | Windows  | QueryUnbiasedInterruptTime   | GetTickCount64       |
+
+    Anywhere else both clocks are `time.monotonic` and no suspend time is ever detected.
+    '''
+
+    def __init__(self):
+        self.awakeFnc, self.totalFnc = SuspendClock.__pickClocks()
+        self.detectsSuspend = self.awakeFnc is not self.totalFnc
+
+    @staticmethod
+    def __pickClocks():
+        if sys.platform.startswith('linux') and hasattr(time, 'CLOCK_BOOTTIME'):
+            return (lambda: time.clock_gettime(time.CLOCK_MONOTONIC)), (lambda: time.clock_gettime(time.CLOCK_BOOTTIME))
+
+        if sys.platform == 'darwin' and hasattr(time, 'CLOCK_UPTIME_RAW'):
+            return (lambda: time.clock_gettime(time.CLOCK_UPTIME_RAW)), (lambda: time.clock_gettime(time.CLOCK_MONOTONIC))
+
+        if sys.platform == 'win32':
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.GetTickCount64.restype = ctypes.c_ulonglong
+
+            def unbiased():
+                # 100ns units, excludes time spent in sleep or hibernation
+                t = ctypes.c_ulonglong()
+                kernel32.QueryUnbiasedInterruptTime(ctypes.byref(t))
+                return t.value / 1E7
+
+            return unbiased, (lambda: kernel32.GetTickCount64() / 1E3)
+
+        return time.monotonic, time.monotonic
+
+    def total(self) -> float:
+        '''
+        Reads the clock that keeps counting while suspended
+        '''
+        return self.totalFnc()
+
+    def mark(self) -> ClockMark:
+        return ClockMark(self.awakeFnc(), self.totalFnc())
+
+    def since(self, mark: ClockMark) -> ClockInterval:
+        now = self.mark()
+        return ClockInterval(now.awake - mark.awake, now.total - mark.total)
@@ -1,10 +1,62 @@
 import re
+from functools import lru_cache
 
 class TimeStringException(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
 
+# A number, whole or fractional e.g. 2, 1.5, .5
+_NUMBER = r'(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)'
+
+# The whole time string grammar: each unit at most once, largest unit first, spaces allowed anywhere between
+_GRAMMAR = re.compile(r'''
+    \s*
+    (?:(?P<days>{n})\s*(?:days|day|d)\s*)?
+    (?:(?P<hours>{n})\s*(?:hours|hour|hrs|hr|h)\s*)?
+    (?:(?P<mins>{n})\s*(?:minutes|minute|mins|min|m)\s*)?
+    (?:(?P<secs>{n})\s*(?:seconds|second|secs|sec|s)\s*)?
+    '''.format(n=_NUMBER), re.IGNORECASE | re.VERBOSE)
+
+_UNIT_SECS = (('days', 86400), ('hours', 3600), ('mins', 60), ('secs', 1))
+
+# Sizes of the parse and make caches, time strings and durations repeat a lot (config values, log lines)
+_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _parse(timestr: str):
+    res = _GRAMMAR.fullmatch(timestr)
+    if res is None or res.lastindex is None:
+        raise TimeStringException('Could not parse time string: {}'.format(timestr))
+
+    groups = res.groupdict()
+    seconds = 0
+    for unit, unitSecs in _UNIT_SECS:
+        val = groups[unit]
+        if val is not None:
+            seconds += int(val) * unitSecs if val.isdigit() else float(val) * unitSecs
+
+    if isinstance(seconds, float) and seconds.is_integer():
+        return int(seconds)
+    return seconds
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _make(seconds: int) -> str:
+    hrs, rem = divmod(seconds, 3600)
+    mins, secs = divmod(rem, 60)
+
+    parts = []
+    if hrs > 0:
+        parts.append('{} hr{}'.format(hrs, 's' if hrs > 1 else ''))
+    if mins > 0:
+        parts.append('{} min{}'.format(mins, 's' if mins > 1 else ''))
+    if secs > 0:
+        parts.append('{} sec{}'.format(secs, 's' if secs > 1 else ''))
+    return ' '.join(parts)
+
+
 class TimeString:
     '''
     Used to make or parse "TimeStrings", which are simple strings that represent a given amount of time.
@@ -20,66 +72,47 @@ class TimeString:
     | `3h30s`                  | 3 hours and 30 seconds               |
     | `3h 3m`                  | 3 hours and 3 minutes                |
     | `2h30m16s`               | 2 hours, 30 minutes and 16 seconds   |
+    | `1d 2h`                  | 1 day and 2 hours                    |
+    | `1.5h`                   | 1 hour and 30 minutes                |
 
-    Can also use full names, like mins, secs, and hours e.g. "2hrs 3mins 2secs" or "2hours 3mins 2secs"
+    Can also use full names, like days, hours, mins and secs e.g. "2hrs 3mins 2secs" or "2hours 3minutes 2seconds".
+    Units must appear largest first and at most once. Parsing and making are cached, so repeated values are cheap.
     '''
 
     @staticmethod
     def parse(timestr: str) -> int:
         '''
-        Parse a time string into seconds
+        Parse a time string into seconds.
+        Returns an int, unless fractional units leave a fraction of a second (e.g. "0.5s") in which case a float is returned
         '''
-        possible_formats = [
-            "([0-9][0-9]* *hour[s]*)* *([0-9][0-9]* *min[s]*)* *([0-9][0-9]* *sec[s]*)*",
-            "([0-9][0-9]* *hr[s]*)* *([0-9][0-9]* *min[s]*)* *([0-9][0-9]* *sec[s]*)*",
-            "([0-9][0-9]* *h)* *([0-9][0-9]* *m)* *([0-9][0-9]* *s)*",
-        ]
-
-        timestr = timestr.lower()
-
-        groups = None
-        for frmt in possible_formats:
-            res = re.search(frmt, timestr)
-            if (res is not None) and (len(res.groups()) == 3) and (any(g is not None for g in res.groups())):
-                groups = list(res.groups())
-                break
-
-        if groups is None:
+        if not isinstance(timestr, str):
             raise TimeStringException('Could not parse time string: {}'.format(timestr))
-
-
-        for i in range(0, 3):
-            if groups[i]:
-                digit_str = ''
-                # remove the letters from each time string
-                for j in range(len(groups)):
-                    if not groups[i][j].isdigit():
-                        break
-                    digit_str += groups[i][j]
-                groups[i] = int(digit_str)
-            else:
-                groups[i] = 0
-
-        #calculate seconds
-        seconds = (groups[0]*3600) + (groups[1]*60) + groups[2]
-        return seconds
+        return _parse(timestr)
 
     @staticmethod
     def make(seconds: int) -> str:
         '''
-        Make time string from seconds input
+        Make time string from seconds input, fractions of a second are dropped
         '''
-        _hrs = int(seconds / 3600)
-        _mins = int((seconds % 3600) / 60)
-        _secs = int((seconds % 3600) % 60)
+        if seconds >= 0:
+            return _make(int(seconds))
 
-        timestr = ''
+        # negative durations keep their old (wrapped) rendering
+        return _make(int(seconds / 3600) * 3600 + int(seconds % 3600))
 
-        info = ( (_secs, 'sec'), (_mins, 'min'), (_hrs, 'hr') )
+    @staticmethod
+    def parseMany(timestrs) -> list:
+        '''
+        Parse every time string in `timestrs` (any iterable), returns the seconds as a list in the same order
+        '''
+        parse = TimeString.parse
+        return [parse(s) for s in timestrs]
 
-        for pair in info:
-            val, unit = pair
-            if val > 0:
-                timestr = '{} {}'.format('{} {}{}'.format(val, unit, 's' if val > 1 else ''), timestr)
-        
-        return timestr.strip()
+    @staticmethod
+    def makeMany(seconds) -> list:
+        '''
+        Make a time string for every amount of seconds in `seconds` (any iterable of numbers, e.g. a list or array.array),
+        returns them as a list in the same order
+        '''
+        make = TimeString.make
+        return [make(s) for s in seconds]
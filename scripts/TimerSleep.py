@@ -1,12 +1,51 @@
+import os
 import sys
-from time import sleep
 
-def timerSleep(secs: int, checkFnc=None) -> None:
+from scripts.DeadlineScheduler import DeadlineScheduler
+
+# Longest time between redraws while the countdown cannot be seen
+MAX_BACKOFF_REDRAW_SECS = 60
+
+
+def stdoutIsTTY() -> bool:
+    try:
+        return sys.stdout is not None and sys.stdout.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def terminalVisible() -> bool:
+    '''
+    Best effort check of whether anyone can see the countdown.
+    On Windows the console window must not be minimised, elsewhere the process must be in the terminal's foreground.
+    '''
+    if sys.platform == 'win32':
+        import ctypes
+        hwnd = ctypes.windll.kernel32.GetConsoleWindow()
+        # Windows Terminal hosts consoles in a hidden pseudo window, so only minimised counts as not visible
+        return not (hwnd and ctypes.windll.user32.IsIconic(hwnd))
+
+    try:
+        return os.tcgetpgrp(sys.stdout.fileno()) == os.getpgrp()
+    except (AttributeError, OSError, ValueError):
+        return True
+
+
+def timerSleep(secs: int, checkFnc=None, scheduler: DeadlineScheduler = None, wakeOn=None, redrawSecs: float = 1):
         '''
         Puts process to sleep for the specified seconds.
 
         Also maintains a time remaining countdown on the console.
+
+        The countdown counts down to a monotonic deadline on `scheduler` (a private scheduler if None), so it finishes
+        exactly on time no matter how often it is redrawn. It is redrawn every `redrawSecs`, backing off up to
+        `MAX_BACKOFF_REDRAW_SECS` while the terminal is not visible, and not at all when stdout is not a terminal.
+        `checkFnc` is called with each redraw.
+
+        Returns the scheduler event that ended the sleep early, if any (see `DeadlineScheduler.sleep`).
         '''
+        if scheduler is None:
+            scheduler = DeadlineScheduler()
 
         # [ hours, mins, secs ]
         times = [0, 0, 0]
@@ -19,26 +58,53 @@ def timerSleep(secs: int, checkFnc=None) -> None:
             times[0] = int(secs / 3600)
             times[1] = int((secs % 3600) / 60)
             times[2] = int((secs % 3600) % 60)
-            
+
             for i, t in enumerate(times):
                 timeStrs[i] = f'0{t}' if t < 10 else f'{t}'
-            
+
             return ' : '.join(timeStrs)
 
         max_width = len(formatSecs(secs))
         msg_format = "Sleeping... " + "{:<" + str(max_width) + "s}"
         msg_len = len(msg_format.format('a'))
 
-        # writes the time stamp on the same line every second to simulate countdown
-        for remaining in range(secs, 0, -1):
-            sys.stdout.write("\r" + msg_format.format(formatSecs(remaining)))
-            sys.stdout.flush()
-            sleep(1)
+        deadline = scheduler.now() + secs
+        tty = stdoutIsTTY()
+        # [ current redraw period, pending redraw timer ]
+        redraw_state = [redrawSecs, None]
+
+        def redraw():
+            if tty:
+                # writes the time stamp on the same line to simulate countdown
+                # rounded since coalesced timers can fire slightly early
+                remaining = max(0, round(deadline - scheduler.now()))
+                sys.stdout.write("\r" + msg_format.format(formatSecs(remaining)))
+                sys.stdout.flush()
+
             # Run our check function if any
             if checkFnc is not None:
                 checkFnc()
 
+            if not tty and checkFnc is None:
+                return
+
+            if tty and terminalVisible():
+                redraw_state[0] = redrawSecs
+            else:
+                redraw_state[0] = min(redraw_state[0] * 2, max(redrawSecs, MAX_BACKOFF_REDRAW_SECS))
+
+            # the final redraw is the Done message, written when the sleep ends
+            if scheduler.now() + redraw_state[0] < deadline - 0.5:
+                redraw_state[1] = scheduler.schedule(redraw_state[0], redraw, name='countdown')
+
+        redraw()
+        try:
+            event = scheduler.sleep(secs, wakeOn=wakeOn)
+        finally:
+            scheduler.cancel(redraw_state[1])
+
         # overwrite timestamp with Done when finished sleeping
         finish_msg_format = "{:<" + str(msg_len) + "s}"
         finish_msg = finish_msg_format.format('Done!')
-        sys.stdout.write("\r{}\n".format(finish_msg))
+        sys.stdout.write("\r{}\n".format(finish_msg) if tty else "{}\n".format(finish_msg.strip()))
+        return event
@@ -1,11 +1,14 @@
 import argparse
 import json
+import os
 import sys
 from argparse import Namespace
 from os import path
 
 
 from scripts.TimeString import TimeString
+from scripts.BatterySource import BATTERY_SOURCES
+from scripts.PhaseTimer import PhaseTimer, PhaseTimerException
 from scripts.functions import get_plug_password, get_emailer_password, PLUG_CREDENTIAL_STORE, EMAIL_CREDENTIAL_STORE
 
 class ArgumentException(Exception):
@@ -19,6 +22,7 @@ class CommandLineArgs:
         self.configJSON = args.config
         self.plugIP = args.plug_ip
         self.plugName = args.plug_name
+        self.plugPort = args.plug_port
         self.wifi = args.home_wifi
         self.logDir = args.logdir
         self.batteryMin = args.min
@@ -34,6 +38,25 @@ class CommandLineArgs:
         self.printLogs = args.printlogs
         self.noLogFile = args.nologfile
         self.testing = args.testing
+        self.collectorUrl = args.collector
+        self.batterySource = args.battery_source
+        self.powerEvents = args.power_events
+        self.plugTimer = args.plug_timer
+        self.noLoadModel = args.no_load_model
+        self.countdownRedraw = args.countdown_redraw
+        self.configPoll = args.config_poll
+        self.watchdogPeriod = args.watchdog_period
+        self.metricsFile = args.metrics_file
+        self.historyDB = args.history_db
+        self.historyKeepRaw = args.history_keep_raw
+        self.historyKeepMinutes = args.history_keep_minutes
+        self.historyKeepEvents = args.history_keep_events
+        self.metricsPort = args.metrics_port
+        self.phaseBudgets = args.phase_budgets
+        self.memoryDiagnostics = args.memory_diagnostics
+        self.memoryCheckPeriod = args.memory_check_period
+        self.rssCeiling = args.rss_ceiling
+        self.pidFile = args.pidfile
 
     def checkArgs(self):
         """
@@ -72,6 +95,89 @@ class CommandLineArgs:
         except Exception:
             raise ArgumentException('Could not parse time string specified for -alert')
 
+        try:
+            secs = TimeString.parse(self.configPoll)
+        except Exception:
+            raise ArgumentException('Could not parse time string specified for -config-poll')
+
+        if secs <= 0:
+            raise ArgumentException('-config-poll must be at least 1 second')
+
+        if self.collectorUrl is not None and not self.collectorUrl.startswith(('http://', 'https://')):
+            raise ArgumentException(f'-collector must be an http:// or https:// URL, got "{self.collectorUrl}"')
+
+        try:
+            secs = TimeString.parse(self.watchdogPeriod)
+        except Exception:
+            raise ArgumentException('Could not parse time string specified for -watchdog-period')
+
+        if secs != 0 and secs < 1:
+            raise ArgumentException('-watchdog-period must be at least 1 second, or 0s to disable the watchdog')
+
+        try:
+            secs = TimeString.parse(self.countdownRedraw)
+        except Exception:
+            raise ArgumentException('Could not parse time string specified for -countdown-redraw')
+
+        if secs <= 0:
+            raise ArgumentException('-countdown-redraw must be at least 1 second')
+
+        if self.metricsFile is not None and not path.isdir(path.dirname(path.abspath(self.metricsFile))):
+            raise ArgumentException(f'Directory for metrics file "{self.metricsFile}" does not exist')
+
+        if self.historyDB is not None and not path.isdir(path.dirname(path.abspath(self.historyDB))):
+            raise ArgumentException(f'Directory for history database "{self.historyDB}" does not exist')
+
+        try:
+            keepRaw = TimeString.parse(self.historyKeepRaw)
+        except Exception:
+            raise ArgumentException('Could not parse time string specified for -history-keep-raw')
+
+        try:
+            keepMinutes = TimeString.parse(self.historyKeepMinutes)
+        except Exception:
+            raise ArgumentException('Could not parse time string specified for -history-keep-minutes')
+
+        if keepRaw < 60:
+            raise ArgumentException('-history-keep-raw must be at least 1 minute')
+
+        if keepMinutes < keepRaw:
+            raise ArgumentException('-history-keep-minutes must be at least as long as -history-keep-raw')
+
+        try:
+            keepEvents = TimeString.parse(self.historyKeepEvents)
+        except Exception:
+            raise ArgumentException('Could not parse time string specified for -history-keep-events')
+
+        if keepEvents < 60:
+            raise ArgumentException('-history-keep-events must be at least 1 minute')
+
+        if self.plugPort is not None and not (0 < self.plugPort < 65536):
+            raise ArgumentException('-plug-port must be between 1 and 65535')
+
+        if self.metricsPort is not None and not (0 < self.metricsPort < 65536):
+            raise ArgumentException('-metrics-port must be between 1 and 65535')
+
+        try:
+            secs = TimeString.parse(self.memoryCheckPeriod)
+        except Exception:
+            raise ArgumentException('Could not parse time string specified for -memory-check-period')
+
+        if secs < 1:
+            raise ArgumentException('-memory-check-period must be at least 1 second')
+
+        if self.rssCeiling is not None and self.rssCeiling <= 0:
+            raise ArgumentException('-rss-ceiling must be non-zero positive integer')
+
+        if self.pidFile is not None and not path.isdir(path.dirname(path.abspath(self.pidFile))):
+            raise ArgumentException(f'Directory of -pidfile "{self.pidFile}" does not exist')
+
+        if self.phaseBudgets is not None:
+            try:
+                PhaseTimer.parseBudgets(self.phaseBudgets)
+            except PhaseTimerException as e:
+                raise ArgumentException(f'-phase-budgets: {e}')
+
         if self.emailRecipient is not None and self.emailUsername is None:
             raise ArgumentException('Specified email recipient but no email credentials')
 
@@ -82,11 +188,17 @@ class CommandLineArgs:
             raise ArgumentException(f'Could not retrieve TP Link credentials for username "{self.plugAccUsername}", are they stored in generic credential "{PLUG_CREDENTIAL_STORE}"?')
 
 
+# Arguments that must be given either on the command line or in the config file
+REQUIRED_ARGS = ('-plug-ip', '-plug-name', '-home-wifi', '-logdir')
+
+
 def make_arg_parser(configFirst=False):
+    '''
+    Makes the monitor's argument parser.
+    If `configFirst`, no argument is required by the parser, `parse_args` checks `REQUIRED_ARGS` once the config file is merged in.
+    '''
     def required_if_no_config():
-        if not configFirst:
-            return True
-        return '-config' not in sys.argv
+        return not configFirst
 
     # Contains all regular arguments
     argParser = argparse.ArgumentParser()
@@ -191,6 +303,33 @@ def make_arg_parser(configFirst=False):
         default=20,
     )
 
+    argParser.add_argument(
+        "-config-poll",
+        required=False,
+        type=str,
+        default='5s',
+        metavar='<poll_period>',
+        help="How often the -config file is checked for changes, which are applied without restarting, default: 5s",
+    )
+
+    argParser.add_argument(
+        "-watchdog-period",
+        required=False,
+        type=str,
+        default='1m',
+        metavar='<check_period>',
+        help="How often the battery is checked while sleeping through a discharge, to wake early if it would fall below -min before the next check. 0s disables it, default: 1m",
+    )
+
+    argParser.add_argument(
+        "-countdown-redraw",
+        required=False,
+        type=str,
+        metavar='<redraw_period>',
+        help="How often the sleep countdown is redrawn on the console, default: 1s",
+        default='1s'
+    )
+
     argParser.add_argument(
         "-email-creds",
         required=False,
@@ -215,6 +354,143 @@ def make_arg_parser(configFirst=False):
         help=f"The email of your TP Link Account. Only use if you have TP Link Command Line Utility installed. Password must be stored as a generic credential under '{PLUG_CREDENTIAL_STORE}'",
     )
 
+    argParser.add_argument(
+        "-plug-port",
+        required=False,
+        type=int,
+        metavar='<port>',
+        help="Port of the Kasa Smart Plug, only needed for a plug that is not on the default port 9999 e.g. a fake plug from fake_kasa_plug.py",
+    )
+
+    argParser.add_argument(
+        "-collector",
+        required=False,
+        type=str,
+        metavar='<URL>',
+        help="URL of a fleet collector to report samples, decisions and plug outcomes to e.g. http://127.0.0.1:8470",
+    )
+
+    argParser.add_argument(
+        "-battery-source",
+        required=False,
+        type=str,
+        choices=BATTERY_SOURCES,
+        default='auto',
+        help="Where battery readings come from. 'auto' reads sysfs directly on Linux and uses psutil elsewhere, default: auto",
+    )
+
+    argParser.add_argument(
+        "-metrics-file",
+        required=False,
+        type=str,
+        metavar='<file path>',
+        help="File the monitor's metrics are written to in OpenMetrics text format after every battery check",
+    )
+
+    argParser.add_argument(
+        "-history-db",
+        required=False,
+        type=str,
+        metavar='<file path>',
+        help="SQLite database the monitor records battery samples, predictions, plug actions and alerts to, queried with bm.py history",
+    )
+
+    argParser.add_argument(
+        "-history-keep-raw",
+        required=False,
+        type=str,
+        default='1d',
+        metavar='<age>',
+        help="Age after which samples in the history database are rolled up into one row per minute, default: 1d",
+    )
+
+    argParser.add_argument(
+        "-history-keep-minutes",
+        required=False,
+        type=str,
+        default='30d',
+        metavar='<age>',
+        help="Age after which the per minute rows in the history database are rolled up into one row per hour, default: 30d",
+    )
+
+    argParser.add_argument(
+        "-history-keep-events",
+        required=False,
+        type=str,
+        default='30d',
+        metavar='<age>',
+        help="Age after which prediction and decision events are deleted from the history database (plug actions and alerts are kept), default: 30d",
+    )
+
+    argParser.add_argument(
+        "-pidfile",
+        required=False,
+        type=str,
+        metavar='<file path>',
+        help="File the monitor holds locked while it runs, read by bm.py status, default: battery_monitor.pid in the log directory",
+    )
+
+    argParser.add_argument(
+        "-metrics-port",
+        required=False,
+        type=int,
+        metavar='<port>',
+        help="Serve the monitor's metrics in OpenMetrics text format at http://127.0.0.1:<port>/metrics",
+    )
+
+    argParser.add_argument(
+        "-phase-budgets",
+        required=False,
+        type=str,
+        metavar='<phase>=<secs>,...',
+        help="Log a warning when a phase of a battery check takes longer than its budget e.g. plug_command=5,notify_email=20",
+    )
+
+    argParser.add_argument(
+        '--power-events',
+        '--power-events',
+        action='store_true',
+        help='Wake up and check the battery as soon as the laptop is plugged in or unplugged'
+    )
+
+    argParser.add_argument(
+        '--plug-timer',
+        '--plug-timer',
+        action='store_true',
+        help="While charging, keep the plug's own countdown timer set to switch it off when the battery is predicted to reach -max, so charging stops even if the laptop is asleep"
+    )
+
+    argParser.add_argument(
+        "-memory-check-period",
+        required=False,
+        type=str,
+        default='1h',
+        metavar='<check_period>',
+        help="How often the monitor's memory use is logged (and checked against -rss-ceiling) when --memory-diagnostics or -rss-ceiling is given, default: 1h",
+    )
+
+    argParser.add_argument(
+        "-rss-ceiling",
+        required=False,
+        type=int,
+        metavar='<MB>',
+        help="Restart the monitor, keeping what it has learned, if its resident memory is above this many megabytes at a memory check",
+    )
+
+    argParser.add_argument(
+        '--memory-diagnostics',
+        '--memory-diagnostics',
+        action='store_true',
+        help="Trace the monitor's allocations with tracemalloc and log its memory use and the allocation sites that have grown the most every -memory-check-period"
+    )
+
+    argParser.add_argument(
+        '--no-load-model',
+        '--no-load-model',
+        action='store_true',
+        help='Predict battery checks from the overall battery rate only, instead of the rate learned for the current CPU load and screen state'
+    )
+
     argParser.add_argument(
         '--nologs',
         '--nologs',
@@ -245,72 +521,156 @@ def make_arg_parser(configFirst=False):
 
     return argParser
 
-def gen_cli_args_from_config(configFile: str, sysArgs: list, useSysArgIfExists: bool=True) -> list:
+_argParser = None
+_argDefaults = None
+
+# absolute config path -> ((mtime, size), compiled config)
+_configCache = {}
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    '''
+    Returns the argument parser, it is only built once
+    '''
+    global _argParser, _argDefaults
+    if _argParser is None:
+        _argParser = make_arg_parser(configFirst=True)
+        _argDefaults = {a.dest: a.default for a in _argParser._actions if a.dest != 'help'}
+    return _argParser
+
+def compile_config(config: dict) -> dict:
     """
-    Generates the list of command line arguments from the JSON config fil
-    @param configFile: The JSON config file
-    @param sysArgs: The original command line argumentts
-    @param useSysArgIfExists: When true, if a command line flag is specified in the original set of arguments it will NOT be replaced by the one in the config file
-    @return:
+    Converts the flags in a JSON config into typed argument values, keyed by the name of the argument's attribute.
+    Values are converted and checked the same way as on the command line.
+    Inclusion flags that are set to false are left out, as if they were not specified.
     """
-    with open(configFile, 'r') as file:
-        config = json.load(file)
-
-    args = []
-    for key in config:
-        cmdLineFlag = key
-        if useSysArgIfExists and cmdLineFlag in sysArgs:
-            # Do not generate this argument if it exists in the system arguments
+    argParser = get_arg_parser()
+    flags = argParser._option_string_actions
+
+    values = {}
+    for key, value in config.items():
+        action = flags.get(key)
+        if action is None or action.dest == 'help':
+            raise ArgumentException(f'Unknown flag "{key}" in config file')
+
+        if action.nargs == 0:
+            # inclusion flags e.g. --headless
+            if not isinstance(value, bool):
+                raise ArgumentException(f'{key} must be true or false in config file, got {json.dumps(value)}')
+            if value:
+                values[action.dest] = action.const
             continue
 
-        if type(config[key]) == bool and config[key]:
-            args.append(cmdLineFlag)
-            continue
+        if isinstance(value, (dict, list)) or value is None:
+            raise ArgumentException(f'Invalid value for {key} in config file: {json.dumps(value)}')
 
-        args.append(cmdLineFlag)
-        args.append(str(config[key]))
+        try:
+            typed = action.type(str(value) if action.type is str else value) if action.type is not None else value
+        except (TypeError, ValueError):
+            raise ArgumentException(f'Invalid value for {key} in config file: {json.dumps(value)}')
 
-    return args
+        if isinstance(value, float) and action.type is int and typed != value:
+            raise ArgumentException(f'{key} must be an integer in config file, got {json.dumps(value)}')
 
-def parse_args() -> CommandLineArgs:
-    argParser = make_arg_parser(configFirst=True)
+        if action.choices is not None and typed not in action.choices:
+            raise ArgumentException(f'Invalid value for {key} in config file: {json.dumps(value)} (choose from {", ".join(map(str, action.choices))})')
 
-    # If config arg is available, translate to command line args
-    # Then parse again
-    args = argParser.parse_args()
-    if args.config is not None:
-        if not path.exists(args.config):
-            raise ArgumentException(f'Config file "{args.config}" does not exist!')
-        newArgs = gen_cli_args_from_config(args.config, sys.argv)
-        sys.argv += newArgs
+        values[action.dest] = typed
 
-    args = make_arg_parser().parse_args()
-    return CommandLineArgs(args)
+    return values
 
-def get_args_from_config_in_sysargs() -> CommandLineArgs:
+def load_config(configFile: str) -> dict:
     """
-    Returns set of arguments for -config in command line, and restores the original set of system arguments
+    Returns the compiled config (see `compile_config`) of a JSON config file.
+    Compiled configs are cached by file path and modification time, so loading an unchanged file again only costs a stat.
     """
-    sysArgs = list(sys.argv)
+    try:
+        stat = os.stat(configFile)
+    except OSError:
+        raise ArgumentException(f'Config file "{configFile}" does not exist!')
 
-    if '-config' not in sysArgs:
-        raise ArgumentException('-config not in arguments')
+    key = path.abspath(configFile)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _configCache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
 
-    ind = sysArgs.index('-config')
-    configFile = sysArgs[ind+1]
-    sysArgs.pop(ind+1)
-    sysArgs.pop(ind)
+    try:
+        with open(configFile, 'r') as file:
+            config = json.load(file)
+    except ValueError as e:
+        raise ArgumentException(f'Could not parse config file "{configFile}": {e}')
 
-    if not path.exists(configFile):
-        raise ArgumentException(f'Config file "{configFile}" does not exist!')
+    if not isinstance(config, dict):
+        raise ArgumentException(f'Config file "{configFile}" must contain a JSON object')
+
+    values = compile_config(config)
+    _configCache[key] = (version, values)
+    return values
+
+def find_config_arg(argv: list):
+    """
+    Returns the file given with -config in `argv`, or None
+    """
+    for i, arg in enumerate(argv):
+        if arg == '-config' and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith('-config='):
+            return arg[len('-config='):]
+    return None
+
+def parse_args(argv: list = None, exitOnError: bool = True) -> CommandLineArgs:
+    """
+    Parses the command line (`sys.argv` if `argv` is None) merged with the config file given with -config.
+    Arguments on the command line take precedence over the config file.
+    If not `exitOnError`, missing arguments raise an ArgumentException instead of exiting with the usage message.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    argParser = get_arg_parser()
+
+    # The parser only fills in defaults for attributes the namespace does not already have,
+    # so starting from the config's values merges config and command line in one parse
+    namespace = Namespace()
+    configFile = find_config_arg(argv)
+    if configFile is not None:
+        for dest, value in load_config(configFile).items():
+            setattr(namespace, dest, value)
+
+    args = argParser.parse_args(argv, namespace=namespace)
 
-    newArgs = gen_cli_args_from_config(configFile, [])
-    sys.argv = [sys.argv[0]] + newArgs
-    args = make_arg_parser().parse_args()
-    sys.argv = sysArgs
+    missing = [flag for flag in REQUIRED_ARGS if getattr(args, argParser._option_string_actions[flag].dest) is None]
+    if missing:
+        message = 'the following arguments are required: {}'.format(', '.join(missing))
+        if not exitOnError:
+            raise ArgumentException(message)
+        argParser.error(message)
 
     return CommandLineArgs(args)
 
+def load_config_args(configFile: str) -> CommandLineArgs:
+    """
+    Returns the arguments in a config file on their own (defaults for everything else), without parsing a command line
+    """
+    values = load_config(configFile)
+    get_arg_parser()
+    args = Namespace(**_argDefaults)
+    for dest, value in values.items():
+        setattr(args, dest, value)
+    args.config = configFile
+    return CommandLineArgs(args)
+
+def get_args_from_config_in_sysargs() -> CommandLineArgs:
+    """
+    Returns set of arguments for -config in command line. The rest of the command line is left to the calling script.
+    """
+    configFile = find_config_arg(sys.argv[1:])
+    if configFile is None:
+        raise ArgumentException('-config not in arguments')
+
+    return load_config_args(configFile)
+
 
 if __name__ == '__main__':
     parse_args()
\ No newline at end of file
@@ -82,13 +82,14 @@ class LoggingController:
     def createFileHandlers(self) -> tuple[RotatingFileHandler, RotatingFileHandler]:
         # Records are written to file using log format
         # Used by logger
-        logs_to_file = logging.handlers.RotatingFileHandler(self.logFileAddr, 'a')
+        # Files are only opened once a record is written to them (delay=True), so no file is created at import
+        logs_to_file = logging.handlers.RotatingFileHandler(self.logFileAddr, 'a', delay=True)
         logs_to_file.setFormatter(LoggingController.LOG_FORMAT)
 
         # Records are written to log file using console log format
         # Used by printer
         # Used by console when headless
-        console_file = logging.handlers.RotatingFileHandler(self.logFileAddr, 'a')
+        console_file = logging.handlers.RotatingFileHandler(self.logFileAddr, 'a', delay=True)
         console_file.setFormatter(LoggingController.CONSOLE_LOG_FORMAT)
 
         return logs_to_file, console_file
@@ -173,9 +174,14 @@ class LoggingController:
 
     def changeLogFile(self, newFileAddr):
         # Recreate log file handler and then reconfigure loggers
+        # The old handlers are closed once the loggers no longer use them, otherwise they keep their file open
+        oldHandlers = (self.hLogFile, self.hConsoleFile)
         self.logFileAddr = newFileAddr
         self.hLogFile, self.hConsoleFile = self.createFileHandlers()
         self.configureLoggers()
+        for h in oldHandlers:
+            if h is not None:
+                h.close()
 
     def getLogFile(self):
         return self.logFileAddr
@@ -3,11 +3,10 @@ import os
 import threading
 import typing
 
-import keyring
-from winsound import Beep as beep
+from scripts.BatterySource import read_battery
+from scripts.CredentialProvider import credentials
 
-import psutil
-from winotify import Notification
+# winsound and winotify are slow to import and rarely needed, so they are imported on first use
 
 script_loc_dir = os.path.split(os.path.realpath(__file__))[0]
 WIN_NOTIF_ICON = os.path.realpath(os.path.join(script_loc_dir, '..', 'roboticon.png'))
@@ -16,10 +15,12 @@ EMAIL_CREDENTIAL_STORE = 'Battery_Monitor_Email_Credentials'
 
 
 def send_notification(title, body):
+    from winotify import Notification
     toast = Notification('Battery Monitor Bot', title, msg=body, icon=WIN_NOTIF_ICON)
     toast.show()
 
 def error_notification(errorObj, logFilePath):
+    from winotify import Notification
     title = 'Headless Battery Monitor Failure'
     body = str(errorObj)
     logFilePath = os.path.abspath(logFilePath)
@@ -31,12 +32,13 @@ def error_notification(errorObj, logFilePath):
 
 
 def get_battery_info():
-    battery = psutil.sensors_battery()
+    battery = read_battery()
     return battery.percent, battery.power_plugged
 
 
 def do_beeps():
     # use winsound to generate beeps
+    from winsound import Beep as beep
     for _ in range(1):
         beep(750, 1000)
 
@@ -47,31 +49,46 @@ def do_beeps_threaded():
     x.start()
 
 def get_plug_password(plug_username) -> typing.Union[str, None]:
-    return keyring.get_password(PLUG_CREDENTIAL_STORE, plug_username)
+    return credentials.get(PLUG_CREDENTIAL_STORE, plug_username)
 
 def get_emailer_password(email_username) -> typing.Union[str, None]:
-    return keyring.get_password(EMAIL_CREDENTIAL_STORE, email_username)
+    return credentials.get(EMAIL_CREDENTIAL_STORE, email_username)
+
+def prefetch_credentials(plug_username=None, email_username=None):
+    '''
+    Looks up the plug and email credentials at the same time, so the lookups made while starting up are answered from memory.
+    '''
+    wanted = []
+    if plug_username is not None:
+        wanted.append((PLUG_CREDENTIAL_STORE, plug_username))
+    if email_username is not None:
+        wanted.append((EMAIL_CREDENTIAL_STORE, email_username))
+    credentials.prefetch(wanted)
 
 
 def get_log_format_str() -> str:
     return '%(filename)-25s [%(lineno)4d] %(asctime)s  %(levelname)-9s %(message)s'
 
+def get_log_date_format_str() -> str:
+    # Fixed width and largest unit first, so timestamps in the logs sort as strings (see LogIndex)
+    return '%Y-%m-%d %H:%M:%S'
+
 def get_console_log_format_str() -> str:
     st = get_log_format_str()
     return st.replace('%(levelname)-9s', 'CONSOLE  ')
 
 def get_log_format():
     return logging.Formatter(get_log_format_str(),
-                      datefmt='%Y-%m-%d %H:%M:%S')
+                      datefmt=get_log_date_format_str())
 
 def get_console_log_format():
     return logging.Formatter(get_console_log_format_str(),
-                             datefmt='%Y-%m-%d %H:%M:%S')
+                             datefmt=get_log_date_format_str())
 
 def get_log_stdout_format():
     # Formats logs so that they show up as yellow when printed to stdout
     set_console_yellow = "\033[0;33m"
     set_console_default = "\033[0m"
     return logging.Formatter(set_console_yellow + get_log_format_str() + set_console_default,
-                             datefmt='%Y-%m-%d %H:%M:%S')
+                             datefmt=get_log_date_format_str())
 
@@ -0,0 +1,7 @@
+"""
+Location of the unlock signal file, read by the sleep controller and written by battery_monitor_unlock_signal.py.
+
+Kept in a module of its own so the helper script can find the file without importing the monitor.
+"""
+
+UNLOCK_FILE = ''
@@ -22,7 +22,7 @@ def main():
     args = sys.argv[1:]
 
     if len(args) == 0 or args[0] in ('-h', '--help'):
-        print("<'on' or 'off'> [--no-tplink] [--no-pykasa]")
+        print("<'on' or 'off'> [--no-tplink] [--no-pykasa] [--no-network-check]")
         return 1
 
     plug_ip = config.plugIP
@@ -35,14 +35,19 @@ def main():
     plug_on = (plug_state == 'on')
     use_tplinkcmd = not ( '--no-tplink' in args )
     use_pykasa = not ( '--no-pykasa' in args)
+    check_network = not ( '--no-network-check' in args)
+
+    plug_password = get_plug_password(config.plugAccUsername)
 
     plc= SmartPlugController(
         config.plugIP,
         config.plugName,
         config.wifi,
-        tplink_creds=(config.plugAccUsername, get_plug_password(config.plugAccUsername)),
-        TPLinkAvail=get_plug_password(config.plugAccUsername) is not None,
-        logger=logger)
+        tplink_creds=(config.plugAccUsername, plug_password),
+        TPLinkAvail=plug_password is not None,
+        logger=logger,
+        plug_port=config.plugPort,
+        check_home_network=check_network)
 
     print("Setting Kasa SmartPlug '{}' to '{}'".format(plug_ip, plug_state))
 
@@ -0,0 +1,162 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if repo_dir not in sys.path:
+    sys.path.append(repo_dir)
+
+from scripts.HistoryStore import HistoryQuery, HistoryRetention, HistoryStoreException, connect
+
+"""
+Rolling samples up must not change what the history says: the rates, the sample counts and the mean percent are the
+same whether they are read from the samples or from their rollups. Routine events are deleted once old, plug actions
+and alerts never are.
+"""
+
+DAY = 86400
+
+
+def make_samples(days: int, seed: int = 1) -> list:
+    '''
+    Returns (t, percent, charging, energy_wh, power_w) rows every 30s to 7m over `days`, cycling between discharging
+    to 20% and charging to 80%, with a few gaps longer than a rate is measured across
+    '''
+    rand = random.Random(seed)
+    rows = []
+    t, percent, charging = 1_700_000_000.0, 80.0, False
+    end = t + days * DAY
+    while t < end:
+        rows.append((t, round(percent), int(charging), None, None))
+        step = rand.uniform(30, 420)
+        if rand.random() < 0.002:
+            # the monitor was off
+            step += 5 * 3600
+        t += step
+        percent += (step / 120) if charging else -(step / 300)
+        if not charging and percent <= 20:
+            charging = True
+        elif charging and percent >= 80:
+            charging = False
+        percent = min(100, max(0, percent))
+    return rows
+
+
+def make_events(samples: list) -> list:
+    '''
+    Returns (t, type, name, value, detail) rows for `samples`: a decision and a prediction at every sample,
+    and a plug action and an alert at every hundredth
+    '''
+    rows = []
+    for i, (t, percent, _, _, _) in enumerate(samples):
+        rows.append((t, 'decision', 'none', percent, None))
+        rows.append((t + 1, 'prediction', 'Calculated Prediction', 600, None))
+        if i % 100 == 0:
+            rows.append((t + 2, 'plug', 'turnOn', 1, None))
+            rows.append((t + 3, 'alert', 'low', 1, 'email'))
+    return rows
+
+
+class HistoryRetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'history.db')
+        self.conn = connect(self.path)
+        self.rows = make_samples(days=40)
+        self.events = make_events(self.rows)
+        with self.conn:
+            self.conn.executemany('INSERT INTO samples VALUES (?, ?, ?, ?, ?)', self.rows)
+            self.conn.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?)', self.events)
+        self.now = self.rows[-1][0] + 60
+
+    def tearDown(self):
+        self.conn.close()
+        self.dir.cleanup()
+
+    def query(self, fnc):
+        history = HistoryQuery(self.path)
+        try:
+            return fnc(history)
+        finally:
+            history.close()
+
+    def rates(self):
+        return self.query(lambda history: [history.rate(charging=charging) for charging in (False, True)])
+
+    def assertRatesEqual(self, before, after):
+        for (rateBefore, hoursBefore), (rateAfter, hoursAfter) in zip(before, after):
+            self.assertIsNotNone(rateBefore)
+            self.assertAlmostEqual(rateBefore, rateAfter, places=6)
+            self.assertAlmostEqual(hoursBefore, hoursAfter, places=6)
+
+    def retain(self, chunkSecs: float, runs: int = 1):
+        '''
+        Runs the retention `runs` times over the last `runs` days, as a monitor running through them would
+        '''
+        retention = HistoryRetention(keepRawSecs=DAY, keepMinutesSecs=7 * DAY, keepEventsSecs=3 * DAY, chunkSecs=chunkSecs)
+        for run in range(runs):
+            retention.run(self.conn, now=self.now - (runs - run - 1) * DAY)
+        return retention
+
+    def test_rates_unchanged(self):
+        before = self.rates()
+        retention = self.retain(chunkSecs=6 * 3600)
+
+        self.assertGreater(retention.samplesRolled, 0)
+        self.assertGreater(retention.minutesRolled, 0)
+        self.assertRatesEqual(before, self.rates())
+
+    def test_rates_unchanged_across_chunk_and_run_boundaries(self):
+        # chunks that are not whole minutes or hours split buckets between steps, which are then merged
+        before = self.rates()
+        self.retain(chunkSecs=1000, runs=10)
+        self.assertRatesEqual(before, self.rates())
+
+    def test_samples_counted_once(self):
+        self.retain(chunkSecs=1000, runs=3)
+
+        raw, rawSum = self.conn.execute('SELECT COUNT(*), TOTAL(percent) FROM samples').fetchone()
+        rolled, rolledSum = self.conn.execute('SELECT TOTAL(samples), TOTAL(percent_mean * samples) FROM rollups').fetchone()
+        self.assertEqual(raw + rolled, len(self.rows))
+        self.assertAlmostEqual(rawSum + rolledSum, sum(row[1] for row in self.rows), places=3)
+
+        minutes, hours = (self.conn.execute('SELECT COUNT(*) FROM rollups WHERE resolution = ?', (res,)).fetchone()[0] for res in (60, 3600))
+        self.assertGreater(minutes, 0)
+        self.assertGreater(hours, 0)
+
+        oldestRaw = self.conn.execute('SELECT MIN(t) FROM samples').fetchone()[0]
+        self.assertGreaterEqual(oldestRaw, self.now - DAY - 60)
+
+    def test_rerun_is_noop(self):
+        retention = self.retain(chunkSecs=6 * 3600)
+        steps = retention.steps
+        rollups = self.conn.execute('SELECT * FROM rollups ORDER BY resolution, t').fetchall()
+
+        retention.run(self.conn, now=self.now)
+        self.assertEqual(retention.steps, steps)
+        self.assertEqual(self.conn.execute('SELECT * FROM rollups ORDER BY resolution, t').fetchall(), rollups)
+
+    def test_routine_events_deleted(self):
+        retention = self.retain(chunkSecs=1000, runs=3)
+
+        cutoff = self.now - 3 * DAY
+        kept = self.conn.execute('SELECT * FROM events ORDER BY t').fetchall()
+        expected = sorted(row for row in self.events if row[0] >= cutoff or row[1] in ('plug', 'alert'))
+        self.assertEqual(kept, expected)
+        self.assertEqual(retention.eventsDeleted, len(self.events) - len(expected))
+
+        alerts = self.query(lambda history: history.events('alert'))
+        self.assertEqual(len(alerts), sum(1 for row in self.events if row[1] == 'alert'))
+
+    def test_keep_minutes_shorter_than_raw(self):
+        with self.assertRaises(HistoryStoreException):
+            HistoryRetention(keepRawSecs=DAY, keepMinutesSecs=3600)
+        with self.assertRaises(HistoryStoreException):
+            HistoryRetention(keepEventsSecs=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if repo_dir not in sys.path:
+    sys.path.append(repo_dir)
+
+from scripts.LogIndex import LogIndex, time_key
+from scripts.functions import get_log_format
+
+"""
+Range queries through the sparse index must return exactly the lines a full scan of the logs would.
+"""
+
+START = datetime(2024, 5, 14, 3, 0, 0)
+
+# Small enough that every file has many index entries
+STRIDE_BYTES = 512
+
+
+def log_line(when: datetime, message: str) -> str:
+    record = logging.LogRecord('test', logging.INFO, 'battery_monitor.py', 10, message, None, None)
+    record.created = when.timestamp()
+    return get_log_format().format(record) + '\n'
+
+
+def write_log(path: str, first: int, count: int, mode: str = 'w'):
+    '''
+    Writes a record every 10 seconds from `first`*10 seconds after START, every fifth with a traceback after it
+    '''
+    with open(path, mode) as file:
+        for i in range(first, first + count):
+            file.write(log_line(START + timedelta(seconds=10 * i), f'record {i}'))
+            if i % 5 == 0:
+                file.write('Traceback (most recent call last):\n  File "x.py", line 1\nValueError: record {}\n'.format(i))
+
+
+class LogIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.logDir = self.dir.name
+        # the rotated file holds the older records
+        write_log(os.path.join(self.logDir, 'status.log.1'), 0, 300)
+        write_log(os.path.join(self.logDir, 'status.log'), 300, 300)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def at(self, i: int) -> str:
+        return time_key(START + timedelta(seconds=10 * i))
+
+    def scan(self, since: str = None, until: str = None) -> list:
+        '''
+        Lines of the records between `since` and `until` found by reading every file
+        '''
+        index = LogIndex(self.logDir, strideBytes=STRIDE_BYTES)
+        lines = []
+        for name in ('status.log.1', 'status.log'):
+            inRange = False
+            with open(os.path.join(self.logDir, name), 'rb') as file:
+                for line in file:
+                    match = index.pattern.match(line)
+                    if match is not None:
+                        timestamp = match.group(1).decode()
+                        inRange = (since is None or timestamp >= since) and (until is None or timestamp <= until)
+                    if inRange:
+                        lines.append((name, line.decode()))
+        return lines
+
+    def query(self, since: str = None, until: str = None) -> list:
+        return list(LogIndex(self.logDir, strideBytes=STRIDE_BYTES).query(since, until))
+
+    def test_ranges_match_scan(self):
+        for since, until in ((None, None), (self.at(0), self.at(0)), (self.at(37), self.at(123)), (self.at(250), self.at(350)),
+                             (self.at(299), self.at(300)), (None, self.at(42)), (self.at(555), None)):
+            with self.subTest(since=since, until=until):
+                self.assertEqual(self.query(since, until), self.scan(since, until))
+
+    def test_bounds_are_inclusive(self):
+        lines = [line for _, line in self.query(self.at(10), self.at(20))]
+        self.assertIn('record 10', lines[0])
+        self.assertTrue(any('record 20' in line for line in lines))
+        # the traceback after record 20 belongs to it
+        self.assertEqual(lines[-1], 'ValueError: record 20\n')
+
+    def test_range_between_records(self):
+        # a range that falls between two records, before all of them and after all of them
+        between = time_key(START + timedelta(seconds=10 * 42 + 3))
+        self.assertEqual(self.query(between, between), [])
+        self.assertEqual(self.query(until=time_key(START - timedelta(days=1))), [])
+        self.assertEqual(self.query(since=time_key(START + timedelta(days=1))), [])
+
+    def test_appended_records(self):
+        self.query()
+        write_log(os.path.join(self.logDir, 'status.log'), 600, 50, mode='a')
+        self.assertEqual(self.query(self.at(590), self.at(620)), self.scan(self.at(590), self.at(620)))
+
+    def test_replaced_file(self):
+        self.query()
+        # rotated: the current file starts again with newer records and is shorter than before
+        os.replace(os.path.join(self.logDir, 'status.log'), os.path.join(self.logDir, 'status.log.1'))
+        write_log(os.path.join(self.logDir, 'status.log'), 600, 20)
+        self.assertEqual(self.query(self.at(250), self.at(610)), self.scan(self.at(250), self.at(610)))
+
+    def test_empty_file(self):
+        open(os.path.join(self.logDir, 'empty.log'), 'w').close()
+        self.assertEqual(self.query(self.at(0), self.at(5)), self.scan(self.at(0), self.at(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
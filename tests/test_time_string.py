@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if repo_dir not in sys.path:
+    sys.path.append(repo_dir)
+
+from scripts.TimeString import TimeString, TimeStringException
+
+
+class TimeStringParseTest(unittest.TestCase):
+
+    def test_units(self):
+        cases = {
+            '30s': 30, '1m': 60, '3h': 10800, '1d': 86400,
+            '1m 25s': 85, '3h30s': 10830, '2h30m16s': 9016, '1d 2h': 93600, '1d2h3m4s': 93784,
+            '2hrs 3mins 2secs': 7382, '2hours 3minutes 2seconds': 7382, '1 day': 86400, '1H 1M': 3660, ' 1h ': 3600,
+        }
+        for timestr, secs in cases.items():
+            with self.subTest(timestr=timestr):
+                self.assertEqual(TimeString.parse(timestr), secs)
+
+    def test_fractions(self):
+        self.assertEqual(TimeString.parse('1.5h'), 5400)
+        self.assertIsInstance(TimeString.parse('1.5h'), int)
+        self.assertEqual(TimeString.parse('.5m'), 30)
+        self.assertEqual(TimeString.parse('0.5s'), 0.5)
+        self.assertEqual(TimeString.parse('1.25s'), 1.25)
+
+    def test_invalid(self):
+        for timestr in ('', ' ', 'abc', '10', '5x', '-1h', '1h1h', '30s 1m', '1.2.3s', 'h'):
+            with self.subTest(timestr=timestr):
+                with self.assertRaises(TimeStringException):
+                    TimeString.parse(timestr)
+
+    def test_not_a_string(self):
+        for value in (None, 30, 1.5):
+            with self.subTest(value=value):
+                with self.assertRaises(TimeStringException):
+                    TimeString.parse(value)
+
+    def test_make_round_trip(self):
+        for secs in (1, 59, 60, 61, 3599, 3600, 3661, 86400 + 61):
+            with self.subTest(secs=secs):
+                self.assertEqual(TimeString.parse(TimeString.make(secs)), secs)
+
+
+if __name__ == '__main__':
+    unittest.main()